@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""Benchmark the GEM map filters of the filter pipeline.
+
+The native `gt.filter | gt.filter | pigz` chain, used by default, is timed
+against the grape streaming map filter enabled with ``--fast-filter``
+(:py:mod:`grape.mapfilter`). Both filter the same uncompressed map file,
+as written by `gt.quality`, with the same maximum edit distance and number
+of matches, and compress the output with the same number of threads.
+
+A real map file should be given with ``-i`` for representative numbers,
+gzipped or not. Without it, a map file with simulated paired end reads is
+written with :py:func:`grape.simulate.map_lines`. The native tools are
+taken from ``--bin`` or the PATH and skipped when they are not found.
+
+For each filter the best wall clock time of the runs, the input
+throughput and the output size are reported, as well as whether the
+uncompressed outputs are identical.
+
+Usage::
+
+    python benchmarks/bench_filter.py [-i <map>] [-n <reads>] [-t <threads>]
+                                      [--bin <folder>] [-r <runs>]
+                                      [-o <output>]
+"""
+import os
+import sys
+import json
+import time
+import gzip
+import shutil
+import hashlib
+import tempfile
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+#: the default number of simulated reads
+READS = 1000000
+
+
+def find_binary(name, folder=None):
+    """Return the path to a binary in the given folder or the PATH, or None
+    if it is not found"""
+    folders = [folder] if folder else \
+        os.environ.get('PATH', '').split(os.pathsep)
+    for f in folders:
+        path = os.path.join(f, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def write_map(path, reads):
+    """Write a map file with simulated reads"""
+    from grape.simulate import map_lines
+    with open(path, 'w') as f:
+        f.writelines(map_lines('bench', reads))
+
+
+def prepare_input(input, folder, reads):
+    """Return an uncompressed map file: the given file, decompressed if
+    needed, or a simulated one"""
+    path = os.path.join(folder, 'input.map')
+    if input is None:
+        write_map(path, reads)
+    elif input.endswith('.gz'):
+        with gzip.open(input) as src:
+            with open(path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+    else:
+        return input
+    return path
+
+
+def native_command(input, output, max_error, max_matches, threads, bins):
+    return "%s -t %d --max-levenshtein-error %d -i %s | " \
+           "%s -t %d --max-matches %d | %s -p %d > %s" % (
+               bins['gt.filter'], threads, max_error, input,
+               bins['gt.filter'], threads, max_matches,
+               bins['pigz'], threads, output)
+
+
+def fast_command(input, output, max_error, max_matches, threads, bins):
+    return "%s -m grape.mapfilter -i %s -o %s -z -t %d " \
+           "--max-levenshtein-error %d --max-matches %d" % (
+               sys.executable, input, output, threads, max_error,
+               max_matches)
+
+
+#: the benchmarked filters and the binaries they need
+FILTERS = [
+    ('native', native_command, ['gt.filter', 'pigz']),
+    ('fast', fast_command, []),
+]
+
+
+def checksum(path):
+    """Return the MD5 checksum of the uncompressed content of a gzip file"""
+    md5 = hashlib.md5()
+    with gzip.open(path) as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def timed(command, runs):
+    """Run a shell command and return the best wall clock time"""
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + [p for p in [env.get('PYTHONPATH')] if p])
+    best = None
+    for i in range(runs):
+        start = time.time()
+        subprocess.check_call(['bash', '-o', 'pipefail', '-c', command],
+                              env=env)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(input, folder, max_error, max_matches, threads, bins, runs):
+    """Run the benchmarks and return the list of results"""
+    size = os.path.getsize(input)
+    results = []
+    for name, command, needed in FILTERS:
+        result = {'filter': name, 'input_bytes': size, 'threads': threads}
+        missing = [b for b in needed if not bins.get(b)]
+        if missing:
+            result['skipped'] = "%s not found" % ", ".join(missing)
+        else:
+            output = os.path.join(folder, '%s.map.gz' % name)
+            result['seconds'] = timed(command(input, output, max_error,
+                                              max_matches, threads, bins),
+                                      runs)
+            result['mb_per_second'] = size / 1024.0 ** 2 / result['seconds']
+            result['output_bytes'] = os.path.getsize(output)
+            result['md5'] = checksum(output)
+        print_result(result)
+        results.append(result)
+    done = [r for r in results if 'md5' in r]
+    if len(done) > 1:
+        same = len(set(r['md5'] for r in done)) == 1
+        print "Outputs identical: %s" % ("yes" if same else "no")
+    return results
+
+
+def print_result(result):
+    line = "%-8s" % result['filter']
+    if 'seconds' not in result:
+        line += " skipped (%s)" % result['skipped']
+    else:
+        line += "%10.3fs %8.1f MB/s %12d bytes" % (
+            result['seconds'], result['mb_per_second'],
+            result['output_bytes'])
+    print line
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument("-i", "--input", default=None,
+                        help="The map file, gzipped or not. Default: a "
+                             "map file with simulated reads")
+    parser.add_argument("-n", "--reads", type=int, default=READS,
+                        help="The number of simulated reads. Default: %d"
+                             % READS)
+    parser.add_argument("-t", "--threads", type=int, default=4,
+                        help="The number of threads. Default: 4")
+    parser.add_argument("-m", "--max-mismatches", dest="max_error",
+                        type=int, default=4,
+                        help="The maximum number of edit operations. "
+                             "Default: 4")
+    parser.add_argument("--max-matches", dest="max_matches", type=int,
+                        default=10,
+                        help="The maximum number of matches. Default: 10")
+    parser.add_argument("--bin", default=None,
+                        help="The folder with the gt.filter and pigz "
+                             "binaries. Default: the PATH")
+    parser.add_argument("-r", "--runs", type=int, default=3,
+                        help="The number of runs of each filter. "
+                             "Default: 3")
+    parser.add_argument("-o", "--output", default=None,
+                        help="Write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    bins = dict((b, find_binary(b, args.bin)) for b in ['gt.filter', 'pigz'])
+    folder = tempfile.mkdtemp(prefix='grape.bench.')
+    try:
+        input = prepare_input(args.input, folder, args.reads)
+        results = run(input, folder, args.max_error, args.max_matches,
+                      args.threads, bins, args.runs)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': sys.version.split()[0],
+                       'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'results': results}, f, indent=1)
+        print "Results written to %s" % args.output
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+"""Benchmark the project operations on synthetic projects.
+
+For each project size a synthetic project is created with
+:py:mod:`synthetic` and the following operations are timed:
+
+- ``load``: :py:meth:`grape.grape.Project.load`
+- ``scan``: ``grape scan`` on a project with unindexed FASTQ files
+- ``list``: ``grape list``
+- ``export``: ``grape export``
+- ``import``: ``grape import`` of an index file with all the datasets
+- ``jip_prepare``: the creation of the pipeline jobs
+- ``on_success``: the index update done after each successful job
+
+The results are written as JSON, so runs on different commits can be
+compared with ``--compare``. Nothing but the grape dependencies is needed;
+the GRAPE_HOME used to create the jobs has the simulated tool modules.
+
+Usage::
+
+    python benchmarks/bench_project.py [-s <sizes>] [-b <benchmarks>]
+                                       [-o <output>] [--compare <results>]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import synthetic
+
+#: the default project sizes
+SIZES = [10, 1000, 100000]
+
+
+@contextmanager
+def cwd(path):
+    """Change the working directory"""
+    old = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(old)
+
+
+@contextmanager
+def quiet():
+    """Discard the standard output, also of the writers that keep a
+    reference to the original stream"""
+    sys.stdout.flush()
+    fd = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(fd, 1)
+        os.close(fd)
+        os.close(devnull)
+
+
+def parse_args(command, argv):
+    """Parse the command line arguments of a grape command"""
+    parser = argparse.ArgumentParser()
+    command.add(parser)
+    return parser.parse_args(argv)
+
+
+def timed(fun, *args):
+    """Call a function quietly and return the elapsed time"""
+    with quiet():
+        start = time.time()
+        fun(*args)
+        return time.time() - start
+
+
+def bench_load(path, n):
+    from grape.grape import Project
+    project = synthetic.create_project(os.path.join(path, 'load'), n)
+    return timed(Project(project.path).load)
+
+
+def bench_scan(path, n):
+    from grape.commands import ScanCommand
+    project = synthetic.create_project(os.path.join(path, 'scan'), n,
+                                       indexed=False)
+    command = ScanCommand()
+    with cwd(project.path):
+        return timed(command.run, parse_args(command, []))
+
+
+def bench_list(path, n):
+    from grape.commands import ListDataCommand
+    project = synthetic.create_project(os.path.join(path, 'list'), n)
+    command = ListDataCommand()
+    with cwd(project.path):
+        return timed(command.run, parse_args(command, []))
+
+
+def bench_export(path, n):
+    from grape.commands import ExportCommand
+    project = synthetic.create_project(os.path.join(path, 'export'), n)
+    command = ExportCommand()
+    with cwd(project.path):
+        return timed(command.run, parse_args(command, ['-o', os.devnull]))
+
+
+def bench_import(path, n):
+    from grape.commands import ImportCommand
+    project = synthetic.create_project(os.path.join(path, 'import'), 0)
+    datasets = synthetic.write_fastqs(os.path.join(path, 'incoming'), n)
+    index = os.path.join(path, 'incoming.index')
+    synthetic.write_index(index, datasets)
+    command = ImportCommand()
+    with cwd(project.path):
+        return timed(command.run, parse_args(command, [index]))
+
+
+def bench_jip_prepare(path, n):
+    from grape.cli import utils
+    from grape.commands import RunCommand
+    project = synthetic.create_project(os.path.join(path, 'jip_prepare'), n)
+    args = parse_args(RunCommand(), [])
+    with cwd(project.path):
+        project, datasets = utils.get_project_and_datasets(args)
+        return timed(utils.jip_prepare, args, False, project, datasets)
+
+
+def bench_on_success(path, n):
+    from grape.grapeindex import _OnSuccessListener
+    project = synthetic.create_project(os.path.join(path, 'on_success'), n)
+    bam = os.path.join(project.folder('data'), '%s.bam' %
+                       synthetic.dataset_id(0))
+    open(bam, 'w').close()
+
+    class Tool(object):
+        def __init__(self):
+            self.outputs = ['bam']
+
+    listener = _OnSuccessListener(project.path, {
+        'bam': bam, 'view': {'bam': 'Alignments'}})
+    return timed(listener, Tool(), None)
+
+
+#: the benchmarks with the largest project size they run on by default
+BENCHMARKS = [
+    ('load', bench_load, None),
+    ('scan', bench_scan, None),
+    ('list', bench_list, None),
+    ('export', bench_export, None),
+    ('import', bench_import, None),
+    ('jip_prepare', bench_jip_prepare, 100),
+    ('on_success', bench_on_success, None),
+]
+
+
+def commit():
+    """Return the current git commit or None"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, names=None, limits=True):
+    """Run the benchmarks and return the list of results
+
+    :param sizes: the project sizes
+    :param names: the names of the benchmarks to run. Default: all
+    :param limits: skip the benchmarks on projects larger than their
+        default maximum size
+    """
+    results = []
+    for n in sizes:
+        for name, bench, max_size in BENCHMARKS:
+            if names and name not in names:
+                continue
+            result = {'benchmark': name, 'datasets': n}
+            if limits and max_size is not None and n > max_size:
+                result['skipped'] = "more than %d datasets" % max_size
+            else:
+                path = tempfile.mkdtemp(prefix='grape.bench.')
+                try:
+                    result['seconds'] = bench(path, n)
+                finally:
+                    shutil.rmtree(path, ignore_errors=True)
+            print_result(result)
+            results.append(result)
+    return results
+
+
+def print_result(result, previous=None):
+    line = "%-12s %8d " % (result['benchmark'], result['datasets'])
+    if 'seconds' not in result:
+        line += " skipped (%s)" % result['skipped']
+    else:
+        line += "%10.3fs" % result['seconds']
+        if previous and previous.get('seconds'):
+            line += " %6.2fx" % (result['seconds'] / previous['seconds'])
+    print line
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument("-s", "--sizes", default=",".join(map(str, SIZES)),
+                        help="Comma separated list of project sizes. "
+                             "Default: %s" % ",".join(map(str, SIZES)))
+    parser.add_argument("-b", "--benchmarks", default=None,
+                        help="Comma separated list of the benchmarks to "
+                             "run: %s. Default: all" %
+                             ", ".join(b[0] for b in BENCHMARKS))
+    parser.add_argument("--no-limits", dest="limits", default=True,
+                        action="store_false",
+                        help="Run the benchmarks on all sizes, also the "
+                             "ones that take hours on large projects")
+    parser.add_argument("-o", "--output", default=None,
+                        help="The JSON results file. Default: "
+                             "benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", default=None,
+                        help="A previous results file to compare with")
+    args = parser.parse_args(argv)
+
+    home = tempfile.mkdtemp(prefix='grape.home.')
+    try:
+        os.environ['GRAPE_HOME'] = home
+        synthetic.create_home(home)
+        sizes = [int(s) for s in args.sizes.split(",")]
+        names = args.benchmarks.split(",") if args.benchmarks else None
+        report = {
+            'commit': commit(),
+            'python': sys.version.split()[0],
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': run(sizes, names, limits=args.limits),
+        }
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+    output = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'results',
+        '%s.json' % (report['commit'] or 'local'))
+    if not os.path.exists(os.path.dirname(os.path.abspath(output))):
+        os.makedirs(os.path.dirname(os.path.abspath(output)))
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print "Results written to %s" % output
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = dict(((r['benchmark'], r['datasets']), r)
+                            for r in json.load(f)['results'])
+        print "Compared with %s" % args.compare
+        for result in report['results']:
+            print_result(result, previous.get((result['benchmark'],
+                                               result['datasets'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""Benchmark the job creation throughput of the default pipeline with and
+without the template cache.
+
+The jobs are created in batches of samples, each batch in its own pipeline,
+so the time measured is the time spent creating the jobs and not the time
+jip needs to merge the jobs shared by all the samples of a single pipeline.
+No input files are needed; a temporary GRAPE_HOME with the simulated tool
+modules is created for the run.
+
+Usage::
+
+    python benchmarks/bench_templates.py [-n <samples>] [-b <batch>]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import synthetic
+
+
+def create_jobs(samples, batch):
+    """Create the jobs of the default pipeline for the given number of
+    samples and return the number of jobs and the elapsed time"""
+    import jip
+    import jip.jobs
+    count = 0
+    start = time.time()
+    for first in range(0, samples, batch):
+        p = jip.Pipeline()
+        p.run('grape_gem_rnapipeline',
+              fastq=['/data/sample%d_1.fastq.gz' % i
+                     for i in range(first, min(samples, first + batch))],
+              genome='/ref/genome.fa', annotation='/ref/annotation.gtf',
+              threads=4, max_mismatches=4, max_matches=10)
+        count += len(jip.jobs.create_jobs(p, validate=False))
+    return count, time.time() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument("-n", "--samples", type=int, default=10000,
+                        help="The number of samples. Default: 10000")
+    parser.add_argument("-b", "--batch", type=int, default=10,
+                        help="The number of samples per pipeline. "
+                             "Default: 10")
+    args = parser.parse_args(argv)
+
+    home = tempfile.mkdtemp(prefix='grape.bench.')
+    try:
+        os.environ['GRAPE_HOME'] = home
+        import jip
+        from grape.templates import install, uninstall
+        synthetic.create_home(home)
+        jip.db.init(os.path.join(home, 'jip.db'))
+
+        results = {}
+        for name, setup in [('cached', install), ('uncached', uninstall)]:
+            setup()
+            jobs, elapsed = create_jobs(args.samples, args.batch)
+            results[name] = elapsed
+            print "%-10s %6d samples %8d jobs %9.1fs %9.1f jobs/s" % (
+                name, args.samples, jobs, elapsed, jobs / elapsed)
+        print "speedup    %.2fx" % (results['uncached'] / results['cached'])
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""Create synthetic grape projects for the benchmarks.
+
+A synthetic project has a given number of paired end datasets. Each dataset
+has two small FASTQ stubs in the project data folder and some metadata in
+the project index. Genome and annotation stubs are created in a `refs`
+folder and set in the project configuration. No real data or tools are
+needed.
+
+Usage::
+
+    python benchmarks/synthetic.py -n <datasets> <path>
+"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+#: the content of the FASTQ stubs
+FASTQ = "@read/%d\nACGTACGTAC\n+\nIIIIIIIIII\n"
+
+#: the metadata values cycled over the datasets
+METADATA = {
+    'sex': ['female', 'male'],
+    'tissue': ['brain', 'liver', 'heart', 'lung'],
+    'quality': ['33'],
+    'readType': ['2x76'],
+}
+
+
+def dataset_id(i):
+    """Return the id of the i-th dataset"""
+    return "sample%06d" % i
+
+
+def write_fastqs(folder, n, first=0):
+    """Write the paired FASTQ stubs of `n` datasets to a folder and return
+    the list of (id, [mate1, mate2]) tuples
+
+    :param folder: the folder
+    :param n: the number of datasets
+    :param first: the index of the first dataset
+    """
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    datasets = []
+    for i in range(first, first + n):
+        id = dataset_id(i)
+        files = []
+        for mate in [1, 2]:
+            path = os.path.join(folder, "%s_%d.fastq" % (id, mate))
+            with open(path, 'w') as f:
+                f.write(FASTQ % mate)
+            files.append(path)
+        datasets.append((id, files))
+    return datasets
+
+
+def index_lines(datasets):
+    """Return the project index lines for the given datasets"""
+    lines = []
+    for i, (id, files) in enumerate(datasets):
+        meta = "".join(" %s=%s;" % (k, v[i % len(v)])
+                       for k, v in sorted(METADATA.items()))
+        for mate, path in enumerate(files):
+            lines.append("%s\ttype=fastq; view=FqRd%d; id=%s;%s\n" % (
+                path, mate + 1, id, meta))
+    return lines
+
+
+def write_index(path, datasets):
+    """Write an index file for the given datasets"""
+    with open(path, 'w') as f:
+        f.writelines(index_lines(datasets))
+
+
+def create_home(path):
+    """Create a GRAPE_HOME with the simulated tool modules, so the pipeline
+    jobs can be created and run without the real tools
+
+    :param path: the GRAPE_HOME folder
+    """
+    from grape.simulate import install
+    install(path)
+
+
+def create_project(path, n, indexed=True):
+    """Create a synthetic project with `n` paired end datasets and return
+    it
+
+    :param path: the project folder
+    :param n: the number of datasets
+    :param indexed: add the datasets to the project index. If False, the
+        FASTQ files are only written to the data folder, e.g. for `scan`
+    """
+    from grape.grape import Project
+    if not os.path.exists(path):
+        os.makedirs(path)
+    project = Project(path)
+    project.initialize()
+    refs = os.path.join(path, 'refs')
+    os.makedirs(refs)
+    for name in ['genome.fa', 'annotation.gtf']:
+        open(os.path.join(refs, name), 'w').close()
+    project.config.set('genome', os.path.join(refs, 'genome.fa'),
+                       commit=True)
+    project.config.set('annotation', os.path.join(refs, 'annotation.gtf'),
+                       commit=True)
+    datasets = write_fastqs(project.folder('data'), n)
+    if indexed:
+        write_index(project.indexfile, datasets)
+    return project
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument("-n", "--datasets", type=int, default=10,
+                        help="The number of datasets. Default: 10")
+    parser.add_argument("--no-index", dest="indexed", default=True,
+                        action="store_false",
+                        help="Do not add the datasets to the project index")
+    parser.add_argument("path", help="The project folder")
+    args = parser.parse_args(argv)
+    create_project(args.path, args.datasets, indexed=args.indexed)
+
+
+if __name__ == '__main__':
+    main()
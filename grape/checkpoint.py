@@ -0,0 +1,451 @@
+"""Grape job checkpoints
+
+A checkpoint is recorded for each job that finished successfully. It is
+stored as a JSON file in the project `.grape/checkpoints` folder and holds
+the job command parameters and their hash, the versions of the modules
+used by the job tool and the size, modification time and hash of the job
+input and output files.
+
+A job is complete only if its checkpoint exists, its command parameters did
+not change and its output files match the recorded ones. Before a job runs
+or is submitted, its checkpoint is replaced by a `partial` marker, so the
+partial outputs of interrupted jobs are never treated as complete. Changed
+input files invalidate the job, and all the jobs depending on a job that
+runs again are run again too. In incremental mode, jobs whose tool module
+versions changed are invalidated as well.
+
+Jobs that have neither a checkpoint nor a partial marker, e.g. jobs that
+finished before the project used checkpoints, are complete if all their
+output files exist. Their checkpoint is created from the current files the
+first time they are checked.
+
+To keep the validation cheap, files are hashed from their size and their
+first and last :py:data:`HASH_BLOCK` bytes.
+"""
+import os
+import json
+import hashlib
+
+#: the number of bytes hashed at the start and at the end of a file
+HASH_BLOCK = 1024 * 1024
+
+#: the tool options that only set the resources of a job and are not part
+#: of the command hash
+RESOURCE_OPTIONS = ['threads', 'max_memory', 'tmp_dir']
+
+#: the maximum number of job names looked up in one jip database query
+SYNC_BATCH = 500
+
+
+def quick_hash(path, block=HASH_BLOCK):
+    """Return the MD5 hash of the size, the first and the last `block`
+    bytes of a file
+
+    :param path: the file path
+    :param block: the number of bytes read at the start and the end
+    """
+    md5 = hashlib.md5()
+    size = os.path.getsize(path)
+    md5.update(str(size))
+    with open(path, 'rb') as f:
+        md5.update(f.read(block))
+        if size > block:
+            f.seek(max(block, size - block))
+            md5.update(f.read(block))
+    return md5.hexdigest()
+
+
+def file_info(path):
+    """Return the checkpoint information of a file or None if the file
+    does not exist
+
+    :param path: the file path
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'hash': quick_hash(path),
+    }
+
+
+def same_file(path, info):
+    """Return True if a file matches its checkpoint information. The file
+    is hashed only if its modification time changed.
+
+    :param path: the file path
+    :param info: the recorded file information
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    if stat.st_size != info.get('size'):
+        return False
+    if stat.st_mtime == info.get('mtime'):
+        return True
+    return quick_hash(path) == info.get('hash')
+
+
+def _value(value):
+    if isinstance(value, (list, tuple)):
+        return [_value(v) for v in value]
+    if value is None or isinstance(value, (basestring, bool, int, long,
+                                           float)):
+        return value
+    # streams
+    return '<stream>'
+
+
+def job_files(job, kind):
+    """Return the sorted absolute paths of the input or output files of a
+    job
+
+    :param job: the job
+    :param kind: `input` or `output`
+    """
+    files = job.get_input_files() if kind == 'input' else \
+        job.get_output_files()
+    return sorted(set(os.path.abspath(f) for f in files))
+
+
+def job_key(job):
+    """Return the checkpoint key of a job, computed from the job name and
+    the job output files
+
+    :param job: the job
+    """
+    sha = hashlib.sha1(job.name or '')
+    for path in job_files(job, 'output'):
+        sha.update('\n' + path)
+    return sha.hexdigest()
+
+
+def command_hash(job):
+    """Return the hash of the tool name and the tool option values of a
+    job. The :py:data:`RESOURCE_OPTIONS` are not included, so planning
+    different resources does not invalidate a job.
+
+    :param job: the job
+    """
+    params = [job.tool_name]
+    for option in job.tool.options:
+        if option.name in RESOURCE_OPTIONS:
+            continue
+        params.append([option.name, _value(option.raw())])
+    return hashlib.sha1(json.dumps(params, sort_keys=True)).hexdigest()
+
+
+def job_parameters(job):
+    """Return a dictionary with the tool option values of a job, without
+    the :py:data:`RESOURCE_OPTIONS`
+
+    :param job: the job
+    """
+    return dict((option.name, _value(option.raw()))
+                for option in job.tool.options
+                if option.name not in RESOURCE_OPTIONS)
+
+
+def tool_modules(job):
+    """Return the sorted list of the modules used by the tool of a job as
+    `name/version` strings
+
+    :param job: the job
+    """
+    modules = getattr(getattr(job.tool, 'instance', None), 'modules', None)
+    if not isinstance(modules, (list, tuple)):
+        return []
+    return sorted("/".join(m) if isinstance(m, (list, tuple)) else str(m)
+                  for m in modules)
+
+
+def group_jobs(job):
+    """Return the jobs that run together with a job, that is the job and
+    the jobs it streams its output to
+
+    :param job: the first job of the group
+    """
+    jobs = [job]
+    for j in jobs:
+        for child in getattr(j, 'pipe_to', None) or []:
+            if child not in jobs:
+                jobs.append(child)
+    return jobs
+
+
+class Checkpoints(object):
+    """The checkpoint records of a project
+
+    :param path: the checkpoints folder
+    :param incremental: invalidate the jobs whose tool module versions
+        changed
+    """
+
+    def __init__(self, path, incremental=False):
+        self.path = path
+        self.incremental = incremental
+        self._complete = {}
+
+    @classmethod
+    def open(cls, project, incremental=False):
+        """Return the checkpoints of a project
+
+        :param project: the project
+        :param incremental: invalidate the jobs whose tool module versions
+            changed
+        """
+        return cls(project.checkpoints, incremental=incremental)
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.json')
+
+    def _marker(self, key):
+        return os.path.join(self.path, key + '.partial')
+
+    def get(self, job):
+        """Return the checkpoint record of a job or None
+
+        :param job: the job
+        """
+        path = self._file(job_key(job))
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except ValueError:
+            return None
+
+    def record(self, job):
+        """Record the checkpoint of a finished job. The record is written to
+        a temporary file and moved in place.
+
+        :param job: the job
+        """
+        record = {
+            'name': job.name,
+            'tool': job.tool_name,
+            'command': command_hash(job),
+            'parameters': job_parameters(job),
+            'modules': tool_modules(job),
+            'inputs': {},
+            'outputs': {},
+        }
+        for kind in ['input', 'output']:
+            for path in job_files(job, kind):
+                info = file_info(path)
+                if info is not None:
+                    record[kind + 's'][path] = info
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        target = self._file(job_key(job))
+        tmp = "%s.%d" % (target, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(record, f, indent=1, sort_keys=True)
+        os.rename(tmp, target)
+        _remove(self._marker(job_key(job)))
+        self._complete.pop(job, None)
+        return record
+
+    def remove(self, job):
+        """Remove the checkpoint of a job
+
+        :param job: the job
+        """
+        _remove(self._file(job_key(job)))
+        self._complete.pop(job, None)
+
+    def start(self, job):
+        """Replace the checkpoint of a job that is about to run or to be
+        submitted by a partial marker. Until the job is recorded again, its
+        outputs are not adopted as complete.
+
+        :param job: the job
+        """
+        self.remove(job)
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        with open(self._marker(job_key(job)), 'w') as f:
+            f.write((job.name or '') + '\n')
+
+    def invalid(self, job):
+        """Return the reason why a job is not complete or None if the job
+        is complete
+
+        :param job: the job
+        """
+        if job in self._complete:
+            return self._complete[job]
+        # guard against cycles
+        self._complete[job] = None
+        reason = self._check(job)
+        self._complete[job] = reason
+        return reason
+
+    def _check(self, job):
+        record = self.get(job)
+        if record is None:
+            if self._adopt(job):
+                return None
+            return "no checkpoint"
+        if record.get('command') != command_hash(job):
+            return self._changed_parameters(job, record)
+        # checkpoints recorded without module versions are not compared
+        if self.incremental and 'modules' in record:
+            modules = tool_modules(job)
+            if record['modules'] != modules:
+                return "tool versions changed: %s -> %s" % (
+                    ", ".join(record['modules']) or "none",
+                    ", ".join(modules) or "none")
+        outputs = record.get('outputs', {})
+        for path in job_files(job, 'output'):
+            if path not in outputs:
+                return "output not recorded: %s" % path
+            if same_file(path, outputs[path]):
+                continue
+            if os.path.exists(path) or not job.temp:
+                return "output changed: %s" % path
+            # temporary outputs can be removed once all the jobs using
+            # them are complete
+            for child in job.children:
+                for j in group_jobs(child):
+                    if self.invalid(j):
+                        return "output removed: %s" % path
+        for path, info in record.get('inputs', {}).items():
+            if os.path.exists(path) and not same_file(path, info):
+                return "input changed: %s" % path
+        return None
+
+    def _adopt(self, job):
+        """Record the checkpoint of a job without checkpoint and partial
+        marker if all the outputs of the job and the jobs it streams to
+        exist, e.g. a job that finished before the project used
+        checkpoints. Returns True if the checkpoint was recorded."""
+        if os.path.exists(self._marker(job_key(job))):
+            return False
+        files = [f for j in group_jobs(job) for f in job_files(j, 'output')]
+        if not files or not all(os.path.exists(f) for f in files):
+            return False
+        self.record(job)
+        return True
+
+    def _changed_parameters(self, job, record):
+        recorded = record.get('parameters')
+        if recorded is None or record.get('tool') != job.tool_name:
+            return "command changed"
+        # round trip through JSON to compare with the recorded values
+        current = json.loads(json.dumps(job_parameters(job)))
+        names = sorted(name for name in set(recorded) | set(current)
+                       if recorded.get(name) != current.get(name))
+        if not names:
+            return "command changed"
+        return "parameters changed: %s" % ", ".join(names)
+
+    def sync(self, jobs):
+        """Record the checkpoints of the given jobs that have no checkpoint
+        yet and finished successfully according to the current jip
+        database, e.g. jobs submitted to a cluster. The database jobs are
+        looked up by name and only the latest one for each checkpoint is
+        considered, so a job that is submitted again is not recorded from
+        its previous run. Returns the number of recorded jobs.
+
+        :param jobs: the jobs
+        """
+        import jip.db
+        keys = {}
+        for job in jobs:
+            key = job_key(job)
+            if job.name and not os.path.exists(self._file(key)):
+                keys.setdefault(job.name, set()).add(key)
+        if not keys:
+            return 0
+        session = jip.db.create_session()
+        count = 0
+        try:
+            latest = {}
+            names = sorted(keys)
+            for i in range(0, len(names), SYNC_BATCH):
+                query = session.query(jip.db.Job).filter(
+                    jip.db.Job.name.in_(names[i:i + SYNC_BATCH]))
+                for job in query:
+                    key = job_key(job)
+                    if key in keys[job.name] and (
+                            key not in latest or job.id > latest[key].id):
+                        latest[key] = job
+            for job in latest.values():
+                if job.state == jip.db.STATE_DONE:
+                    self.record(job)
+                    count += 1
+        finally:
+            session.close()
+        return count
+
+
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def plan(jobs, checkpoints, force=False):
+    """Return a list of (group, reason) tuples for the job groups, that is
+    the jobs that run together, in execution order. The reason is None for
+    complete groups, which can be skipped. A group runs if one of its jobs
+    is not complete or if it depends on a group that runs.
+
+    :param jobs: the jobs
+    :param checkpoints: the project :py:class:`Checkpoints`
+    :param force: run all the jobs
+    """
+    import jip.db
+    import jip.jobs
+
+    result = []
+    running = set()
+    for group in jip.jobs.create_groups(jobs):
+        group = group_jobs(group[0])
+        reason = "forced" if force else None
+        if reason is None:
+            for job in group:
+                parents = [p for p in job.dependencies if p in running]
+                if parents:
+                    reason = "%s runs" % parents[0].name
+                    break
+        if reason is None:
+            if not any(job_files(job, 'output') for job in group):
+                # jobs without outputs are complete if jip says so
+                if group[0].state != jip.db.STATE_DONE:
+                    reason = "not done"
+            else:
+                for job in group:
+                    reason = checkpoints.invalid(job)
+                    if reason:
+                        break
+        if reason:
+            running.update(group)
+        result.append((group, reason))
+    return result
+
+
+def update_states(jobs, checkpoints, force=False):
+    """Set the state of the jobs from their checkpoints: complete jobs are
+    done and all the other jobs are put on hold, so they are executed or
+    submitted. Jobs in other states, e.g. queued behind running setup jobs,
+    are not changed. Returns the list returned by :py:func:`plan`.
+
+    :param jobs: the jobs
+    :param checkpoints: the project :py:class:`Checkpoints`
+    :param force: run all the jobs
+    """
+    import jip.db
+
+    groups = plan(jobs, checkpoints, force=force)
+    for group, reason in groups:
+        for job in group:
+            if job.state in (None, jip.db.STATE_HOLD, jip.db.STATE_DONE):
+                job.state = jip.db.STATE_HOLD if reason \
+                    else jip.db.STATE_DONE
+    return groups
@@ -4,6 +4,7 @@ from clint.textui import colored, puts, columns
 import jip
 from grape.cli import *
 from grape.grape import Grape
+from grape.profiling import phase
 
 
 class CommandError(Exception):
@@ -18,33 +19,115 @@ def jip_prepare(args, submit=False, project=None, datasets=[], validate=True):
         project, datasets = get_project_and_datasets(args)
     # setup jip db
     jip.db.init(project.jip_db)
+    with phase('planner'):
+        planner = get_resource_planner(args, project, datasets)
     p = jip.Pipeline()
     jargs = {}
-    if datasets == ['setup']:
-        jargs['input'] = project.config.get('genome')
-        jargs['annotation'] = project.config.get('annotation')
-        p.run('grape_gem_setup', **jargs)
-        jobs = jip.jobs.create_jobs(p)
-    else:
-        input = []
-        for d in datasets:
-            fqs = d.fastq.keys()
-            fqs.sort()
-            input.append(fqs[0])
-            if len(fqs) == 1:
-                jargs['single-end'] == True
-        jargs['fastq'] = input
-        jargs['annotation'] = project.config.get('annotation')
-        jargs['genome'] = project.config.get('genome')
-        jargs['max_mismatches'] = args.max_mismatches
-        jargs['max_matches'] = args.max_matches
-        jargs['threads'] = args.threads
-        p.run('grape_gem_rnapipeline', **jargs)
-        jobs = jip.jobs.create_jobs(p, validate=validate)
+    with phase('create_jobs'):
+        if datasets == ['setup']:
+            jargs['input'] = project.config.get('genome')
+            jargs['annotation'] = project.config.get('annotation')
+            p.run('grape_gem_setup', **jargs)
+            jobs = jip.jobs.create_jobs(p)
+        else:
+            p.run('grape_gem_rnapipeline',
+                  **get_pipeline_args(args, project, datasets, planner))
+            jobs = jip.jobs.create_jobs(p, validate=validate)
+            mark_retained_outputs(jobs)
+    with phase('configure_jobs'):
+        configure_jobs(jobs, args, project=project, planner=planner)
+        if getattr(args, 'stage', False):
+            from grape.stage import stage_jobs
+            stage_jobs(jobs, getattr(args, 'scratch', None))
     if submit:
-        jobs = check_jobs_dependencies(jobs)
+        with phase('dependencies'):
+            jobs = check_jobs_dependencies(jobs)
     return jobs
 
+def get_pipeline_args(args, project, datasets, planner=None):
+    """Return the arguments of the default pipeline for the given datasets
+    """
+    jargs = {}
+    input = []
+    for d in datasets:
+        fqs = d.fastq.keys()
+        fqs.sort()
+        input.append(fqs[0])
+        if len(fqs) == 1:
+            jargs['single-end'] == True
+    jargs['fastq'] = input
+    jargs['annotation'] = project.config.get('annotation')
+    jargs['genome'] = project.config.get('genome')
+    jargs['max_mismatches'] = args.max_mismatches
+    jargs['max_matches'] = args.max_matches
+    jargs['threads'] = args.threads
+    if jargs['threads'] is None and planner is not None:
+        # plan the pipeline threads from the largest input
+        size = max([planner.file_size(f) or 0 for f in input] or [0])
+        jargs['threads'] = planner.threads('grape_gem_rnatool', size)
+    jargs['retention'] = getattr(args, 'retention', None) or \
+        project.config.get('retention')
+    jargs['sort_tmp_dir'] = getattr(args, 'sort_tmp_dir', None)
+    jargs['fast_filter'] = getattr(args, 'fast_filter', False)
+    return jargs
+
+def mark_retained_outputs(jobs):
+    """Mark the jobs producing intermediate files with a retention policy
+    as temporary. Temporary jobs are done once all the jobs consuming their
+    outputs are done, so they do not run again after the files are removed.
+    """
+    import os
+    retained = set()
+    for job in jobs:
+        if job.tool_name == 'grape_retention':
+            retained.update(os.path.abspath(f)
+                            for f in job.tool.options['files'].raw())
+    if not retained:
+        return
+    for job in jobs:
+        outputs = set(os.path.abspath(f) for f in job.get_output_files())
+        if outputs & retained:
+            job.temp = True
+
+def get_resource_planner(args, project, datasets):
+    """Return the resource planner for the given project and datasets or
+    None if resource planning is disabled
+    """
+    from grape.resources import ResourcePlanner, index_sizes
+    from grape.history import History
+    if getattr(args, 'no_plan', False):
+        return None
+    if datasets == ['setup']:
+        datasets = []
+    return ResourcePlanner(sizes=index_sizes(project, datasets),
+                           history=History.open(project))
+
+def get_user_job_config(args):
+    """Return the job configuration specified on the command line"""
+    user_config = {}
+    if getattr(args, 'threads', None):
+        user_config['threads'] = int(args.threads)
+    if getattr(args, 'max_mem', None):
+        user_config['max_memory'] = jip.utils.parse_mem(args.max_mem)
+    if getattr(args, 'max_time', None):
+        user_config['max_time'] = jip.utils.parse_time(args.max_time)
+    for k in ['queue', 'priority']:
+        if getattr(args, k, None):
+            user_config[k] = getattr(args, k)
+    return user_config
+
+def configure_jobs(jobs, args, project=None, planner=None):
+    """Apply the grape job configuration, the planned resources and
+    the command line job configuration to the given jobs
+    """
+    from grape.resources import configure_sort
+    grape = Grape()
+    user_config = get_user_job_config(args)
+    for job in jobs:
+        grape.configure_job(job, project=project, user_config=user_config,
+                            planner=planner)
+        configure_sort(job)
+
 def check_jobs_dependencies(jobs):
     out_jobs = []
     for j in jobs:
@@ -88,11 +171,42 @@ def get_setup_jobs(job):
         setup_jobs += get_setup_jobs(j)
     return [j for j in setup_jobs if j]
 
+def show_plan(groups):
+    """Print the job groups that run and the reason why they run, and the
+    job groups that are skipped
+
+    :param groups: the list of (group, reason) tuples returned by
+        :py:func:`grape.checkpoint.plan`
+    """
+    run = len([reason for _, reason in groups if reason])
+    info("%d of %d job groups run" % (run, len(groups)))
+    for group, reason in groups:
+        name = " | ".join(j.name for j in group)
+        if reason:
+            warn("Run   %s (%s)" % (name, reason))
+        else:
+            info("Skip  %s" % name)
+
+
+def show_summary(summary):
+    """Print the job counts, the existing outputs and the requested CPU
+    hours of each tool
+
+    :param summary: the :py:class:`grape.dryrun.Summary`
+    """
+    from jip.cli import render_table
+    rows, total = summary.rows()
+    print render_table(["Tool", "Jobs", "Outputs", "Existing", "CPU hours"],
+                       [(r['tool'], r['jobs'], r['outputs'], r['existing'],
+                         "%.1f" % r['cpu_hours']) for r in rows + [total]])
+
+
 def remove_job(job):
-    for j in job.children:
-        remove_job(j)
-    jip.jobs.delete(job, clean_logs=True)
-    warn('Removed job %s[%s]' % (job.name, job.id))
+    from grape.jobs import delete
+    jobs = jip.jobs.get_subgraph(job)
+    delete(jobs)
+    for j in jobs:
+        warn('Removed job %s[%s]' % (j.name, j.id))
     return True
 
 def get_project_and_datasets(args):
@@ -109,11 +223,12 @@ def get_project_and_datasets(args):
 
     datasets = None
 
-    project = Project.find()
-    if not project or not project.exists():
-        project = Project(os.getcwd())
-        project.initialize()
-        datasets = prepare_from_commandline(project, args)
+    with phase('project'):
+        project = Project.find()
+        if not project or not project.exists():
+            project = Project(os.getcwd())
+            project.initialize()
+            datasets = prepare_from_commandline(project, args)
 
     if "datasets" in args and not datasets:
         datasets = args.datasets
@@ -128,7 +243,8 @@ def get_project_and_datasets(args):
     if datasets == ['all']:
         datasets = []
 
-    datasets = project.get_datasets(id=datasets)
+    with phase('datasets'):
+        datasets = project.get_datasets(id=datasets)
 
     return (project, datasets)
 
@@ -216,6 +332,34 @@ def add_default_job_configuration(parser, add_cluster_parameter=True, add_pipeli
                            help="The maximum number of mismatches allowed")
         pgroup.add_argument("-n", "--max-matches", default=10,
                            help="The maximum number of matches allowed (multimaps)")
+        pgroup.add_argument("--no-plan", dest="no_plan", default=False,
+                           action="store_true",
+                           help="Do not estimate threads, memory and time "
+                                "of the jobs from the input sizes")
+        pgroup.add_argument("--retention", default=None,
+                           help="Retention policies for the intermediate "
+                                "outputs as a comma separated list of "
+                                "output=policy pairs. The outputs are map, "
+                                "filtered_map and bam, the policies keep, "
+                                "delete and archive. Default: keep all the "
+                                "outputs")
+        pgroup.add_argument("--sort-tmp-dir", dest="sort_tmp_dir",
+                           default=None,
+                           help="The folder for the temporary BAM sort "
+                                "files. Default: the output folder")
+        pgroup.add_argument("--fast-filter", dest="fast_filter",
+                           default=False, action="store_true",
+                           help="Filter the mappings with the grape "
+                                "streaming map filter instead of gt.filter "
+                                "and pigz")
+        pgroup.add_argument("--stage", default=False, action="store_true",
+                           help="Run the mapping, sorting and quantification "
+                                "jobs in a scratch folder on the local disk "
+                                "of the compute node and move the outputs "
+                                "back when they succeed")
+        pgroup.add_argument("--scratch", default=None,
+                           help="The folder used for staging. "
+                                "Default: $TMPDIR on the compute node")
 
     if add_dataset_parameter:
 
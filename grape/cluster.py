@@ -0,0 +1,879 @@
+#!/usr/bin/env python
+"""Grape cluster integration
+
+This module extends the jip cluster implementations with array job
+submission. Executions that run the same tools with the same resource
+profile at the same level of the pipeline graph are grouped into a single
+array job and sent to the cluster with one submit call. Dependencies
+between jobs are translated into dependencies between the arrays.
+
+The array mode is selected in the grape ``cluster.json`` configuration
+by using one of the array cluster classes, i.e.::
+
+    {
+        "class": "grape.cluster.SlurmArray",
+        "max_array_size": 1000
+    }
+
+:py:class:`LocalCluster` runs the jobs on the local machine with the same
+queue semantics, so job submission can be tested without a cluster.
+"""
+import os
+import re
+import json
+import time
+from contextlib import contextmanager
+from subprocess import Popen, PIPE
+
+import jip
+import jip.cluster
+from jip.cluster import SubmissionError
+
+from .profiling import phase
+
+
+#: job attributes that define the resource profile of a job
+_PROFILE_ATTRIBUTES = ['threads', 'tasks', 'nodes', 'tasks_per_node',
+                       'max_memory', 'max_time', 'queue', 'priority',
+                       'account', 'environment', 'working_directory']
+
+
+def _tools(job):
+    """Return the tool names of all the jobs executed together
+    with the given job
+    """
+    return tuple(str(j.tool_name) for j in jip.jobs.get_group_jobs(job))
+
+
+def _profile(job):
+    """Return the resource profile of a job as a tuple"""
+    return tuple(getattr(job, a, None) for a in _PROFILE_ATTRIBUTES)
+
+
+def group_jobs(jobs, max_array_size=None):
+    """Group the given executable jobs into arrays. Jobs are grouped if
+    they run the same tools with the same resource profile and are at the
+    same depth in the pipeline graph. The depth makes sure that there are
+    no dependencies between jobs of the same group.
+
+    Returns a list of groups in submission order, i.e. a group is always
+    returned after all the groups it depends on.
+
+    :param jobs: list of executable jobs, usually the jobs of
+        :py:func:`jip.jobs.create_executions`
+    :param max_array_size: maximum number of jobs in a single group
+    """
+    heads = {}
+    for job in jobs:
+        for j in jip.jobs.get_group_jobs(job):
+            heads[j] = job
+
+    depths = {}
+
+    def _depth(job):
+        if job not in depths:
+            parents = set([heads[d] for j in jip.jobs.get_group_jobs(job)
+                           for d in j.dependencies
+                           if d in heads and heads[d] is not job])
+            depths[job] = 1 + max([_depth(p) for p in parents] + [-1])
+        return depths[job]
+
+    keys = []
+    groups = {}
+    for job in jobs:
+        key = (_depth(job), _tools(job), _profile(job))
+        if key not in groups:
+            keys.append(key)
+            groups[key] = []
+        groups[key].append(job)
+
+    keys.sort(key=lambda k: k[0])
+    result = []
+    for key in keys:
+        group = groups[key]
+        if not max_array_size:
+            result.append(group)
+            continue
+        for i in range(0, len(group), max_array_size):
+            result.append(group[i:i + max_array_size])
+    return result
+
+
+def get_dependencies(group, arrays):
+    """Return the set of cluster ids the given group depends on. Jobs
+    submitted as part of an array are resolved to the array id.
+
+    :param group: the list of jobs
+    :param arrays: dictionary that maps submitted jobs to the id of the
+        array they are part of
+    """
+    deps = set([])
+    for job in group:
+        for j in jip.jobs.get_group_jobs(job):
+            for d in j.dependencies:
+                if d in arrays:
+                    deps.add(arrays[d])
+                elif d.job_id and d.state != jip.db.STATE_DONE:
+                    deps.add(str(d.job_id))
+    return deps
+
+
+def submit_arrays(jobs, cluster, force=False, save=True):
+    """Submit the given jobs as array jobs. This is a generator that
+    yields a tuple with the array id and the list of jobs for each
+    submitted array.
+
+    The jobs have to be stored in the database already, i.e. created with
+    :py:func:`jip.jobs.create_executions` and ``save=True``.
+
+    :param jobs: list of executable jobs
+    :param cluster: the cluster instance. It has to provide a
+        ``submit_array`` method
+    :param force: force the submission of jobs that are done
+    :param save: if True, update the job states in the database
+    """
+    arrays = {}
+    jobs = [j for j in jobs if len(j.pipe_from) == 0 and
+            (force or j.state != jip.db.STATE_DONE)]
+    for group in group_jobs(jobs, getattr(cluster, 'max_array_size', None)):
+        for job in group:
+            if job.id is None:
+                raise SubmissionError("No ID assigned to job %s. Jobs have "
+                                      "to be saved before array "
+                                      "submission" % job)
+            if job.state in jip.db.STATES_ACTIVE:
+                jip.jobs.cancel(job, clean_logs=True, cluster=cluster,
+                                cancel_children=False)
+            jip.jobs.set_state(job, jip.db.STATE_QUEUED,
+                               update_children=True)
+
+        array_id = cluster.submit_array(group, get_dependencies(group,
+                                                                arrays))
+        all_jobs = []
+        for job in group:
+            for j in jip.jobs.get_group_jobs(job):
+                j.job_id = job.job_id
+                arrays[j] = array_id
+                all_jobs.append(j)
+        if save:
+            jip.db.update_job_states(all_jobs)
+        yield array_id, group
+
+
+def submit_job(job, cluster, force=False):
+    """Submit a single job with :py:func:`jip.jobs.submit_job` and return
+    True if it was submitted. The dependencies on jobs that are done are
+    dropped, as in :py:func:`get_dependencies`, because the scheduler may
+    have purged them already and would reject the submission. The states
+    of the dependencies are read from the jip database, as they may have
+    finished since the job was loaded.
+
+    :param job: the executable job
+    :param cluster: the cluster instance
+    :param force: force the submission of a job that is done
+    """
+    deps = [d for d in job.dependencies if d.job_id]
+    states = _job_states(deps)
+    done = [d for d in deps
+            if states.get(d.id, d.state) == jip.db.STATE_DONE]
+    ids = [d.job_id for d in done]
+    for d in done:
+        d.job_id = None
+    try:
+        return jip.jobs.submit_job(job, force=force, cluster=cluster)
+    finally:
+        for d, job_id in zip(done, ids):
+            d.job_id = job_id
+
+
+def _job_states(jobs):
+    """Return a dictionary that maps the ids of the given jobs to their
+    state in the jip database"""
+    from sqlalchemy import select
+    ids = [j.id for j in jobs if j.id is not None]
+    if not ids:
+        return {}
+    t = jip.db.Job.__table__
+    q = select([t.c.id, t.c.state]).where(t.c.id.in_(ids))
+    conn = jip.db.engine.connect()
+    try:
+        return dict(conn.execute(q).fetchall())
+    finally:
+        conn.close()
+
+
+def count_active_jobs():
+    """Return the number of jobs that are queued or running on the
+    cluster according to the jip database. Jobs that are executed
+    together and share the same remote id are counted once.
+    """
+    from sqlalchemy import select, func, distinct
+    t = jip.db.Job.__table__
+    q = select([func.count(distinct(t.c.job_id))]).where(
+        t.c.state.in_(jip.db.STATES_ACTIVE))
+    conn = jip.db.engine.connect()
+    try:
+        return conn.execute(q).scalar()
+    finally:
+        conn.close()
+
+
+def get_held_jobs(ids=None, datasets=None):
+    """Return the executable jobs that are stored in the jip database
+    and are on hold. These are the jobs that were saved but not yet
+    submitted. Jobs are stored in topological order, so they are returned
+    sorted by id.
+
+    :param ids: only return the jobs with these ids, e.g. the jobs left on
+        hold by a previous submission
+    :param datasets: only return the jobs of these datasets and the
+        project level jobs linked to them, e.g. the index jobs they
+        depend on
+    """
+    session = jip.db.create_session()
+    held = session.query(jip.db.Job).filter(
+        jip.db.Job.state == jip.db.STATE_HOLD).order_by(jip.db.Job.id).all()
+    if ids is not None:
+        ids = set(ids)
+        held = [j for j in held if j.id in ids]
+    if datasets:
+        held = _dataset_jobs(held, datasets)
+    return [exe.job for exe in jip.jobs.create_executions(
+        held, check_outputs=False, check_queued=False)]
+
+
+def _dataset_jobs(jobs, datasets):
+    """Return the jobs of the given datasets and the project level jobs
+    linked to them. The dataset None selects the project level jobs that
+    do not depend on dataset jobs, e.g. the setup jobs."""
+    from .jobs import job_dataset
+    datasets = set(datasets)
+    found = dict((j.id, job_dataset(j.name, j.tool_name)) for j in jobs)
+    selected = set()
+    for job in jobs:
+        dataset = found[job.id]
+        if dataset is None and any(job_dataset(d.name, d.tool_name)
+                                   for d in job.dependencies):
+            continue
+        if dataset in datasets:
+            selected.add(job.id)
+    todo = [j for j in jobs if j.id in selected]
+    while todo:
+        job = todo.pop()
+        for other in list(job.dependencies) + list(job.children) + \
+                list(job.pipe_to) + list(job.pipe_from):
+            if other.id in found and other.id not in selected and \
+                    found[other.id] is None:
+                selected.add(other.id)
+                todo.append(other)
+    return [j for j in jobs if j.id in selected]
+
+
+class Throttle(object):
+    """Limit the number of jobs in flight on the cluster and the job
+    submission rate.
+
+    :param max_jobs: the maximum number of queued and running jobs. No
+        limit is applied if None
+    :param rate: the maximum number of submissions per minute. No limit
+        is applied if None
+    :param interval: number of seconds to wait before checking again the
+        number of active jobs when the limit is reached
+    """
+    def __init__(self, max_jobs=None, rate=None, interval=30):
+        self.max_jobs = int(max_jobs) if max_jobs else None
+        self.rate = float(rate) if rate else None
+        self.interval = interval
+        self._last = None
+
+    @property
+    def enabled(self):
+        return self.max_jobs is not None or self.rate is not None
+
+    def slots(self):
+        """Return the number of jobs that can be submitted now or None
+        if there is no limit"""
+        if self.max_jobs is None:
+            return None
+        return max(0, self.max_jobs - count_active_jobs())
+
+    def tick(self):
+        """Called after each submission. Waits as long as needed to
+        respect the submission rate"""
+        if self.rate is None:
+            return
+        now = time.time()
+        if self._last is not None:
+            delay = 60.0 / self.rate - (now - self._last)
+            if delay > 0:
+                with phase('throttle'):
+                    time.sleep(delay)
+        self._last = time.time()
+
+    def feed(self, jobs, wait=True):
+        """Generator that yields chunks of the given jobs that can be
+        submitted without exceeding the maximum number of active jobs.
+        If wait is True, the generator blocks until some of the active jobs
+        are finished, otherwise it stops when the limit is reached.
+
+        :param jobs: list of executable jobs in submission order
+        :param wait: wait for jobs to finish if the limit is reached
+        """
+        jobs = list(jobs)
+        while jobs:
+            with phase('scheduler'):
+                slots = self.slots()
+            if slots == 0:
+                if not wait:
+                    return
+                with phase('throttle'):
+                    time.sleep(self.interval)
+                continue
+            chunk = jobs[:slots] if slots is not None else jobs
+            jobs = jobs[len(chunk):]
+            yield chunk
+
+
+def _array_name(jobs):
+    """Create a name for the array from the first job"""
+    job = jobs[0]
+    name = job.pipeline if job.pipeline else "_".join(_tools(job))
+    return re.sub("[^\w\.-]", "_", name)
+
+
+def _log_folder(jobs):
+    """Return the log folder for the array and make sure it exists"""
+    job = jobs[0]
+    folder = job.working_directory if job.working_directory else os.getcwd()
+    if job.stdout:
+        folder = os.path.dirname(job.stdout)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    return folder
+
+
+def _task_script(jobs, task_var, offset=0):
+    """Create the bash script that runs the array tasks"""
+    lines = ["#!/bin/bash", "case $%s in" % task_var]
+    for i, job in enumerate(jobs):
+        lines.append("%d) exec %s;;" % (i + offset,
+                                        job.get_cluster_command()))
+    lines.append("esac")
+    lines.append("")
+    return "\n".join(lines)
+
+
+#: the maximum number of job ids passed to a single cancel command
+MAX_CANCEL_IDS = 500
+
+
+def _cancel_all(command, jobs):
+    """Cancel jobs with a command that takes a list of job ids, e.g.
+    `scancel` or `qdel`
+
+    :param command: the command
+    :param jobs: the jobs
+    """
+    ids = [str(j.job_id) for j in jobs if j is not None and j.job_id]
+    for i in range(0, len(ids), MAX_CANCEL_IDS):
+        Popen([command] + ids[i:i + MAX_CANCEL_IDS], stdout=PIPE,
+              stderr=PIPE).communicate()
+
+
+class SlurmArray(jip.cluster.Slurm):
+    """Slurm cluster implementation that supports array submission.
+
+    Single jobs are submitted using the default jip implementation. The
+    constructor takes the optional paths to the slurm commands and the
+    maximum number of jobs submitted in a single array. This should not
+    exceed the ``MaxArraySize`` of the Slurm configuration.
+    """
+    def __init__(self, sbatch=None, squeue=None, scancel=None,
+                 max_array_size=1000):
+        jip.cluster.Slurm.__init__(self)
+        self.sbatch = sbatch if sbatch else self.sbatch
+        self.squeue = squeue if squeue else self.squeue
+        self.scancel = scancel if scancel else self.scancel
+        self.max_array_size = int(max_array_size)
+
+    def submit_array(self, jobs, dependencies=None):
+        """Submit the list of jobs as a single array job. All the jobs must
+        share the same resource profile. The jobs remote ids are set to the
+        array task ids.
+
+        :param jobs: list of jobs
+        :param dependencies: set of cluster ids the array depends on
+        :returns: the array id
+        """
+        job = jobs[0]
+        name = _array_name(jobs)
+        log = os.path.join(_log_folder(jobs), "%s-%%A_%%a" % name)
+        cmd = [self.sbatch, "--array", "0-%d" % (len(jobs) - 1),
+               "-J", name, "-o", log + ".out", "-e", log + ".err"]
+        if job.threads and job.threads > 0:
+            cmd.extend(["-c", str(job.threads)])
+        if job.tasks and job.tasks > 0:
+            cmd.extend(["-n", str(job.tasks)])
+        if job.nodes:
+            cmd.extend(["-N", job.nodes])
+        if job.tasks_per_node:
+            cmd.extend(["--ntasks-per-node", str(job.tasks_per_node)])
+        if job.max_time > 0:
+            cmd.extend(["-t", str(job.max_time)])
+        if job.account:
+            cmd.extend(["-A", str(job.account)])
+        if job.priority:
+            cmd.extend(["--qos", str(job.priority)])
+        if job.queue:
+            cmd.extend(["-p", str(job.queue)])
+        if job.working_directory:
+            cmd.extend(["-D", job.working_directory])
+        if job.max_memory > 0:
+            cmd.extend(["--mem-per-cpu", str(job.max_memory)])
+        if job.extra is not None:
+            cmd.extend(job.extra)
+        if dependencies:
+            cmd.extend(["-d", "afterok:%s" % ":".join(sorted(dependencies))])
+
+        process = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        out, err = process.communicate(_task_script(jobs,
+                                                    "SLURM_ARRAY_TASK_ID"))
+        match = re.search("Submitted batch job (?P<job_id>\d+)", out)
+        if process.returncode != 0 or not match:
+            raise SubmissionError("%s\nExecuted command:\n%s\n" % (
+                err, " ".join(cmd)))
+        array_id = match.group('job_id')
+        for i, job in enumerate(jobs):
+            job.job_id = "%s_%d" % (array_id, i)
+            job.stdout = log.replace("%A_%a", "%j") + ".out"
+            job.stderr = log.replace("%A_%a", "%j") + ".err"
+        return array_id
+
+    def cancel_jobs(self, jobs):
+        """Cancel a list of jobs with a single `scancel` call"""
+        _cancel_all(self.scancel, jobs)
+
+    def list(self):
+        # list array tasks one per line
+        cmd = [self.squeue, '-h', '-r', '-o', '%i']
+        p = Popen(cmd, stdout=PIPE)
+        return [line.strip() for line in p.stdout]
+
+    def __repr__(self):
+        return "SlurmArray"
+
+
+class SGEArray(jip.cluster.SGE):
+    """SGE cluster implementation that supports array submission.
+
+    Single jobs are submitted using the default jip implementation. The
+    constructor takes the optional paths to the SGE commands, the parallel
+    environment used for threaded jobs and the maximum number of jobs
+    submitted in a single array.
+    """
+    def __init__(self, qsub=None, qstat=None, qdel=None, threads_pe=None,
+                 max_array_size=1000):
+        jip.cluster.SGE.__init__(self)
+        self.qsub = qsub if qsub else self.qsub
+        self.qstat = qstat if qstat else self.qstat
+        self.qdel = qdel if qdel else self.qdel
+        self.threads_pe = threads_pe if threads_pe else self.threads_pe
+        self.max_array_size = int(max_array_size)
+
+    def submit_array(self, jobs, dependencies=None):
+        """Submit the list of jobs as a single array job. All the jobs must
+        share the same resource profile. The jobs remote ids are set to the
+        array task ids.
+
+        :param jobs: list of jobs
+        :param dependencies: set of cluster ids the array depends on
+        :returns: the array id
+        """
+        job = jobs[0]
+        name = _array_name(jobs)
+        log = os.path.join(_log_folder(jobs), "%s-$JOB_ID.$TASK_ID" % name)
+        cmd = [self.qsub, "-V", "-notify", "-t", "1-%d" % len(jobs),
+               "-N", name, "-o", log + ".out", "-e", log + ".err"]
+        if job.max_time > 0:
+            cmd.extend(["-l", '%s=%s' % (self.time_limit,
+                                         str(job.max_time * 60))])
+        if job.threads and job.threads > 1:
+            env = job.environment if job.environment else self.threads_pe
+            if not env:
+                raise SubmissionError("No parallel environment configured "
+                                      "for threaded jobs. Please set the "
+                                      "'threads_pe' value in your cluster "
+                                      "configuration")
+            slots = job.tasks if job.tasks > 1 else job.threads
+            cmd.extend(["-pe", env, str(slots)])
+        if job.priority:
+            cmd.extend(["-p", str(job.priority)])
+        if job.queue:
+            cmd.extend(["-q", str(job.queue)])
+        if job.working_directory:
+            cmd.extend(["-wd", job.working_directory])
+        if job.max_memory > 0:
+            cmd.extend(["-l", '%s=%s' % (self.mem_limit,
+                                         str(job.max_memory))])
+        if job.account:
+            cmd.extend(["-A", str(job.account)])
+        if job.extra is not None:
+            cmd.extend(job.extra)
+        if dependencies:
+            # hold on the whole array
+            deps = set([d.split(".")[0] for d in dependencies])
+            cmd.extend(["-hold_jid", ",".join(sorted(deps))])
+
+        process = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        out, err = process.communicate(_task_script(jobs, "SGE_TASK_ID",
+                                                    offset=1))
+        match = re.search("Your job(-array)? (?P<job_id>\d+)", out)
+        if process.returncode != 0 or not match:
+            raise SubmissionError("%s\nExecuted command:\n%s\n" % (
+                err, " ".join(cmd)))
+        array_id = match.group('job_id')
+        for i, job in enumerate(jobs):
+            job.job_id = "%s.%d" % (array_id, i + 1)
+            job.stdout = log.replace("$JOB_ID.$TASK_ID", "$JOB_ID") + ".out"
+            job.stderr = log.replace("$JOB_ID.$TASK_ID", "$JOB_ID") + ".err"
+        return array_id
+
+    def list(self):
+        jobs = []
+        for job_id in jip.cluster.SGE.list(self):
+            jobs.append(job_id)
+        # expand the array tasks
+        params = [self.qstat, "-u", os.getenv('USER'), "-g", "d"]
+        process = Popen(params, stdout=PIPE, stderr=PIPE, shell=False)
+        for l in process.stdout:
+            fields = l.split()
+            if len(fields) > 1 and fields[0].isdigit() and \
+                    fields[-1].isdigit():
+                jobs.append("%s.%s" % (fields[0], fields[-1]))
+        process.wait()
+        return jobs
+
+    def cancel_jobs(self, jobs):
+        """Cancel a list of jobs with a single `qdel` call"""
+        _cancel_all(self.qdel, jobs)
+
+    def __repr__(self):
+        return "SGEArray"
+
+
+class LocalCluster(jip.cluster.Cluster):
+    """Cluster implementation that runs the jobs on the local machine, e.g.
+    to test the job submission without a real cluster.
+
+    Submitted jobs are queued in a spool folder. A scheduler process is
+    started on the first submission and runs the queued jobs in first in,
+    first out order as long as the number of threads of the running jobs
+    does not exceed the number of slots. A job starts once all its
+    dependencies finished successfully. Jobs that depend on a failed or
+    canceled job are canceled, also when they are submitted after the
+    scheduler stopped. The failed and canceled jobs are removed from the
+    spool folder when they are submitted again, restarted or deleted, see
+    :py:meth:`forget_jobs`, or once they are older than `expire` seconds.
+    The scheduler keeps running after the grape command exits and stops
+    when the queue has been empty for `idle` seconds. The cluster is
+    selected in the grape ``cluster.json``::
+
+        {
+            "class": "grape.cluster.LocalCluster",
+            "slots": 4
+        }
+
+    :param slots: the number of threads available to the jobs. Defaults to
+        the number of CPUs
+    :param spool: the spool folder. Default: ~/.grape/cluster
+    :param interval: the number of seconds between two scheduler runs
+    :param idle: the number of seconds the scheduler waits for new jobs
+        before stopping
+    :param expire: the number of seconds the failed and canceled jobs are
+        kept. Default: one week
+    """
+    #: the states of the jobs in the spool folder
+    STATES = ['queued', 'running', 'done', 'failed', 'canceled']
+
+    def __init__(self, slots=None, spool=None, interval=0.5, idle=5,
+                 expire=7 * 86400):
+        import multiprocessing
+        self.slots = int(slots) if slots else multiprocessing.cpu_count()
+        self.spool = spool if spool else os.path.join(
+            os.path.expanduser("~"), ".grape", "cluster")
+        self.interval = float(interval)
+        self.idle = float(idle)
+        self.expire = float(expire)
+        self._scheduler = None
+        if not os.path.exists(self.spool):
+            os.makedirs(self.spool)
+
+    @contextmanager
+    def _lock(self):
+        import fcntl
+        with open(os.path.join(self.spool, "lock"), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _path(self, job_id, state):
+        return os.path.join(self.spool, "%s.%s" % (job_id, state))
+
+    def _records(self):
+        """Return a dictionary that maps the ids of the jobs in the spool
+        folder to their state"""
+        records = {}
+        for name in os.listdir(self.spool):
+            job_id, _, state = name.partition(".")
+            if state in self.STATES and job_id.isdigit():
+                records[job_id] = state
+        return records
+
+    def _read(self, job_id, state):
+        with open(self._path(job_id, state)) as f:
+            return json.load(f)
+
+    def _write(self, record, state, previous=None):
+        with open(self._path(record['id'], state), 'w') as f:
+            json.dump(record, f)
+        if previous is not None and previous != state:
+            os.remove(self._path(record['id'], previous))
+
+    def _next_id(self):
+        path = os.path.join(self.spool, "next_id")
+        job_id = 1
+        if os.path.exists(path):
+            with open(path) as f:
+                job_id = int(f.read().strip() or 1)
+        with open(path, 'w') as f:
+            f.write("%d\n" % (job_id + 1))
+        return str(job_id)
+
+    def _scheduler_running(self):
+        if self._scheduler is not None and self._scheduler.poll() is not None:
+            self._scheduler = None
+        path = os.path.join(self.spool, "scheduler.pid")
+        if not os.path.exists(path):
+            return False
+        with open(path) as f:
+            pid = int(f.read().strip() or 0)
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            return False
+        return True
+
+    def _start_scheduler(self):
+        import sys
+        env = dict(os.environ)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = os.pathsep.join(
+            [root] + [p for p in [env.get('PYTHONPATH')] if p])
+        # the jobs run `jip exec`, installed next to the interpreter
+        env['PATH'] = os.pathsep.join(
+            [os.path.dirname(sys.executable)] +
+            [p for p in [env.get('PATH')] if p])
+        with open(os.path.join(self.spool, "scheduler.log"), 'a') as log:
+            self._scheduler = Popen(
+                [sys.executable, "-m", "grape.cluster", self.spool,
+                 str(self.slots), str(self.interval), str(self.idle),
+                 str(self.expire)],
+                stdin=open(os.devnull), stdout=log, stderr=log,
+                close_fds=True, preexec_fn=os.setsid, env=env)
+        with open(os.path.join(self.spool, "scheduler.pid"), 'w') as f:
+            f.write("%d\n" % self._scheduler.pid)
+
+    def submit(self, job):
+        cwd = job.working_directory if job.working_directory else \
+            os.getcwd()
+        if job.stdout is None:
+            job.stdout = os.path.join(cwd, "local-%J.out")
+        if job.stderr is None:
+            job.stderr = os.path.join(cwd, "local-%J.err")
+        with self._lock():
+            # the job is submitted again, e.g. after it failed
+            self._forget([job])
+            job.job_id = self._next_id()
+            self._write({
+                'id': job.job_id,
+                'name': job.name,
+                'command': job.get_cluster_command(),
+                'working_directory': cwd,
+                'stdout': self.resolve_log(job, job.stdout),
+                'stderr': self.resolve_log(job, job.stderr),
+                'threads': max(1, job.threads or 1),
+                'dependencies': sorted(set([str(d.job_id)
+                                            for d in job.dependencies
+                                            if d.job_id])),
+            }, 'queued')
+            if not self._scheduler_running():
+                self._start_scheduler()
+
+    def list(self):
+        with self._lock():
+            return sorted([job_id for job_id, state in
+                           self._records().items()
+                           if state in ['queued', 'running']], key=int)
+
+    def cancel(self, job):
+        self.cancel_jobs([job])
+
+    def cancel_jobs(self, jobs):
+        """Cancel a list of jobs holding the spool lock once"""
+        import signal
+        ids = [str(j.job_id) for j in jobs if j is not None and j.job_id]
+        if not ids:
+            return
+        with self._lock():
+            records = self._records()
+            for job_id in ids:
+                state = records.get(job_id)
+                if state not in ['queued', 'running']:
+                    continue
+                record = self._read(job_id, state)
+                if state == 'running':
+                    try:
+                        os.killpg(record['pid'], signal.SIGTERM)
+                    except OSError:
+                        pass
+                self._write(record, 'canceled', previous=state)
+
+    def forget_jobs(self, jobs):
+        """Remove the failed and canceled jobs from the spool folder, e.g.
+        once they are restarted or deleted. The jobs submitted later do not
+        depend on them anymore. Jobs that queued jobs depend on are kept
+        until the scheduler cancels the queued jobs."""
+        with self._lock():
+            self._forget(jobs)
+
+    def _forget(self, jobs):
+        records = self._records()
+        needed = set()
+        for job_id, state in records.items():
+            if state == 'queued':
+                needed.update(self._read(job_id, state)['dependencies'])
+        for job in jobs:
+            if job is None or not job.job_id:
+                continue
+            job_id = str(job.job_id)
+            state = records.get(job_id)
+            if state in ['failed', 'canceled'] and job_id not in needed:
+                os.remove(self._path(job_id, state))
+
+    def resolve_log(self, job, path):
+        if path is None:
+            return None
+        return path.replace("%J", str(job.job_id))
+
+    def __repr__(self):
+        return "LocalCluster"
+
+
+class _LocalScheduler(object):
+    """The scheduler process of the :py:class:`LocalCluster`"""
+
+    def __init__(self, cluster):
+        self.cluster = cluster
+        self.running = {}
+
+    def _start(self, record):
+        import signal
+        out = open(record['stdout'], 'a')
+        err = open(record['stderr'], 'a')
+
+        def setup():
+            os.setsid()
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        try:
+            process = Popen(record['command'], shell=True,
+                            cwd=record['working_directory'], stdout=out,
+                            stderr=err, close_fds=True, preexec_fn=setup)
+        finally:
+            out.close()
+            err.close()
+        record['pid'] = process.pid
+        self.running[record['id']] = process
+        self.cluster._write(record, 'running', previous='queued')
+
+    def _reap(self, records):
+        for job_id, process in self.running.items():
+            code = process.poll()
+            if code is None:
+                continue
+            del self.running[job_id]
+            if records.get(job_id) != 'running':
+                # canceled
+                continue
+            record = self.cluster._read(job_id, 'running')
+            record['exit_code'] = code
+            state = 'done' if code == 0 else 'failed'
+            self.cluster._write(record, state, previous='running')
+            records[job_id] = state
+
+    def schedule(self):
+        """Reap the finished jobs and start the queued jobs that can run.
+        Returns the number of queued and running jobs."""
+        cluster = self.cluster
+        records = cluster._records()
+        self._reap(records)
+        used = sum([cluster._read(i, 'running')['threads']
+                    for i, s in records.items() if s == 'running'])
+        queued = sorted([i for i, s in records.items() if s == 'queued'],
+                        key=int)
+        for job_id in queued:
+            record = cluster._read(job_id, 'queued')
+            states = [records.get(d) for d in record['dependencies']]
+            if 'failed' in states or 'canceled' in states:
+                record['reason'] = "dependency failed"
+                cluster._write(record, 'canceled', previous='queued')
+                records[job_id] = 'canceled'
+                continue
+            if 'queued' in states or 'running' in states:
+                continue
+            # a job that needs more threads than slots runs alone
+            if used > 0 and used + record['threads'] > cluster.slots:
+                continue
+            self._start(record)
+            records[job_id] = 'running'
+            used += record['threads']
+        return len([s for s in records.values()
+                    if s in ['queued', 'running']])
+
+    def _cleanup(self):
+        """Remove the pid file and the jobs that finished successfully.
+        The failed and canceled jobs are kept until they expire, so the jobs
+        that depend on them and are submitted later are canceled too."""
+        now = time.time()
+        for job_id, state in self.cluster._records().items():
+            path = self.cluster._path(job_id, state)
+            if state == 'done' or \
+                    now - os.path.getmtime(path) >= self.cluster.expire:
+                os.remove(path)
+        pid = os.path.join(self.cluster.spool, "scheduler.pid")
+        if os.path.exists(pid):
+            os.remove(pid)
+
+    def run(self):
+        """Run the scheduler until the queue is empty for the idle time"""
+        idle = None
+        while True:
+            with self.cluster._lock():
+                active = self.schedule()
+                if active == 0:
+                    if idle is None:
+                        idle = time.time()
+                    elif time.time() - idle >= self.cluster.idle:
+                        self._cleanup()
+                        return
+                else:
+                    idle = None
+            time.sleep(self.cluster.interval)
+
+
+if __name__ == '__main__':
+    import sys
+    spool, slots, interval, idle, expire = sys.argv[1:6]
+    _LocalScheduler(LocalCluster(slots, spool, interval, idle,
+                                 expire)).run()
@@ -18,6 +18,7 @@ import argparse
 
 
 from . import cli
+from . import profiling
 from . import grapeindex as index
 from . import utils as grapeutils
 from .grape import Grape, Project, GrapeError
@@ -36,6 +37,16 @@ class GrapeCommand(object):
         """Implement this to add arguments"""
         pass
 
+    def _get_cluster(self):
+        """Return the cluster configured in the grape cluster.json or None
+        to use the default jip cluster"""
+        try:
+            return Grape().get_cluster()
+        except GrapeError, e:
+            if str(e) != "No cluster configuration found!":
+                cli.warn("%s. Using the default cluster." % str(e))
+            return None
+
 
 class InitCommand(GrapeCommand):
     name = "init"
@@ -94,34 +105,70 @@ class RunCommand(GrapeCommand):
     def run(self, args):
         import tools
         import jip
+        import resource
         from datetime import datetime, timedelta
+        from .history import History
+        from .checkpoint import Checkpoints, update_states, group_jobs
+        from . import metrics
         # jip parameters
         silent = False
         profiler = False
-        force = False
 
-        jobs = utils.jip_prepare(args)
+        project, datasets = utils.get_project_and_datasets(args)
+        if args.summary:
+            from .dryrun import summarize
+            with profiling.phase('summary'):
+                summary = summarize(args, project, datasets)
+            utils.show_summary(summary)
+            return True
+        with profiling.phase('jip_prepare'):
+            jobs = utils.jip_prepare(args, project=project,
+                                     datasets=datasets)
 
         if not jobs:
             return False
 
+        # only skip the jobs that are verifiably complete
+        with profiling.phase('checkpoints'):
+            checkpoints = Checkpoints.open(project,
+                                           incremental=args.incremental)
+            checkpoints.sync(jobs)
+            groups = update_states(jobs, checkpoints, force=args.force)
+
         if args.dry:
             from jip.cli import show_commands, show_dry
+            utils.show_plan(groups)
             show_dry(jobs)
             show_commands(jobs)
             return
 
         # all created and validated, time to run
+        history = History.open(project)
+        update_metrics = metrics.textfile(project) is not None
         for exe in jip.jobs.create_executions(jobs):
-            if exe.completed and not force:
+            if exe.completed and not args.force:
                 if not silent:
                     cli.warn("Skipping " + exe.name)
             else:
                 if not silent:
                     cli.warn("Running {name:30}".format(name=exe.name))
+                group = group_jobs(exe.job)
+                for job in group:
+                    checkpoints.start(job)
                 start = datetime.now()
-                success = jip.jobs.run_job(exe.job, profiler=profiler)
-                end = timedelta(seconds=(datetime.now() - start).seconds)
+                usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+                with profiling.phase('run_job'):
+                    success = jip.jobs.run_job(exe.job, profiler=profiler)
+                wall = datetime.now() - start
+                end = timedelta(seconds=wall.seconds)
+                if success:
+                    for job in group:
+                        checkpoints.record(job)
+                    self._record(history, exe.job, wall, usage,
+                                 project.config.get('name'))
+                if update_metrics:
+                    metrics.update_textfile(project, reload=True,
+                                            jobs=jobs)
                 if success:
                     if not silent:
                         cli.info(exe.job.state + " [%s]" % (end))
@@ -131,12 +178,41 @@ class RunCommand(GrapeCommand):
                     sys.exit(1)
         return True
 
+    def _record(self, history, job, wall, usage, project):
+        """Record the resources used by a job in the job history stores. The peak
+        memory of the job is known only if it is the highest peak of the
+        jobs run so far, because the operating system reports the maximum
+        over all terminated child processes.
+        """
+        import resource
+        from .history import job_run
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = (after.ru_utime + after.ru_stime) - \
+            (usage.ru_utime + usage.ru_stime)
+        rss = after.ru_maxrss if after.ru_maxrss > usage.ru_maxrss else None
+        seconds = wall.days * 86400 + wall.seconds + wall.microseconds / 1e6
+        run = job_run(job, wall=seconds, cpu=cpu, rss=rss, project=project)
+        try:
+            for store in history:
+                store.record([run])
+        except Exception, e:
+            cli.warn("Unable to record job history: %s" % str(e))
+
     def add(self, parser):
         parser.add_argument("datasets", default=["all"], nargs="*")
         parser.add_argument("--dry", default=False, action="store_true",
                             help="Show the pipeline graph and commands and exit")
+        parser.add_argument("--summary", default=False, action="store_true",
+                            help="Show the number of jobs, the existing "
+                                 "outputs and the requested CPU hours of "
+                                 "each tool without creating the jobs and "
+                                 "exit")
         parser.add_argument("--force", default=False, action="store_true",
                             help="Force computation of all jobs")
+        parser.add_argument("--incremental", default=False,
+                            action="store_true",
+                            help="Also run the jobs whose tool module "
+                                 "versions changed, and their descendants")
         parser.add_argument("--compute-stats", default=False, action="store_true",
                             help="Compute md5 sums and size for jobs output files")
         utils.add_default_job_configuration(parser,
@@ -148,20 +224,55 @@ class SubmitCommand(GrapeCommand):
     description = """Submit the pipeline on a set of data"""
 
     def run(self, args):
-        import time
         import tools
         import jip
-        from datetime import datetime, timedelta
+        from .cluster import Throttle, get_held_jobs
+        from .checkpoint import Checkpoints, update_states, group_jobs
+        from .jobs import delete as delete_jobs, deferred, defer
 
         force = args.force
+        throttle = Throttle(max_jobs=args.max_jobs, rate=args.rate)
 
-        jobs = utils.jip_prepare(args, submit=True)
+        if args.resume:
+            #####################################################
+            # Continue the submission of the jobs on hold
+            #####################################################
+            project, datasets = utils.get_project_and_datasets(args)
+            jip.db.init(project.jip_db)
+            names = None
+            if datasets == ['setup']:
+                # the project level jobs, see get_held_jobs
+                names = [None]
+            elif args.datasets and args.datasets != ['all']:
+                names = [d.id for d in datasets]
+            held = get_held_jobs(ids=deferred(project.jip_db),
+                                 datasets=names)
+            return self._submit(project.jip_db, held, throttle, args)
+
+        project, datasets = utils.get_project_and_datasets(args)
+        if args.summary:
+            from .dryrun import summarize
+            with profiling.phase('summary'):
+                summary = summarize(args, project, datasets)
+            utils.show_summary(summary)
+            return True
+        with profiling.phase('jip_prepare'):
+            jobs = utils.jip_prepare(args, submit=True, project=project,
+                                     datasets=datasets)
 
         if not jobs:
             return False
 
+        # only skip the jobs that are verifiably complete
+        with profiling.phase('checkpoints'):
+            checkpoints = Checkpoints.open(project,
+                                           incremental=args.incremental)
+            checkpoints.sync(jobs)
+            groups = update_states(jobs, checkpoints, force=force)
+
         if args.dry:
             from jip.cli import show_commands, show_dry
+            utils.show_plan(groups)
             show_dry(jobs)
             show_commands(jobs)
             return
@@ -171,41 +282,129 @@ class SubmitCommand(GrapeCommand):
             # Only save the jobs and let them stay on hold
             #####################################################
             jip.db.save(jobs)
+            # the ids of deleted jobs are reused
+            defer(project.jip_db, [j.id for j in jobs], False)
+            for group, reason in groups:
+                if reason:
+                    for job in group:
+                        checkpoints.start(job)
             print "Jobs stored and put on hold"
         else:
+            pending = []
             try:
                 #####################################################
                 # Iterate the executions and submit
                 #####################################################
-                for exe in jip.jobs.create_executions(jobs, save=True,
-                                                      check_outputs=not force,
-                                                      check_queued=not force):
-
-                    if exe.job.state == jip.db.STATE_DONE and not force:
-                        cli.warn("Skipping %s" % exe.name)
-                    else:
-                        if jip.jobs.submit_job(exe.job, force=force):
-                            cli.info("Submitted %s with remote id %s" % (
-                                exe.job.id, exe.job.job_id
-                            ))
-                return True
+                with profiling.phase('save'):
+                    for exe in jip.jobs.create_executions(
+                            jobs, save=True, check_outputs=not force,
+                            check_queued=not force):
+
+                        if exe.job.state == jip.db.STATE_DONE and not force:
+                            cli.warn("Skipping %s" % exe.name)
+                        else:
+                            for job in group_jobs(exe.job):
+                                checkpoints.start(job)
+                            pending.append(exe.job)
             except Exception as err:
                 cli.error("Error while submitting job: %s" % str(err))
-                ##################################################
-                # delete all submitted jobs
-                ##################################################
-                jip.jobs.delete(jobs, clean_logs=True)
-
+                delete_jobs(jobs, cluster=self._get_cluster())
+                return False
+            return self._submit(project.jip_db, pending, throttle, args,
+                                delete_on_error=jobs)
+
+    def _submit(self, path, pending, throttle, args, delete_on_error=None):
+        """Submit the pending jobs respecting the throttle limits. Jobs
+        that are not submitted stay on hold and are recorded in the jip
+        database, so they can be submitted later with the --continue
+        option.
+        """
+        import jip
+        from .checkpoint import group_jobs
+        from .jobs import delete as delete_jobs, defer
+        force = args.force
+        cluster = self._get_cluster()
+        submitted = 0
+        defer(path, [j.id for job in pending for j in group_jobs(job)])
+        try:
+            for chunk in throttle.feed(pending, wait=not args.no_wait):
+                if hasattr(cluster, 'submit_array'):
+                    from .cluster import submit_arrays
+                    with profiling.phase('scheduler'):
+                        for array_id, group in submit_arrays(chunk, cluster,
+                                                             force=force):
+                            cli.info("Submitted %d jobs with remote array "
+                                     "id %s" % (len(group), array_id))
+                            submitted += len(group)
+                            throttle.tick()
+                else:
+                    from .cluster import submit_job
+                    with profiling.phase('scheduler'):
+                        for job in chunk:
+                            if submit_job(job, cluster, force=force):
+                                cli.info("Submitted %s with remote id %s" % (
+                                    job.id, job.job_id
+                                ))
+                                submitted += 1
+                                throttle.tick()
+        except Exception as err:
+            cli.error("Error while submitting job: %s" % str(err))
+            if throttle.enabled or args.resume or not delete_on_error:
+                cli.warn("%d jobs left on hold. Use 'grape submit "
+                         "--continue' to submit them" % (len(pending) -
+                                                          submitted))
+                return False
+            ##################################################
+            # delete all submitted jobs
+            ##################################################
+            delete_jobs(delete_on_error, cluster=cluster)
+            return False
+        finally:
+            defer(path, [j.id for job in pending
+                         if job.state != jip.db.STATE_HOLD
+                         for j in group_jobs(job)], False)
+        if submitted < len(pending):
+            cli.warn("Maximum number of active jobs reached. %d jobs left on "
+                     "hold. Use 'grape submit --continue' to submit "
+                     "them" % (len(pending) - submitted))
+        return True
 
     def add(self, parser):
         parser.add_argument("--dry", default=False, action="store_true",
                             help="Show the pipeline graph and commands and exit")
+        parser.add_argument("--summary", default=False, action="store_true",
+                            help="Show the number of jobs, the existing "
+                                 "outputs and the requested CPU hours of "
+                                 "each tool without creating the jobs and "
+                                 "exit")
         parser.add_argument("--hold", default=False, action="store_true",
                             help="Submit and hold the jobs")
         parser.add_argument("--force", default=False, action="store_true",
                             help="Force job submission")
+        parser.add_argument("--incremental", default=False,
+                            action="store_true",
+                            help="Also submit the jobs whose tool module "
+                                 "versions changed, and their descendants")
         parser.add_argument("--compute-stats", default=False, action="store_true",
                             help="Compute md5 sums and size for jobs output files")
+        parser.add_argument("--max-jobs", dest="max_jobs", type=int,
+                            help="Maximum number of queued and running jobs. "
+                                 "Submission waits for jobs to finish when "
+                                 "the limit is reached")
+        parser.add_argument("--rate", type=float,
+                            help="Maximum number of submissions per minute")
+        parser.add_argument("--no-wait", dest="no_wait", default=False,
+                            action="store_true",
+                            help="Do not wait for jobs to finish when the "
+                                 "maximum number of jobs is reached. The "
+                                 "remaining jobs stay on hold")
+        parser.add_argument("--continue", dest="resume", default=False,
+                            action="store_true",
+                            help="Submit the jobs left on hold by a "
+                                 "previous submission or restarted with "
+                                 "'grape jobs --restart'. Jobs stored with "
+                                 "--hold are submitted only once "
+                                 "restarted")
         parser.add_argument("datasets", default=["all"], nargs="*")
         utils.add_default_job_configuration(parser,
                                             add_cluster_parameter=True)
@@ -213,25 +412,338 @@ class SubmitCommand(GrapeCommand):
 
 class JobsCommand(GrapeCommand):
     name = "jobs"
-    description = """List and modify grape jobs"""
+    description = """Summarize, cancel, restart or delete the grape jobs"""
 
     def run(self, args):
         import jip
-        project, datasets = utils.get_project_and_datasets(args)
-        # setup jip db
-        jip.db.init(project.jip_db)
+        from . import jobs
+        project = Project.find()
+        if not project or not project.exists():
+            raise utils.CommandError("No grape project found!")
+        if args.action:
+            return self._update(project, args)
+        if args.list or args.expand:
+            # setup jip db
+            jip.db.init(project.jip_db)
+            try:
+                import runpy
+                argv = ["jip-jobs"] + ['--expand'] if args.expand else []
+                sys.argv = argv # reset options
+                runpy.run_module("jip.cli.jip_jobs", run_name="__main__")
+            except ImportError:
+                cli.error("Import error. Here is the exception:",
+                          exc_info=True)
+            return
+        summary = lambda: jobs.summary(project.jip_db, by=args.by,
+                                       states=args.states,
+                                       datasets=args.datasets)
+        if not args.watch:
+            self._summary(summary(), args.by)
+            return True
+        import time
+        # only query the database again when it changed
+        version = previous = None
         try:
-            import runpy
-            argv = ["jip-jobs"] + ['--expand'] if args.expand else []
-            sys.argv = argv # reset options
-            runpy.run_module("jip.cli.jip_jobs", run_name="__main__")
-        except ImportError:
-            cli.error("Import error. Here is the exception:",
-                      exc_info=True)
+            while True:
+                current = jobs.version(project.jip_db)
+                if previous is None or current != version:
+                    version = current
+                    counts = summary()
+                    if sys.stdout.isatty():
+                        sys.stdout.write("\x1b[H\x1b[2J")
+                    print time.strftime("%H:%M:%S")
+                    self._summary(counts, args.by, previous)
+                    sys.stdout.flush()
+                    previous = jobs.totals(counts)
+                time.sleep(args.interval)
+        except KeyboardInterrupt:
+            pass
+        return True
+
+    def _update(self, project, args):
+        """Cancel, restart or delete the selected jobs and the jobs that
+        depend on them"""
+        import jip
+        from jip.cli import confirm
+        from . import jobs
+        ids = jobs.select(project.jip_db, states=args.states,
+                          datasets=args.datasets)
+        if not ids:
+            cli.warn("No jobs found")
+            return True
+        ids = jobs.related(project.jip_db, ids)
+        if not args.yes and not confirm("Are you sure you want to %s %d "
+                                        "jobs" % (args.action, len(ids)),
+                                        False):
+            return False
+        jip.db.init(project.jip_db)
+        cluster = self._get_cluster()
+        if args.action == 'cancel':
+            updated = jobs.cancel(jobs.load(ids), cluster=cluster)
+            cli.info("Canceled %d jobs" % len(updated))
+        elif args.action == 'restart':
+            updated = jobs.restart(jobs.load(ids), cluster=cluster)
+            cli.info("%d jobs on hold. Use 'grape submit --continue' "
+                     "to submit them" % len(updated))
+        else:
+            updated = jobs.delete(jobs.load(ids), cluster=cluster)
+            cli.info("Deleted %d jobs" % len(updated))
+        return True
+
+    def _summary(self, counts, by, previous=None):
+        from jip.cli import render_table
+        from . import jobs
+        states = jobs.states(counts)
+        rows = []
+        for group in sorted(counts, key=lambda g: (g is None, g)):
+            row = counts[group]
+            rows.append([group or "-"] + [row.get(s, 0) for s in states] +
+                        [sum(row.values())])
+        if rows:
+            print render_table([by.capitalize()] + states + ["Total"], rows)
+        totals = jobs.totals(counts)
+        line = []
+        for state in jobs.states({None: dict(previous or {}, **totals)}):
+            count = totals.get(state, 0)
+            change = count - previous.get(state, 0) if previous else 0
+            line.append("%s: %d%s" % (state, count,
+                                      " (%+d)" % change if change else ""))
+        print "%d jobs%s" % (sum(totals.values()),
+                             ". " + ", ".join(line) if line else "")
 
     def add(self, parser):
+        parser.add_argument("--state", dest="states", default=None,
+                            action="append", type=str.capitalize,
+                            help="Only select the jobs in the given state. "
+                                 "Can be repeated")
+        parser.add_argument("-d", "--dataset", dest="datasets", default=None,
+                            action="append",
+                            help="Only select the jobs of the given "
+                                 "dataset. Can be repeated")
+        parser.add_argument("--by", default="tool",
+                            choices=["tool", "dataset"],
+                            help="Count the jobs of each tool or of each "
+                                 "dataset. Default: tool")
+        parser.add_argument("--watch", default=False, action="store_true",
+                            help="Refresh the summary when the jobs change")
+        parser.add_argument("--interval", default=2.0, type=float,
+                            help="The number of seconds between the checks "
+                                 "for changes with --watch. Default: 2")
+        action = parser.add_mutually_exclusive_group()
+        action.add_argument("--cancel", dest="action", default=None,
+                            action="store_const", const="cancel",
+                            help="Cancel the selected jobs that are not "
+                                 "finished and the jobs that depend on them")
+        action.add_argument("--restart", dest="action",
+                            action="store_const", const="restart",
+                            help="Put the selected jobs and the jobs that "
+                                 "depend on them back on hold, to submit "
+                                 "them again with 'grape submit --continue'")
+        action.add_argument("--delete", dest="action",
+                            action="store_const", const="delete",
+                            help="Delete the selected jobs, the jobs that "
+                                 "depend on them and their log files")
+        parser.add_argument("-y", "--yes", default=False, action="store_true",
+                            help="Do not ask for confirmation")
+        parser.add_argument("--list", default=False, action="store_true",
+                            help="List the jobs with jip instead of showing "
+                                 "the summary")
         parser.add_argument("--expand", default=False, action="store_true",
-                            dest="expand", help="Do not collapse pipeline jobs")
+                            dest="expand", help="List the jobs and do not "
+                                                "collapse pipeline jobs")
+
+class StatsCommand(GrapeCommand):
+    name = "stats"
+    description = """Show project statistics"""
+
+    def run(self, args):
+        import jip
+        from .history import History
+        project = Project.find()
+        if not project or not project.exists():
+            raise utils.CommandError("No grape project found!")
+        stores = History.open(project)
+        if args.site and len(stores) < 2:
+            raise utils.CommandError("No site-level job history found!")
+        if not args.site:
+            stores = stores[:1]
+        # record the finished jobs submitted to the cluster
+        jip.db.init(project.jip_db)
+        for store in stores:
+            store.sync(project=project.config.get('name'))
+        self._jobs(stores[-1].summary(), args.human)
+        return True
+
+    def _jobs(self, summary, human=False):
+        from jip.cli import render_table
+
+        def fmt(value, size=False):
+            if value is None:
+                return "-"
+            if human and size and value > 1:
+                return grapeutils.human_fmt(float(value), size)
+            return "%.0f" % value
+
+        rows = []
+        for s in summary:
+            rows.append((s['tool'], s['runs'], fmt(s['wall']), fmt(s['cpu']),
+                         fmt(s['rss'] * 1024 if s['rss'] else None, True),
+                         fmt(s['input_bytes'], True),
+                         fmt(s['output_bytes'], True),
+                         fmt(s['throughput'], True)))
+        print render_table(["Tool", "Runs", "Wall (s)", "CPU (s)",
+                            "Max RSS", "Input", "Output", "Input/s"], rows)
+        print "Max RSS is the peak memory of the largest process of a job. " \
+              "'grape run' records it only for the jobs whose peak is higher " \
+              "than the peaks of the jobs run before them, so the memory " \
+              "estimates are based on the larger jobs."
+
+    def add(self, parser):
+        parser.add_argument("what", choices=["jobs"],
+                            help="The statistics to show")
+        parser.add_argument("--site", default=False, action="store_true",
+                            help="Show the site-level job history")
+        parser.add_argument('--human', dest='human', default=False,
+                            action='store_true',
+                            help='Use human readable sizes')
+
+
+class MetricsCommand(GrapeCommand):
+    name = "metrics"
+    description = """Export the pipeline metrics in the Prometheus text format"""
+
+    def run(self, args):
+        import jip
+        from . import metrics
+        from .history import History
+        project = Project.find()
+        if not project or not project.exists():
+            raise utils.CommandError("No grape project found!")
+        # record the finished jobs submitted to the cluster
+        jip.db.init(project.jip_db)
+        history = History.open(project)[0]
+        history.sync(project=project.config.get('name'))
+        history.close()
+        project.load()
+
+        if args.serve:
+            host, _, port = args.serve.rpartition(":")
+            try:
+                port = int(port)
+            except ValueError:
+                raise utils.CommandError("Invalid port: %s" % args.serve)
+            cli.info("Serving the metrics on http://%s:%d/metrics" % (
+                host or '127.0.0.1', port))
+            metrics.serve(project, host or '127.0.0.1', port)
+            return True
+
+        text = metrics.render(metrics.collect(project))
+        output = args.output or metrics.textfile(project) or '-'
+        if output == '-':
+            sys.stdout.write(text)
+        else:
+            metrics.write_textfile(output, text)
+        return True
+
+    def add(self, parser):
+        parser.add_argument("-o", "--output", default=None,
+                            help="The metrics file. Use - for the standard "
+                                 "output. Default: the project file in "
+                                 "GRAPE_METRICS_DIR if set, otherwise the "
+                                 "standard output")
+        parser.add_argument("--serve", metavar="[HOST:]PORT", default=None,
+                            help="Serve the metrics on "
+                                 "http://HOST:PORT/metrics. The default "
+                                 "host is 127.0.0.1")
+
+
+class ReportCommand(GrapeCommand):
+    name = "report"
+    description = """Show the mapping statistics of the datasets"""
+
+    def run(self, args):
+        from jip.cli import render_table
+        from .mapstats import report
+        project, datasets = utils.get_project_and_datasets(args)
+        summary, total = report(datasets)
+        if not summary:
+            cli.warn("No mapping statistics found")
+            return False
+
+        def pct(value, reads):
+            return "%.2f%%" % (100.0 * value / reads) if reads else "-"
+
+        rows = []
+        for s in summary + [total]:
+            multi = s['mapped'] - s['unique']
+            rows.append((s['id'], s['reads'], pct(s['mapped'], s['reads']),
+                         pct(s['unique'], s['reads']),
+                         pct(multi, s['reads']),
+                         pct(s['split'], s['reads'])))
+        print render_table(["Dataset", "Reads", "Mapped", "Unique",
+                            "Multimaps", "Split"], rows)
+        return True
+
+    def add(self, parser):
+        parser.add_argument("datasets", default=["all"], nargs="*")
+
+
+class QuantifyCommand(GrapeCommand):
+    name = "quantify"
+    description = """Build the transcript expression matrix of the datasets"""
+
+    def run(self, args):
+        from .quantify import build_matrix, build_matrix_file
+        project, datasets = utils.get_project_and_datasets(args)
+        try:
+            if args.format == 'matrix':
+                output = args.output or os.path.join(
+                    project.path, 'expression.%s.mtx' % args.value)
+                rows, cols = build_matrix_file(output, project, datasets,
+                                               value=args.value,
+                                               cache=not args.no_cache,
+                                               log=cli.warn)
+                cli.info("Written %d transcripts x %d samples to %s" % (
+                    rows, cols, output))
+                return cols > 0
+            matrix = build_matrix(project, datasets, value=args.value,
+                                  cache=not args.no_cache, log=cli.warn)
+        except ValueError, e:
+            raise utils.CommandError(str(e))
+        if not matrix.samples:
+            cli.warn("No transcript quantifications found")
+            return False
+        if args.format == 'npz':
+            if not args.output:
+                raise utils.CommandError("Please specify an output file for "
+                                         "the npz format")
+            matrix.save_npz(args.output)
+        else:
+            out = sys.stdout if not args.output else open(args.output, 'w')
+            try:
+                matrix.write_tsv(out)
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+        return True
+
+    def add(self, parser):
+        from .quantify import VALUES
+        parser.add_argument("datasets", default=["all"], nargs="*")
+        parser.add_argument("-v", "--value", default="RPKM", choices=VALUES,
+                            help="The expression value. Default: RPKM")
+        parser.add_argument("-o", "--output", default=None,
+                            help="The output file. Default: stdout")
+        parser.add_argument("-f", "--format", default="tsv",
+                            choices=["tsv", "npz", "matrix"],
+                            help="The output format. The memory mapped "
+                                 "matrix format is written to "
+                                 "<project>/expression.<value>.mtx by "
+                                 "default. Default: tsv")
+        parser.add_argument("--no-cache", dest="no_cache", default=False,
+                            action="store_true",
+                            help="Parse all transcript files again")
+
 
 class ConfigCommand(GrapeCommand):
     name = "config"
@@ -583,7 +1095,7 @@ def _add_command(command, command_parser):
     """
     subparser = command_parser.add_parser(command.name,
                                           help=command.description)
-    subparser.set_defaults(func=command.run)
+    subparser.set_defaults(func=command.run, command_name=command.name)
     command.add(subparser)
 
 
@@ -596,6 +1108,16 @@ def main():
     parser = argparse.ArgumentParser(prog="grape")
     parser.add_argument('-v', '--version', action='version',
                         version='grape %s' % (__version__))
+    parser.add_argument('--profile', action='store_const', const='timers',
+                        default=os.environ.get('GRAPE_PROFILE'),
+                        help="Time the phases of the command and write a "
+                             "report to the .grape/profiles folder. Can "
+                             "also be enabled with GRAPE_PROFILE=1")
+    parser.add_argument('--cprofile', dest='profile', action='store_const',
+                        const='cprofile',
+                        help="Like --profile, and also run the command with "
+                             "cProfile. Can also be enabled with "
+                             "GRAPE_PROFILE=cprofile")
 
     # add commands
     command_parsers = parser.add_subparsers()
@@ -606,13 +1128,23 @@ def main():
     _add_command(SubmitCommand(), command_parsers)
     _add_command(ConfigCommand(), command_parsers)
     _add_command(JobsCommand(), command_parsers)
+    _add_command(StatsCommand(), command_parsers)
+    _add_command(MetricsCommand(), command_parsers)
+    _add_command(QuantifyCommand(), command_parsers)
+    _add_command(ReportCommand(), command_parsers)
     _add_command(ImportCommand(), command_parsers)
     _add_command(ListToolsCommand(), command_parsers)
     _add_command(ExportCommand(), command_parsers)
 
     args = parser.parse_args()
     try:
-        if not args.func(args):
+        profiling.start(profiling.get_mode(args.profile))
+    except ValueError, e:
+        parser.error(str(e))
+    try:
+        with profiling.phase(args.command_name):
+            success = args.func(args)
+        if not success:
             sys.exit(1)
     except KeyboardInterrupt:
         pass
@@ -627,6 +1159,10 @@ def main():
             sys.exit(1)
         else:
             raise e
+    finally:
+        report = profiling.finish(args.command_name)
+        if report:
+            cli.info("Profile written to %s" % report)
 
 
 
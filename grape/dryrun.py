@@ -0,0 +1,163 @@
+"""Grape dry run summary
+
+Creating the jobs of a large project renders the templates of all the tool
+options for every sample and merges the jobs shared by the samples, which
+makes `grape run --dry` slow. The summary planner expands the pipeline only
+once for each group of datasets with the same input folder and file naming,
+using :py:data:`SAMPLE` as the sample name. The jobs of each dataset are
+derived from the expanded jobs by replacing the placeholder with the sample
+name, and their resources are planned from the dataset input sizes.
+"""
+import os
+import re
+
+#: the placeholder for the sample name in the expanded pipelines
+SAMPLE = '__grape_sample__'
+
+
+def sample_name(path):
+    """Return the sample name the pipeline derives from a fastq file, i.e.
+    the file name without the last two extensions and the mate suffix
+
+    :param path: the fastq file
+    """
+    name = os.path.basename(path)
+    for _ in range(2):
+        i = name.rfind('.')
+        if i > 0:
+            name = name[:i]
+    return re.sub("[_-][12]", "", name)
+
+
+def placeholder(path):
+    """Return the path of a fastq file with the sample name replaced by
+    :py:data:`SAMPLE` or None if the sample name can not be replaced
+
+    :param path: the fastq file
+    """
+    name = sample_name(path)
+    base = os.path.basename(path)
+    if not name or not base.startswith(name):
+        return None
+    result = os.path.join(os.path.dirname(path), SAMPLE + base[len(name):])
+    return result if sample_name(result) == SAMPLE else None
+
+
+def group_datasets(datasets):
+    """Group the datasets by the placeholder path of their first fastq file.
+    Returns a list of (fastq, [(dataset, sample)]) tuples where the sample
+    is None for datasets whose files can not be expressed with the
+    placeholder; their groups contain the real file.
+
+    :param datasets: the datasets
+    """
+    groups = []
+    index = {}
+    for dataset in datasets:
+        fastq = os.path.abspath(sorted(dataset.fastq.keys())[0])
+        key = placeholder(fastq)
+        sample = sample_name(fastq) if key else None
+        key = key or fastq
+        if key not in index:
+            index[key] = []
+            groups.append((key, index[key]))
+        index[key].append((dataset, sample))
+    return groups
+
+
+def substitute(value, sample):
+    """Replace the :py:data:`SAMPLE` placeholder in a string
+
+    :param value: the string
+    :param sample: the sample name or None
+    """
+    if sample is None or value is None:
+        return value
+    return value.replace(SAMPLE, sample)
+
+
+class Summary(object):
+    """The job counts, output files and requested CPU hours of each tool
+    """
+
+    def __init__(self):
+        self.tools = {}
+        self._seen = set()
+
+    def add(self, job, sample=None):
+        """Add a job unless an identical job was already added. The
+        placeholder in the job name and output files is replaced with the
+        sample name.
+
+        :param job: the job
+        :param sample: the sample name
+        """
+        outputs = sorted(set(substitute(os.path.abspath(f), sample)
+                             for f in job.get_output_files()))
+        key = (job.tool_name, substitute(job.name, sample), tuple(outputs))
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        tool = self.tools.setdefault(job.tool_name, {
+            'tool': job.tool_name, 'jobs': 0, 'outputs': 0, 'existing': 0,
+            'cpu_hours': 0.0})
+        tool['jobs'] += 1
+        tool['outputs'] += len(outputs)
+        tool['existing'] += len([o for o in outputs if os.path.exists(o)])
+        tool['cpu_hours'] += (job.threads or 1) * (job.max_time or 0) / 60.0
+        return True
+
+    def rows(self):
+        """Return the tool summaries sorted by tool name and the total"""
+        rows = [self.tools[t] for t in sorted(self.tools)]
+        total = {'tool': 'Total', 'jobs': 0, 'outputs': 0, 'existing': 0,
+                 'cpu_hours': 0.0}
+        for row in rows:
+            for k in ['jobs', 'outputs', 'existing', 'cpu_hours']:
+                total[k] += row[k]
+        return rows, total
+
+
+def summarize(args, project, datasets):
+    """Plan the jobs of the default pipeline for the given datasets and
+    return their :py:class:`Summary`
+
+    :param args: the command line arguments
+    :param project: the project
+    :param datasets: the datasets
+    """
+    import jip
+    from .grape import Grape
+    from .resources import ResourcePlanner
+    from .cli.utils import get_resource_planner, get_pipeline_args, \
+        get_user_job_config
+
+    jip.db.init(project.jip_db)
+    planner = get_resource_planner(args, project, datasets)
+    jargs = get_pipeline_args(args, project, datasets, planner)
+    grape = Grape()
+    user_config = get_user_job_config(args)
+    summary = Summary()
+    for fastq, members in group_datasets(datasets):
+        p = jip.Pipeline()
+        jargs['fastq'] = [fastq]
+        p.run('grape_gem_rnapipeline', **jargs)
+        jobs = jip.jobs.create_jobs(p, validate=False)
+        for dataset, sample in members:
+            dataset_planner = None
+            if planner is not None:
+                sizes = dict(planner.sizes)
+                for f in dataset.fastq.keys():
+                    path = os.path.abspath(f)
+                    if sample:
+                        path = placeholder(path) or path
+                    sizes[path] = planner.file_size(f)
+                dataset_planner = ResourcePlanner(profiles=planner.profiles,
+                                                  sizes=sizes,
+                                                  history=planner.history)
+            for job in jobs:
+                grape.configure_job(job, project=project,
+                                    user_config=user_config,
+                                    planner=dataset_planner)
+                summary.add(job, sample)
+    return summary
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""Grape Flux Capacitor output splitter
+
+Split the Flux Capacitor GTF output by feature type in a single pass. One
+buffered writer is kept open per feature type and the declared outputs,
+`<input>.transcript.gtf`, `<input>.junction.gtf` and `<input>.intron.gtf`,
+where `<input>` is the input path without the `.gtf` extension, are always
+created, even if the input contains no records for a feature. Records of
+other feature types are written to `<input>.<feature>.gtf`.
+
+Usage::
+
+    python -m grape.fluxsplit -i <input> [-z] [-n <name>] [--update-index]
+"""
+import os
+import sys
+
+#: the feature types that are always written
+FEATURES = ['transcript', 'junction', 'intron']
+
+#: the write buffer size for each output file
+BUFFER_SIZE = 1024 * 1024
+
+
+def output_prefix(input):
+    """Return the output prefix for an input file, that is the input path
+    without the `.gtf` extension
+
+    :param input: the input path
+    """
+    base, ext = os.path.splitext(input)
+    return base if ext == '.gtf' else input
+
+
+def output_path(prefix, feature, compress=False):
+    """Return the output path for a feature
+
+    :param prefix: the output prefix
+    :param feature: the feature type
+    :param compress: True if the output is compressed
+    """
+    return "%s.%s.gtf%s" % (prefix, feature, '.gz' if compress else '')
+
+
+def _open(path, compress=False):
+    if compress:
+        import gzip
+        return gzip.GzipFile(path, 'wb', 6, open(path, 'wb', BUFFER_SIZE))
+    return open(path, 'wb', BUFFER_SIZE)
+
+
+def split_features(input, prefix, features=None, compress=False):
+    """Split a GTF stream by feature type and return a dictionary with the
+    written files. The dictionary maps the feature type to a tuple with the
+    output path and the number of lines written.
+
+    :param input: the input file object
+    :param prefix: the output prefix
+    :param features: the feature types that are always written. Defaults to
+        :py:data:`FEATURES`
+    :param compress: compress the output files with gzip
+    """
+    if features is None:
+        features = FEATURES
+    writers = {}
+    counts = {}
+    try:
+        for feature in features:
+            writers[feature] = _open(output_path(prefix, feature, compress),
+                                     compress)
+            counts[feature] = 0
+        for line in input:
+            fields = line.split('\t', 3)
+            if len(fields) < 4:
+                continue
+            feature = fields[2]
+            writer = writers.get(feature)
+            if writer is None:
+                writer = writers[feature] = _open(
+                    output_path(prefix, feature, compress), compress)
+                counts[feature] = 0
+            writer.write(line)
+            counts[feature] += 1
+    finally:
+        for writer in writers.values():
+            fileobj = getattr(writer, 'fileobj', None)
+            writer.close()
+            if fileobj is not None:
+                fileobj.close()
+    return dict((f, (output_path(prefix, f, compress), c))
+                for f, c in counts.items())
+
+
+def update_index(outputs, name, path=None):
+    """Register the split files with their line counts in the index of the
+    grape project containing the given path
+
+    :param outputs: the dictionary returned by :py:func:`split_features`
+    :param name: the dataset id
+    :param path: the path used to find the project
+    :returns: True if a project was found and updated
+    """
+    from .grape import Project
+    from .grapeindex import add_files
+
+    project = Project.find(os.path.abspath(path or os.getcwd()))
+    if project is None:
+        return False
+    files = []
+    for feature, (output, lines) in sorted(outputs.items()):
+        files.append({
+            'path': os.path.abspath(output),
+            'type': 'gtf',
+            'view': feature,
+            # the index writes false values as NA
+            'lines': str(lines),
+        })
+    add_files(project, name, files)
+    return True
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="python -m grape.fluxsplit",
+        description="Split the Flux Capacitor output by feature type")
+    parser.add_argument("-i", "--input", required=True,
+                        help="The Flux Capacitor GTF file")
+    parser.add_argument("-z", "--gzip", dest="compress", default=False,
+                        action="store_true", help="Compress the output")
+    parser.add_argument("-n", "--name", default=None,
+                        help="The dataset id used to update the index")
+    parser.add_argument("--update-index", dest="update_index", default=False,
+                        action="store_true",
+                        help="Add the outputs and their line counts to the "
+                             "project index")
+    args = parser.parse_args(argv)
+
+    with open(args.input, 'rb', BUFFER_SIZE) as input:
+        outputs = split_features(input, output_prefix(args.input),
+                                 compress=args.compress)
+    if args.update_index and args.name:
+        if not update_index(outputs, args.name, os.path.dirname(args.input)):
+            sys.stderr.write("No grape project found, index not updated\n")
+
+
+if __name__ == "__main__":
+    main()
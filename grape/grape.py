@@ -6,11 +6,41 @@ from . import utils
 #from indexfile.index import *
 from grapeindex import GrapeIndex
 
+#: cache for the parsed configuration files. The cache maps the file path
+#: to a tuple with the file modification time and the parsed content
+_config_cache = {}
+
+#: cache for the cluster instances created from the configuration
+_cluster_cache = {}
+
+
 class GrapeError(Exception):
     """Base grape error"""
     pass
 
 
+def load_json(path):
+    """Load a json file and return its content. The parsed content is
+    cached and reused as long as the file modification time does not change.
+    Returns None if the file does not exist.
+
+    Note that the returned content is shared and must not be modified.
+
+    :param path: the path to the json file
+    """
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    cached = _config_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with open(path, "r") as f:
+        data = json.load(f)
+    _config_cache[path] = (mtime, data)
+    return data
+
+
 class Grape(object):
     """Grape main class to run and submit pipelines"""
 
@@ -19,11 +49,17 @@ class Grape(object):
         self.home = os.getenv("GRAPE_HOME", None)
         self._default_job_config = None
         self._user_job_config = None
+        self._tool_job_config = {}
 
-    def configure_job(self, tool, project=None, dataset=None, user_config=None):
+    def configure_job(self, tool, project=None, dataset=None, user_config=None,
+                      planner=None):
         """Apply job configuration to this tool. The configuration
         is loaded first from the grape_home, then from the user home.
-        Lastly, if specified, the user_config is applied to the job.
+        If a resource planner is specified, the planned resources are
+        applied next. Lastly, if specified, the user_config is applied to
+        the job, unless the job is piped from another job. Piped jobs run in
+        the cluster job of the first job of the pipe chain, which is the
+        only one submitted.
 
         In addition to the job configuration, grape specific attributes are
         set. This includes:
@@ -33,7 +69,7 @@ class Grape(object):
         import jip
 
         job = tool
-        name = None
+        name = getattr(tool, 'tool_name', None)
 
         try:
             job = tool.job
@@ -41,14 +77,6 @@ class Grape(object):
         except:
             pass
 
-        # load configuration lazily once
-        if self._default_job_config is None:
-            self._default_job_config = self.__load_configuration("jobs.json",
-                                                                 use_global=True)
-        if self._user_job_config is None:
-            self._user_job_config = self.__load_configuration("jobs.json",
-                                                              use_global=False)
-
         # apply configuration in order
         #
         # 0. hardocoded configuration for all jobs
@@ -59,24 +87,46 @@ class Grape(object):
         if project is not None:
             job.logdir = project.logdir()
 
-        # 2. the global default
-        self.__apply_job_config(job, self._default_job_config.get("default",
-                                                                   None))
-
-        # 3. the global configuration for the tool based on the tool name
-        self.__apply_job_config(job, self._default_job_config.get(name,
-                                                                   None))
-
-        # 4. the user default
-        self.__apply_job_config(job, self._user_job_config.get("default",
-                                                                None))
-        # 5. the user configuration for the tool based on the tool name
-        self.__apply_job_config(job, self._user_job_config.get(name,
-                                                                None))
-        # 6. user specified overrides
-        if user_config is not None:
+        # 2. the merged global and user configuration for the tool
+        self.__apply_job_config(job, self._get_tool_job_config(name))
+
+        # 3. the resources planned from the job input size
+        if planner is not None:
+            self.__apply_job_config(job, planner.plan_job(job))
+
+        # 4. user specified overrides for the submitted jobs
+        if user_config is not None and not getattr(job, 'pipe_from', None):
             self.__apply_job_config(job, user_config)
 
+    def _get_tool_job_config(self, name):
+        """Return the job configuration for the tool with the given name.
+        The configuration merges, in order, the global default, the global
+        tool configuration, the user default and the user tool
+        configuration. The merged configuration is computed once per tool.
+        """
+        if name in self._tool_job_config:
+            return self._tool_job_config[name]
+
+        # load configuration lazily once
+        if self._default_job_config is None:
+            self._default_job_config = self.__load_configuration("jobs.json",
+                                                                 use_global=True)
+        if self._user_job_config is None:
+            self._user_job_config = self.__load_configuration("jobs.json",
+                                                              use_global=False)
+        merged = {}
+        for cfg in [self._default_job_config.get("default", None),
+                    self._default_job_config.get(name, None),
+                    self._user_job_config.get("default", None),
+                    self._user_job_config.get(name, None)]:
+            if cfg is None:
+                continue
+            for k, v in cfg.items():
+                if v is not None:
+                    merged[k] = v
+        self._tool_job_config[name] = merged
+        return merged
+
     def __apply_job_config(self, job, cfg):
         if cfg is None:
             return
@@ -96,6 +146,11 @@ class Grape(object):
         if len(cfg) == 0:
             raise GrapeError("No cluster configuration found!")
 
+        key = json.dumps(cfg, sort_keys=True)
+        if key in _cluster_cache:
+            return _cluster_cache[key]
+
+        cfg = dict(cfg)
         class_name = cfg.get("class", None)
         if class_name is None:
             raise GrapeError("No cluster class specified!")
@@ -112,6 +167,7 @@ class Grape(object):
         except Exception, e:
             raise GrapeError("Error while loading cluster implementation: "
                              "%s" % (str(e)))
+        _cluster_cache[key] = cluster
         return cluster
 
     def __load_configuration(self, name, use_global=True):
@@ -120,7 +176,9 @@ class Grape(object):
         conf directory, otherwise it checks for the users .grape folder.
 
         An empty dict is returned if the requested configuration file does not
-        exist.
+        exist. The configuration is parsed and filtered once per process as
+        long as the file does not change and the returned dictionary is
+        shared, so it must not be modified.
 
         :param name: the name of the configuration file relative to the conf
             directory.
@@ -134,16 +192,20 @@ class Grape(object):
             base = os.path.join(os.path.expanduser("~"), ".grape")
 
         conf_file = os.path.join(base, name)
-        if not os.path.exists(conf_file):
+        ret = load_json(conf_file)
+        if ret is None:
             return {}
 
-        with open(conf_file, "r") as f:
-            ret = json.load(f)
-            res = {}
-            for k, v in ret.items():
-                if v is not None and v != "":
-                    res[k] = v
-            return res
+        key = (conf_file, "filtered")
+        cached = _config_cache.get(key)
+        if cached is not None and cached[0] is ret:
+            return cached[1]
+        res = {}
+        for k, v in ret.items():
+            if v is not None and v != "":
+                res[k] = v
+        _config_cache[key] = (ret, res)
+        return res
 
 
 class Project(object):
@@ -269,6 +331,24 @@ class Project(object):
             jip_db_file = os.path.join(self.path, '.grape', 'grape_jp.db')
         return jip_db_file
 
+    @property
+    def history_db(self):
+        """Return the path to the job history database of the project
+        """
+        return os.path.join(self.path, '.grape', 'history.db')
+
+    @property
+    def checkpoints(self):
+        """Return the path to the job checkpoints folder of the project
+        """
+        return os.path.join(self.path, '.grape', 'checkpoints')
+
+    @property
+    def profiles(self):
+        """Return the path to the profiling reports folder of the project
+        """
+        return os.path.join(self.path, '.grape', 'profiles')
+
     @property
     def formatfile(self):
         """Return the path to the json file describing the format for the project index
@@ -555,8 +635,9 @@ class Config(object):
         if grape_home:
             global_config = os.path.join(grape_home,'conf','stats.json')
 
-            if os.path.exists(global_config):
-                self.stats = json.load(open(global_config,'r'))
+            stats = load_json(global_config)
+            if stats is not None:
+                self.stats = dict(stats)
 
         self.data['name'] = 'Default project'
         self.stats['user'] = pwd.getpwuid(os.getuid()).pw_name
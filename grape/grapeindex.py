@@ -30,6 +30,89 @@ class GrapeIndex(Index):
 
 
 
+def add_fileinfo(project, keys):
+    """Add keys to the file information keys of the project index format.
+    The format is saved to the project format file, so the keys are read
+    back as file information when the project is loaded. Keys that are not
+    in the format are otherwise stored as dataset metadata.
+
+    :param project: the project
+    :type project: grape.Project
+    :param keys: the keys
+    """
+    import json
+    index = project.index
+    fileinfo = list(index.format.get('fileinfo') or [])
+    missing = [k for k in keys if k not in fileinfo and k != 'id']
+    if not missing:
+        return False
+    index.format = dict(index.format, fileinfo=fileinfo + sorted(set(missing)))
+    with open(project.formatfile, 'w') as f:
+        json.dump(index.format, f, indent=2)
+    return True
+
+
+def add_files(project, id, files, update=True):
+    """Add files to a dataset of the project index. The index is locked,
+    reloaded to pick up concurrent changes and saved. Keys of the file
+    information that are not in the index format are added to it, see
+    :py:func:`add_fileinfo`.
+
+    :param project: the project
+    :type project: grape.Project
+    :param id: the dataset id
+    :param files: list of dictionaries with the file information. Each
+        dictionary must contain at least the `path` and the `type` keys
+    :param update: update existing entries
+    """
+    index = project.index
+    try:
+        index.lock()
+        if os.path.exists(project.indexfile):
+            project.load()
+            index = project.index
+        add_fileinfo(project, set(k for info in files for k in info))
+        for info in files:
+            index.insert(update=update, id=id, **info)
+        index.save()
+    finally:
+        index.release()
+
+
+def update_files(project, id, paths):
+    """Remove or move files of a dataset in the project index. The index is
+    locked, reloaded to pick up concurrent changes and saved.
+
+    :param project: the project
+    :type project: grape.Project
+    :param id: the dataset id
+    :param paths: dictionary that maps the absolute path of each file to its
+        new path or to None if the file is removed
+    """
+    index = project.index
+    try:
+        index.lock()
+        if os.path.exists(project.indexfile):
+            project.load()
+            index = project.index
+        dataset = index.datasets.get(id)
+        if dataset is not None:
+            for type, files in dataset._files.items():
+                for path, info in files.items():
+                    abspath = os.path.abspath(os.path.join(project.path,
+                                                           path))
+                    if abspath not in paths:
+                        continue
+                    info = dict(info)
+                    dataset.rm_file(path=path, type=type)
+                    if paths[abspath]:
+                        info.update({'path': paths[abspath], 'type': type})
+                        dataset.add_file(**info)
+        index.save()
+    finally:
+        index.release()
+
+
 class _OnSuccessListener(object):
     def __init__(self, project, config, compute_stats=False):
         self.project = project
@@ -39,6 +122,7 @@ class _OnSuccessListener(object):
         # grape.grape has an import grape.index.* so we
         # import implicitly here to avoid circular dependencies
         from .grape import Project
+        from . import metrics
 
         project = Project(self.project)
         project.load()
@@ -65,6 +149,7 @@ class _OnSuccessListener(object):
             index.save()
         finally:
             index.release()
+        metrics.update_textfile(project)
 
 def prepare_tool(tool, project, config, compute_stats=False):
     """Add listeners to the tool to ensure that it updates the index
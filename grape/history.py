@@ -0,0 +1,284 @@
+"""Grape job history
+
+Store runtime measurements of finished jobs in a sqlite database. Each
+project keeps its history in `.grape/history.db`. A site-level history is
+used in addition when the `history.db` file exists in the grape home folder,
+so measurements can be shared between projects. To enable the site-level
+history, create an empty file::
+
+    $ touch $GRAPE_HOME/history.db
+
+For each job run the history records the tool, the wall clock time and the
+CPU time in seconds, the peak resident memory in KB, and the total size of
+the input and output files in bytes. The peak memory is the one of the
+largest process of the job. The operating system only reports the maximum
+over all the processes run so far, so it is recorded only for the jobs that
+exceed the peaks of the jobs run before them in the same `grape run`. Jobs that run in a pipe are recorded
+once, using the tool names of the pipe joined by `|`, and the resource
+planning looks the pipe chains up by that name.
+"""
+import os
+import sqlite3
+
+#: minimum number of runs required to derive a resource model for a tool
+MIN_RUNS = 3
+
+#: safety margin applied to the resources derived from the history
+MARGIN = 1.2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE,
+    tool TEXT NOT NULL,
+    name TEXT,
+    project TEXT,
+    state TEXT,
+    finished TEXT,
+    threads INTEGER,
+    wall REAL,
+    cpu REAL,
+    rss INTEGER,
+    input_bytes INTEGER,
+    output_bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_tool ON runs (tool);
+"""
+
+_FIELDS = ['key', 'tool', 'name', 'project', 'state', 'finished', 'threads',
+           'wall', 'cpu', 'rss', 'input_bytes', 'output_bytes']
+
+
+class History(object):
+    """A job history store
+
+    :param path: the path to the sqlite database
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._models = {}
+
+    @classmethod
+    def open(cls, project):
+        """Return the list of history stores for a project: the project
+        history and, if enabled, the site-level history
+
+        :param project: the project
+        """
+        from .grape import Grape
+        stores = [cls(project.history_db)]
+        home = Grape().home
+        if home and os.path.exists(os.path.join(home, 'history.db')):
+            stores.append(cls(os.path.join(home, 'history.db')))
+        return stores
+
+    @property
+    def conn(self):
+        """The database connection. The database is created on first
+        access"""
+        if self._conn is None:
+            folder = os.path.dirname(os.path.abspath(self.path))
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def close(self):
+        """Close the database connection"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def record(self, runs):
+        """Add job runs to the history. A run is a dictionary with the
+        history fields. Runs with a key that is already stored are ignored.
+
+        :param runs: list of runs
+        :returns: number of runs added
+        """
+        rows = [[run.get(f) for f in _FIELDS] for run in runs]
+        if not rows:
+            return 0
+        before = self.conn.total_changes
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO runs (%s) VALUES (%s)" % (
+                    ", ".join(_FIELDS), ", ".join("?" * len(_FIELDS))),
+                rows)
+        self._models = {}
+        return self.conn.total_changes - before
+
+    def runs(self, tool=None):
+        """Return the recorded runs as a list of dictionaries
+
+        :param tool: only return runs of the given tool
+        """
+        query = "SELECT %s FROM runs" % ", ".join(_FIELDS)
+        params = []
+        if tool is not None:
+            query += " WHERE tool = ?"
+            params.append(tool)
+        return [dict(zip(_FIELDS, row))
+                for row in self.conn.execute(query + " ORDER BY id", params)]
+
+    def summary(self):
+        """Return the per tool summary of the history as a list of
+        dictionaries with the number of runs, the mean wall and CPU time,
+        the maximum peak memory, the total input and output bytes and the
+        throughput in input bytes per second"""
+        rows = self.conn.execute(
+            "SELECT tool, COUNT(*), AVG(wall), AVG(cpu), MAX(rss), "
+            "SUM(input_bytes), SUM(output_bytes), SUM(wall) "
+            "FROM runs GROUP BY tool ORDER BY tool")
+        summary = []
+        for tool, count, wall, cpu, rss, inb, outb, total_wall in rows:
+            summary.append({
+                'tool': tool,
+                'runs': count,
+                'wall': wall,
+                'cpu': cpu,
+                'rss': rss,
+                'input_bytes': inb,
+                'output_bytes': outb,
+                'throughput': inb / total_wall if inb and total_wall else None,
+            })
+        return summary
+
+    def model(self, tool):
+        """Return a linear resource model for a tool derived from the
+        history, or None if there are not enough runs. The model is a
+        dictionary that maps `rss` (KB) and `cpu` (seconds) to the
+        (intercept, slope) tuple of a least squares fit against the input
+        bytes
+
+        :param tool: the tool name
+        """
+        if tool in self._models:
+            return self._models[tool]
+        model = None
+        runs = [r for r in self.runs(tool)
+                if r['input_bytes'] and r['wall'] is not None]
+        if len(runs) >= MIN_RUNS:
+            model = {}
+            rss = [(r['input_bytes'], r['rss']) for r in runs
+                   if r['rss'] is not None]
+            if len(rss) >= MIN_RUNS:
+                model['rss'] = _fit(rss)
+            cpu = [(r['input_bytes'],
+                    r['cpu'] if r['cpu'] is not None
+                    else r['wall'] * (r['threads'] or 1))
+                   for r in runs]
+            model['cpu'] = _fit(cpu)
+        self._models[tool] = model
+        return model
+
+    def sync(self, project=None):
+        """Record the finished jobs of the current jip database that are
+        not in the history yet. Only wall time and file sizes are known for
+        these jobs.
+
+        :param project: the project name stored with the runs
+        """
+        import jip.db
+        session = jip.db.create_session()
+        try:
+            jobs = session.query(jip.db.Job).filter(
+                jip.db.Job.state == jip.db.STATE_DONE).all()
+            runs = []
+            for job in jobs:
+                if getattr(job, 'pipe_from', None):
+                    continue
+                if not job.start_date or not job.finish_date:
+                    continue
+                runs.append(job_run(job, project=project))
+            return self.record(runs)
+        finally:
+            session.close()
+
+
+def job_run(job, wall=None, cpu=None, rss=None, project=None):
+    """Create a history run for a jip job and the jobs it pipes to
+
+    :param job: the job
+    :param wall: the wall time in seconds. Computed from the job start and
+        finish date if not specified
+    :param cpu: the CPU time in seconds
+    :param rss: the peak resident memory in KB
+    :param project: the project name
+    """
+    chain = pipe_chain(job)
+    if wall is None and job.start_date and job.finish_date:
+        wall = _seconds(job.finish_date - job.start_date)
+    outputs = set()
+    for j in chain:
+        outputs.update(j.get_output_files())
+    return {
+        'key': "%s:%s:%s" % (project, job.id, job.start_date),
+        'tool': chain_tool(job),
+        'name': job.name,
+        'project': project,
+        'state': job.state,
+        'finished': str(job.finish_date) if job.finish_date else None,
+        'threads': job.threads,
+        'wall': wall,
+        'cpu': cpu,
+        'rss': rss,
+        'input_bytes': _total_size(job.get_input_files()),
+        'output_bytes': _total_size(outputs),
+    }
+
+
+def pipe_chain(job):
+    """Return a job followed by the jobs it pipes to
+
+    :param job: the job
+    """
+    chain = [job]
+    while getattr(chain[-1], 'pipe_to', None):
+        chain.append(chain[-1].pipe_to[0])
+    return chain
+
+
+def chain_tool(job):
+    """Return the tool name a job is recorded with, the tool names of its
+    pipe chain joined by `|`
+
+    :param job: the job
+    """
+    return "|".join([j.tool_name for j in pipe_chain(job)])
+
+
+def _seconds(delta):
+    """Convert a timedelta to seconds"""
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+
+
+def _total_size(files):
+    """Return the total size of the existing files"""
+    total = 0
+    for f in files:
+        try:
+            total += os.path.getsize(f)
+        except OSError:
+            pass
+    return total
+
+
+def _fit(points):
+    """Least squares linear fit of a list of (x, y) tuples. The intercept
+    and the slope are never negative. Returns a tuple (intercept, slope)"""
+    n = float(len(points))
+    mx = sum(p[0] for p in points) / n
+    my = sum(p[1] for p in points) / n
+    sxx = sum((p[0] - mx) ** 2 for p in points)
+    slope = 0.0
+    if sxx > 0:
+        slope = max(0.0, sum((p[0] - mx) * (p[1] - my)
+                             for p in points) / sxx)
+    intercept = max(0.0, my - slope * mx)
+    if slope == 0.0:
+        intercept = max(p[1] for p in points)
+    return (intercept, slope)
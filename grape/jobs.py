@@ -0,0 +1,451 @@
+"""Grape job summaries
+
+Summarize the jobs of a project jip database with aggregate queries, so
+`grape jobs` returns quickly also for projects with tens of thousands of
+jobs. The jobs are counted per state and grouped by tool or by dataset.
+The dataset of a job is taken from its name: the dataset steps of the
+pipeline name their jobs `<step>.<dataset>`, e.g. `gem.mapfilter.<dataset>`.
+The other jobs, e.g. the index and the retention jobs, are project level
+jobs without a dataset. An index on the tool, state and name of the jobs
+is added to the database, so the jobs are counted from the index only.
+
+The jobs left on hold by a submission, e.g. when the maximum number of
+active jobs is reached, are recorded in the database, so only these jobs
+are submitted by `grape submit --continue` and the jobs stored on purpose
+with `grape submit --hold` stay on hold.
+
+The jobs can also be canceled, put back on hold to be submitted again or
+deleted in bulk. The state changes and the deletions are written to the
+database in a single batch and the jobs are canceled on the cluster and
+their log files removed in parallel.
+"""
+import os
+import sqlite3
+
+from .metrics import JOB_STATES
+
+#: the number of threads used to cancel the jobs on the cluster and to
+#: remove the job log files
+THREADS = 8
+
+#: the number of jobs loaded with a single query
+CHUNK_SIZE = 500
+
+#: the tools of the dataset steps of the pipeline and the prefixes of their
+#: job names
+DATASET_JOBS = {
+    'grape_gem_rnatool': ('gem',),
+    'grape_gem_quality': ('gem.quality',),
+    'grape_gem_filter': ('gem.filter', 'gem.matches'),
+    'grape_gem_mapfilter': ('gem.mapfilter',),
+    'grape_gem_mapstats': ('gem.mapstats',),
+    'grape_gem_stats': ('gem.stats',),
+    'grape_gem_sam': ('gem.sam',),
+    'grape_pigz': ('pigz', 'unpigz'),
+    'grape_fix_se': ('fix_se',),
+    'grape_samtools_view': ('sam.view',),
+    'grape_samtools_sort': ('sam.sort',),
+    'grape_samtools_index': ('sam.index',),
+    'grape_flux': ('flux',),
+    'grape_flux_split_features': ('split_flux_features',),
+}
+
+#: the index used to count the jobs without reading the job rows
+INDEX = "CREATE INDEX IF NOT EXISTS ix_grape_jobs_summary " \
+        "ON jobs (tool_name, state, name)"
+
+#: the table of the jobs left on hold to be submitted with
+#: `grape submit --continue`
+DEFERRED = "CREATE TABLE IF NOT EXISTS grape_deferred " \
+           "(id INTEGER PRIMARY KEY)"
+
+
+def job_dataset(name, tool):
+    """Return the dataset of a job from the job name or None for project
+    level jobs
+
+    :param name: the job name
+    :param tool: the job tool name
+    """
+    for prefix in DATASET_JOBS.get(tool, ()):
+        if (name or '').startswith(prefix + '.'):
+            return name[len(prefix) + 1:]
+    return None
+
+
+def _dataset_column():
+    """SQL expression for the dataset of a job, see :py:func:`job_dataset`
+    """
+    cases = []
+    for tool, prefixes in sorted(DATASET_JOBS.items()):
+        for prefix in prefixes:
+            prefix += '.'
+            cases.append("WHEN tool_name = '%s' AND substr(name, 1, %d) = "
+                         "'%s' THEN substr(name, %d)" % (
+                             tool, len(prefix), prefix, len(prefix) + 1))
+    return "CASE %s END" % " ".join(cases)
+
+
+#: the columns the jobs can be grouped by
+GROUPS = {
+    'tool': 'tool_name',
+    'dataset': _dataset_column(),
+}
+
+
+def _where(states=None, datasets=None):
+    """Return the WHERE clause and its parameters that select the jobs in
+    the given states and datasets"""
+    where = []
+    params = []
+    for column, values in [('state', states),
+                           (GROUPS['dataset'], datasets)]:
+        if values:
+            where.append("%s IN (%s)" % (column,
+                                        ",".join("?" * len(values))))
+            params.extend(values)
+    return (" WHERE " + " AND ".join(where) if where else "", params)
+
+
+def summary(path, by='tool', states=None, datasets=None):
+    """Count the jobs of a jip database. Returns a dictionary that maps each
+    group, i.e. a tool or a dataset, to a dictionary with the number of
+    jobs in each state. Project level jobs are grouped under None when the
+    jobs are grouped by dataset.
+
+    :param path: the path to the jip database
+    :param by: the group, `tool` or `dataset`
+    :param states: only count the jobs in these states
+    :param datasets: only count the jobs of these datasets
+    """
+    if by not in GROUPS:
+        raise ValueError("Unknown job group %s. Use one of %s" % (
+            by, ", ".join(sorted(GROUPS))))
+    counts = {}
+    if not os.path.exists(path):
+        return counts
+    where, params = _where(states, datasets)
+    query = "SELECT %s, state, COUNT(*) FROM jobs%s GROUP BY 1, 2" % (
+        GROUPS[by], where)
+    conn = sqlite3.connect(path)
+    try:
+        try:
+            conn.execute(INDEX)
+        except sqlite3.OperationalError, e:
+            if 'no such table' in str(e):
+                return counts
+            # e.g. a read only database, the jobs are counted without the
+            # index
+            pass
+        for group, state, count in conn.execute(query, params):
+            counts.setdefault(group, {})[state] = count
+    finally:
+        conn.close()
+    return counts
+
+
+def totals(counts):
+    """Return the number of jobs in each state of a summary
+
+    :param counts: the summary, see :py:func:`summary`
+    """
+    result = {}
+    for states in counts.values():
+        for state, count in states.items():
+            result[state] = result.get(state, 0) + count
+    return result
+
+
+def states(counts):
+    """Return the states of a summary in the jip order, followed by
+    unknown states
+
+    :param counts: the summary, see :py:func:`summary`
+    """
+    found = totals(counts)
+    return [s for s in JOB_STATES if s in found] + \
+        sorted(set(found) - set(JOB_STATES))
+
+
+def version(path):
+    """Return a value that changes when a jip database is modified or None
+    if the database does not exist. Used to refresh a summary only when
+    the database changed.
+
+    :param path: the path to the jip database
+    """
+    result = []
+    for p in [path, path + '-journal', path + '-wal']:
+        if os.path.exists(p):
+            stat = os.stat(p)
+            result.append((p, stat.st_mtime, stat.st_size))
+    return tuple(result) or None
+
+
+def select(path, states=None, datasets=None):
+    """Return the ids of the jobs of a jip database in the given states and
+    datasets
+
+    :param path: the path to the jip database
+    :param states: only select the jobs in these states
+    :param datasets: only select the jobs of these datasets
+    """
+    if not os.path.exists(path):
+        return []
+    where, params = _where(states, datasets)
+    conn = sqlite3.connect(path)
+    try:
+        return [row[0] for row in conn.execute(
+            "SELECT id FROM jobs%s ORDER BY id" % where, params)]
+    except sqlite3.OperationalError:
+        # no jobs table yet
+        return []
+    finally:
+        conn.close()
+
+
+def deferred(path):
+    """Return the ids of the jobs left on hold to be submitted with
+    `grape submit --continue`
+
+    :param path: the path to the jip database
+    """
+    if not os.path.exists(path):
+        return []
+    conn = sqlite3.connect(path)
+    try:
+        return [row[0] for row in conn.execute(
+            "SELECT id FROM grape_deferred ORDER BY id")]
+    except sqlite3.OperationalError:
+        # no job was deferred yet
+        return []
+    finally:
+        conn.close()
+
+
+def defer(path, ids, deferred=True):
+    """Mark the jobs as left on hold to be submitted with
+    `grape submit --continue`, or remove the mark
+
+    :param path: the path to the jip database
+    :param ids: the job ids
+    :param deferred: set to False to remove the mark
+    """
+    if deferred:
+        query = "INSERT OR IGNORE INTO grape_deferred (id) VALUES (?)"
+    else:
+        query = "DELETE FROM grape_deferred WHERE id = ?"
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            conn.execute(DEFERRED)
+            conn.executemany(query, [(i,) for i in ids])
+    finally:
+        conn.close()
+
+
+def _db_file():
+    """Return the file of the current jip database or None if it is not
+    a sqlite file"""
+    import jip.db
+    if jip.db.db_in_memory or not jip.db.db_path or \
+            not jip.db.db_path.startswith('sqlite:///'):
+        return None
+    return jip.db.db_path[len('sqlite:///'):]
+
+
+def related(path, ids):
+    """Return the ids of the given jobs and of all the jobs that depend on
+    them, directly or not. The jobs they pipe to and the jobs in their
+    groups are included as they run in the same cluster job.
+
+    :param path: the path to the jip database
+    :param ids: the job ids
+    """
+    edges = {}
+    conn = sqlite3.connect(path)
+    try:
+        # job_dependencies links a job (source) to its dependencies
+        # (target), the pipes and the groups are followed both ways
+        for query in ["SELECT target, source FROM job_dependencies",
+                      "SELECT source, target FROM job_pipes",
+                      "SELECT target, source FROM job_pipes",
+                      "SELECT source, target FROM job_groups",
+                      "SELECT target, source FROM job_groups"]:
+            for source, target in conn.execute(query):
+                edges.setdefault(source, []).append(target)
+    finally:
+        conn.close()
+    result = set(ids)
+    todo = list(ids)
+    while todo:
+        for target in edges.get(todo.pop(), []):
+            if target not in result:
+                result.add(target)
+                todo.append(target)
+    return sorted(result)
+
+
+def load(ids):
+    """Load the jobs with the given ids from the current jip database
+
+    :param ids: the job ids
+    """
+    import jip.db
+    session = jip.db.create_session()
+    jobs = []
+    for i in range(0, len(ids), CHUNK_SIZE):
+        jobs.extend(session.query(jip.db.Job).filter(
+            jip.db.Job.id.in_(ids[i:i + CHUNK_SIZE])).order_by(
+                jip.db.Job.id).all())
+    return jobs
+
+
+def _parallel(fun, items, threads=THREADS):
+    """Call a function on each item using a pool of threads"""
+    if threads <= 1 or len(items) < 2:
+        return map(fun, items)
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(threads, len(items)))
+    try:
+        return pool.map(fun, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _cluster(cluster=None):
+    import jip.cluster
+    return cluster if cluster is not None else jip.cluster.get()
+
+
+def _cancel_on_cluster(jobs, cluster, threads=THREADS):
+    """Cancel the active jobs on the cluster. Jobs that are piped from
+    another job run in the cluster job of their source."""
+    import jip.db
+    active = [j for j in jobs if j.state in jip.db.STATES_ACTIVE and
+              j.job_id and not j.pipe_from]
+    if not active:
+        return
+    cluster = _cluster(cluster)
+    if hasattr(cluster, 'cancel_jobs'):
+        cluster.cancel_jobs(active)
+    else:
+        _parallel(cluster.cancel, active, threads)
+
+
+def _forget_on_cluster(jobs, cluster):
+    """Let the cluster forget the finished jobs that are restarted or
+    deleted, if it keeps track of them, see
+    :py:meth:`grape.cluster.LocalCluster.forget_jobs`"""
+    jobs = [j for j in jobs if j.job_id and not j.pipe_from]
+    if not jobs:
+        return
+    try:
+        cluster = _cluster(cluster)
+    except Exception:
+        return
+    if hasattr(cluster, 'forget_jobs'):
+        cluster.forget_jobs(jobs)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _remove_logs(jobs, cluster, threads=THREADS):
+    """Remove the log files of the jobs"""
+    try:
+        cluster = _cluster(cluster)
+    except Exception:
+        # the log paths can not be resolved without a cluster
+        return
+    paths = set()
+    for job in jobs:
+        if job.pipe_from:
+            continue
+        for log in [job.stdout, job.stderr]:
+            try:
+                path = cluster.resolve_log(job, log)
+            except Exception:
+                continue
+            if path:
+                paths.add(path)
+    _parallel(_remove, sorted(paths), threads)
+
+
+def _set_states(jobs, state):
+    import jip.db
+    import jip.jobs
+    for job in jobs:
+        jip.jobs.set_state(job, state, update_children=False, cleanup=False)
+    if jobs:
+        jip.db.update_job_states(jobs)
+    return jobs
+
+
+def cancel(jobs, cluster=None, threads=THREADS):
+    """Cancel the jobs that are on hold, queued or running. Returns the
+    canceled jobs.
+
+    :param jobs: the jobs
+    :param cluster: the cluster. Default: the jip cluster
+    :param threads: the number of threads used to cancel the jobs on the
+        cluster
+    """
+    import jip.db
+    jobs = [j for j in jobs
+            if j.state in jip.db.STATES_ACTIVE + [jip.db.STATE_HOLD]]
+    _cancel_on_cluster(jobs, cluster, threads)
+    return _set_states(jobs, jip.db.STATE_CANCELED)
+
+
+def restart(jobs, cluster=None, threads=THREADS):
+    """Put the jobs back on hold, so they are submitted again by
+    `grape submit --continue`. Queued and running jobs are canceled on the
+    cluster first. Jobs already on hold, e.g. stored with
+    `grape submit --hold`, are submitted too. Returns the jobs to be
+    submitted.
+
+    :param jobs: the jobs
+    :param cluster: the cluster. Default: the jip cluster
+    :param threads: the number of threads used to cancel the jobs on the
+        cluster
+    """
+    import jip.db
+    _cancel_on_cluster(jobs, cluster, threads)
+    held = [j for j in jobs if j.state == jip.db.STATE_HOLD]
+    jobs = [j for j in jobs if j.state != jip.db.STATE_HOLD]
+    _forget_on_cluster(jobs, cluster)
+    for job in jobs:
+        job.job_id = None
+    _set_states(jobs, jip.db.STATE_HOLD)
+    if (jobs or held) and _db_file():
+        defer(_db_file(), [j.id for j in held + jobs])
+    return held + jobs
+
+
+def delete(jobs, cluster=None, clean_logs=True, threads=THREADS):
+    """Delete the jobs from the database. Queued and running jobs are
+    canceled on the cluster first.
+
+    :param jobs: the jobs
+    :param cluster: the cluster. Default: the jip cluster
+    :param clean_logs: remove the job log files
+    :param threads: the number of threads used to cancel the jobs on the
+        cluster and to remove the log files
+    """
+    import jip.db
+    _cancel_on_cluster(jobs, cluster, threads)
+    _forget_on_cluster(jobs, cluster)
+    if clean_logs:
+        _remove_logs(jobs, cluster, threads)
+    ids = [j.id for j in jobs if j.id is not None]
+    jip.db.delete(list(jobs))
+    # the ids of deleted jobs are reused
+    if ids and _db_file():
+        defer(_db_file(), ids, False)
+    return jobs
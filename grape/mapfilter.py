@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""Grape streaming GEM map filter
+
+Filter a GEM map file in a single pass and optionally compress the output
+with a parallel block gzip writer. The filter applies the maximum edit
+distance and the maximum number of matches to each read and replaces the
+`gt.filter | gt.filter | pigz` part of the filter pipeline.
+
+A GEM map line has five tab separated fields: the read name, the sequence,
+the qualities, the match counters and the comma separated mappings. Paired
+mappings join the two ends with `::`, and each end is described as
+`chr:strand:position:cigar`. Mapping scores follow the mapping after `:::`.
+
+Usage::
+
+    python -m grape.mapfilter [-i <input>] [-o <output>] [-z] [-t <threads>]
+        [--max-levenshtein-error <error>] [--max-matches <matches>]
+"""
+import re
+import sys
+import zlib
+import struct
+
+#: the default size of the uncompressed gzip blocks
+BLOCK_SIZE = 1024 * 1024
+
+#: GEM cigar operations: matches, mismatches, trims and indels/splices
+_CIGAR = re.compile(r'(\d+)|([A-Za-z])|\((\d+)\)|>(\d+)([+\-*])')
+
+#: gzip member header without file name and modification time
+_GZIP_HEADER = '\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+
+def edit_distance(cigar):
+    """Return the edit distance of a GEM cigar string. Mismatches count as
+    one edit, insertions and deletions count as their length, trimmed
+    bases and splices do not count.
+
+    :param cigar: the GEM cigar string
+    """
+    distance = 0
+    for match, mismatch, trim, length, op in _CIGAR.findall(cigar):
+        if mismatch:
+            distance += 1
+        elif length and op != '*':
+            distance += int(length)
+    return distance
+
+
+def mapping_distance(mapping):
+    """Return the edit distance of a single or paired GEM mapping
+
+    :param mapping: the mapping
+    """
+    mapping = mapping.split(':::', 1)[0]
+    distance = 0
+    for end in mapping.split('::'):
+        fields = end.split(':')
+        if len(fields) < 4:
+            raise ValueError("Invalid GEM mapping: %s" % mapping)
+        distance += edit_distance(fields[3])
+    return distance
+
+
+def filter_line(line, max_error=None, max_matches=None):
+    """Filter the mappings of a GEM map line. Mappings with more than
+    `max_error` edits are removed. Reads with more than `max_matches`
+    remaining mappings are reported as unmapped. The match counters are
+    recomputed from the remaining mappings. Lines that are not GEM map lines
+    are returned unchanged.
+
+    :param line: the map line without the line terminator
+    :param max_error: the maximum number of edits
+    :param max_matches: the maximum number of matches
+    """
+    fields = line.split('\t')
+    if len(fields) != 5 or fields[4] == '-':
+        return line
+    mappings = []
+    counters = []
+    for mapping in fields[4].split(','):
+        distance = mapping_distance(mapping)
+        if max_error is not None and distance > max_error:
+            continue
+        mappings.append(mapping)
+        if distance >= len(counters):
+            counters.extend([0] * (distance + 1 - len(counters)))
+        counters[distance] += 1
+    if not mappings or (max_matches is not None and
+                        len(mappings) > max_matches):
+        fields[3] = '0'
+        fields[4] = '-'
+    else:
+        fields[3] = ':'.join(str(c) for c in counters)
+        fields[4] = ','.join(mappings)
+    return '\t'.join(fields)
+
+
+def gzip_block(data, level=6):
+    """Compress a block of data into a complete gzip member. Concatenated
+    gzip members form a valid gzip file.
+
+    :param data: the uncompressed data
+    :param level: the compression level
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = compressor.compress(data) + compressor.flush()
+    trailer = struct.pack('<II', zlib.crc32(data) & 0xffffffff,
+                          len(data) & 0xffffffff)
+    return _GZIP_HEADER + body + trailer
+
+
+class BlockGzipWriter(object):
+    """Parallel gzip writer. The data is split into blocks that are
+    compressed in a thread pool and written in order as gzip members.
+
+    :param out: the output file object
+    :param threads: the number of compression threads
+    :param level: the compression level
+    :param block_size: the size of the uncompressed blocks
+    """
+
+    def __init__(self, out, threads=1, level=6, block_size=BLOCK_SIZE):
+        self.out = out
+        self.threads = max(1, threads)
+        self.level = level
+        self.block_size = block_size
+        self._buffer = []
+        self._buffered = 0
+        self._blocks = []
+        self._pool = None
+        if self.threads > 1:
+            from multiprocessing.pool import ThreadPool
+            self._pool = ThreadPool(self.threads)
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.block_size:
+            self._flush_buffer()
+
+    def _flush_buffer(self):
+        if not self._buffer:
+            return
+        self._blocks.append(''.join(self._buffer))
+        self._buffer = []
+        self._buffered = 0
+        # compress a batch of blocks per thread at once
+        if len(self._blocks) >= self.threads:
+            self._compress()
+
+    def _compress(self):
+        if self._pool is not None:
+            members = self._pool.map(self._gzip, self._blocks)
+        else:
+            members = [self._gzip(b) for b in self._blocks]
+        self._blocks = []
+        for member in members:
+            self.out.write(member)
+
+    def _gzip(self, data):
+        return gzip_block(data, self.level)
+
+    def close(self):
+        self._flush_buffer()
+        self._compress()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        self.out.flush()
+
+
+def run(input, output, max_error=None, max_matches=None, compress=False,
+        threads=1, level=6):
+    """Filter a GEM map stream
+
+    :param input: the input file object
+    :param output: the output file object
+    :param max_error: the maximum number of edits
+    :param max_matches: the maximum number of matches
+    :param compress: compress the output with block gzip
+    :param threads: the number of compression threads
+    :param level: the compression level
+    """
+    writer = output
+    if compress:
+        writer = BlockGzipWriter(output, threads=threads, level=level)
+    for line in input:
+        writer.write(filter_line(line.rstrip('\n'), max_error,
+                                 max_matches) + '\n')
+    if compress:
+        writer.close()
+    else:
+        writer.flush()
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="python -m grape.mapfilter",
+        description="Filter GEM map files in a single pass")
+    parser.add_argument("-i", "--input", default=None,
+                        help="The input map file. Default: stdin")
+    parser.add_argument("-o", "--output", default=None,
+                        help="The output file. Default: stdout")
+    parser.add_argument("--max-levenshtein-error", dest="max_error",
+                        type=int, default=None,
+                        help="The maximum number of edit operations allowed")
+    parser.add_argument("--max-matches", dest="max_matches", type=int,
+                        default=None,
+                        help="The maximum number of matches allowed")
+    parser.add_argument("-z", "--gzip", dest="compress", default=False,
+                        action="store_true", help="Compress the output")
+    parser.add_argument("-t", "--threads", type=int, default=1,
+                        help="The number of compression threads")
+    parser.add_argument("-l", "--level", type=int, default=6,
+                        help="The compression level")
+    args = parser.parse_args(argv)
+
+    input = sys.stdin if args.input in (None, '-') else open(args.input)
+    output = sys.stdout if args.output in (None, '-') else \
+        open(args.output, 'wb')
+    try:
+        run(input, output, max_error=args.max_error,
+            max_matches=args.max_matches, compress=args.compress,
+            threads=args.threads, level=args.level)
+    finally:
+        if input is not sys.stdin:
+            input.close()
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+"""Grape mapping statistics
+
+Compute the mapping statistics of a GEM map file in a single streaming
+pass: the number of reads, mapped reads, uniquely mapped reads, split
+reads and the distribution of the number of mappings per read. The
+summary is written as JSON and can be stored in the project index, so
+`grape report` can aggregate the statistics of all datasets without
+reading the mapping files again.
+
+Usage::
+
+    python -m grape.mapstats -i <input> [-o <output>] [-n <name>]
+        [--update-index]
+"""
+import os
+import re
+import sys
+import json
+
+#: the number of mappings from which reads are counted in one bucket
+MAX_MULTIMAPS = 10
+
+#: a GEM cigar splice operation
+_SPLICE = re.compile(r'>\d+\*')
+
+#: the summary keys stored in the index
+INDEX_KEYS = ['reads', 'mapped', 'unique', 'split', 'multimaps']
+
+
+def _open(path):
+    """Open a plain or gzip compressed map file and return a tuple with the
+    file object and the decompression process or None. Compressed files are
+    read through `gzip -dc` if available, which is faster than the gzip
+    module"""
+    if path == '-':
+        return sys.stdin, None
+    if not path.endswith('.gz'):
+        return open(path, 'rb', 1024 * 1024), None
+    import subprocess
+    try:
+        process = subprocess.Popen(['gzip', '-dc', path],
+                                   stdout=subprocess.PIPE,
+                                   bufsize=1024 * 1024)
+        return process.stdout, process
+    except OSError:
+        import gzip
+        return gzip.open(path, 'rb'), None
+
+
+def map_stats(input, max_multimaps=MAX_MULTIMAPS):
+    """Compute the statistics of a GEM map stream and return them as a
+    dictionary. The `multimaps` entry maps the number of mappings to the
+    number of reads, with all reads with `max_multimaps` or more mappings
+    counted under `max_multimaps`.
+
+    :param input: the map file object
+    :param max_multimaps: the last bucket of the multimap distribution
+    """
+    reads = mapped = split = 0
+    multimaps = [0] * (max_multimaps + 1)
+    for line in input:
+        reads += 1
+        mappings = line.rsplit('\t', 1)[-1].rstrip('\n')
+        if mappings == '-' or not mappings:
+            continue
+        mapped += 1
+        multimaps[min(mappings.count(',') + 1, max_multimaps)] += 1
+        if '*' in mappings and _SPLICE.search(mappings):
+            split += 1
+    return {
+        'reads': reads,
+        'mapped': mapped,
+        'unique': multimaps[1],
+        'split': split,
+        'multimaps': dict((i, c) for i, c in enumerate(multimaps) if c),
+    }
+
+
+def encode_multimaps(multimaps):
+    """Encode the multimap distribution as a compact string for the index,
+    e.g. `1:100,2:10`"""
+    return ",".join("%d:%d" % (k, multimaps[k]) for k in sorted(multimaps))
+
+
+def decode_multimaps(value):
+    """Decode a multimap distribution encoded with
+    :py:func:`encode_multimaps`"""
+    multimaps = {}
+    for item in (value or "").split(","):
+        if ":" in item:
+            k, v = item.split(":")
+            multimaps[int(k)] = int(v)
+    return multimaps
+
+
+def update_index(stats, output, name):
+    """Add the statistics file and its summary to the index of the grape
+    project containing the file
+
+    :param stats: the statistics dictionary
+    :param output: the statistics file
+    :param name: the dataset id
+    :returns: True if a project was found and updated
+    """
+    from .grape import Project
+    from .grapeindex import add_files
+
+    output = os.path.abspath(output)
+    project = Project.find(os.path.dirname(output))
+    if project is None:
+        return False
+    # the index writes false values, e.g. zero counts, as NA
+    info = dict((k, str(stats[k])) for k in INDEX_KEYS if k != 'multimaps')
+    info['multimaps'] = encode_multimaps(stats['multimaps'])
+    info.update({'path': output, 'type': 'json', 'view': 'mapstats'})
+    add_files(project, name, [info])
+    return True
+
+
+def _int(value):
+    """Convert an index value to int. Missing values, which the index
+    stores as NA, are 0"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def report(datasets):
+    """Aggregate the mapping statistics stored in the index for the given
+    datasets. Returns a tuple with the list of per dataset summaries and
+    the project total. Datasets without statistics are skipped.
+
+    :param datasets: the datasets
+    """
+    summary = []
+    total = dict((k, 0) for k in INDEX_KEYS if k != 'multimaps')
+    total['id'] = 'Total'
+    total['multimaps'] = {}
+    for d in sorted(datasets, key=lambda d: d.id):
+        for info in (d._files.get('json') or {}).values():
+            if info.get('view') != 'mapstats':
+                continue
+            s = dict((k, _int(info.get(k))) for k in INDEX_KEYS
+                     if k != 'multimaps')
+            s['id'] = d.id
+            s['multimaps'] = decode_multimaps(info.get('multimaps'))
+            for k in s:
+                if k == 'multimaps':
+                    for m, c in s[k].items():
+                        total[k][m] = total[k].get(m, 0) + c
+                elif k != 'id':
+                    total[k] += s[k]
+            summary.append(s)
+            break
+    return summary, total
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="python -m grape.mapstats",
+        description="Compute mapping statistics of a GEM map file")
+    parser.add_argument("-i", "--input", default='-',
+                        help="The input map file. Default: stdin")
+    parser.add_argument("-o", "--output", default=None,
+                        help="The JSON output file. Default: stdout")
+    parser.add_argument("-n", "--name", default=None,
+                        help="The dataset id used to update the index")
+    parser.add_argument("--update-index", dest="update_index", default=False,
+                        action="store_true",
+                        help="Add the statistics to the project index")
+    args = parser.parse_args(argv)
+
+    input, process = _open(args.input)
+    try:
+        stats = map_stats(input)
+    finally:
+        if input is not sys.stdin:
+            input.close()
+    if process is not None and process.wait() != 0:
+        sys.stderr.write("Unable to decompress %s\n" % args.input)
+        sys.exit(1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(stats, f, indent=2, sort_keys=True)
+    else:
+        json.dump(stats, sys.stdout, indent=2, sort_keys=True)
+    if args.update_index and args.name and args.output:
+        if not update_index(stats, args.output, args.name):
+            sys.stderr.write("No grape project found, index not updated\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""Grape binary expression matrix format
+
+Expression matrices are stored in a binary file that can be memory mapped
+with `numpy.memmap`, so single samples or transcripts are read without
+loading the full matrix. The file layout is:
+
+    header      fixed size little endian header (see :py:data:`HEADER`)
+    padding     zero bytes up to the next :py:data:`ALIGNMENT` boundary
+    data        float32 little endian values in column major order. Each
+                sample column is a contiguous block of `rows` values
+    rows        the transcript ids, newline separated, UTF-8 encoded
+    columns     the sample ids, newline separated, UTF-8 encoded
+
+The header contains the magic string, the format version, the number of
+rows and columns, the data offset and the byte length of the two name
+tables.
+"""
+import os
+import struct
+
+#: file magic
+MAGIC = 'GRAPEMTX'
+
+#: format version
+VERSION = 1
+
+#: header layout: magic, version, rows, columns, data offset, row names
+#: length, column names length
+HEADER = struct.Struct('<8sIQQQQQ')
+
+#: data block alignment
+ALIGNMENT = 4096
+
+#: data type of the stored values
+DTYPE = '<f4'
+
+
+def _import_numpy():
+    from .quantify import _import_numpy
+    return _import_numpy()
+
+
+def _data_offset():
+    return ((HEADER.size + ALIGNMENT - 1) // ALIGNMENT) * ALIGNMENT
+
+
+def _encode(names):
+    return "\n".join(n.encode('utf-8') if isinstance(n, unicode) else n
+                     for n in names)
+
+
+class MatrixWriter(object):
+    """Write a matrix file column by column. The file is created with the
+    final size on open and memory mapped, so the full matrix is never held
+    in memory. The file is written to a temporary path and moved in place
+    on close.
+
+    :param path: the output path
+    :param transcripts: the row names
+    :param samples: the column names
+    """
+
+    def __init__(self, path, transcripts, samples):
+        numpy = _import_numpy()
+        self.path = path
+        self.transcripts = list(transcripts)
+        self.samples = list(samples)
+        self._rows = dict((t, i) for i, t in enumerate(self.transcripts))
+        self._tmp = "%s.tmp.%d" % (path, os.getpid())
+        rows, cols = len(self.transcripts), len(self.samples)
+        offset = _data_offset()
+        row_names = _encode(self.transcripts)
+        col_names = _encode(self.samples)
+        data_size = rows * cols * numpy.dtype(DTYPE).itemsize
+        with open(self._tmp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, rows, cols, offset,
+                                len(row_names), len(col_names)))
+            f.seek(offset + data_size)
+            f.write(row_names)
+            f.write(col_names)
+        self.data = None
+        if rows and cols:
+            self.data = numpy.memmap(self._tmp, dtype=DTYPE, mode='r+',
+                                     offset=offset, shape=(rows, cols),
+                                     order='F')
+
+    def set_column(self, j, ids, values):
+        """Set the values of a column. Rows without a value are zero.
+
+        :param j: the column index
+        :param ids: the row names of the values
+        :param values: the values
+        :raises ValueError: if a row name is unknown
+        """
+        unknown = [t for t in ids if t not in self._rows]
+        if unknown:
+            raise ValueError("Unknown row names: %s" % ", ".join(
+                sorted(unknown)[:5]))
+        if self.data is not None and len(ids):
+            self.data[[self._rows[t] for t in ids], j] = values
+
+    def close(self):
+        """Flush the data and move the file in place"""
+        if self.data is not None:
+            self.data.flush()
+            del self.data
+            self.data = None
+        os.rename(self._tmp, self.path)
+
+    def discard(self):
+        """Remove the temporary file without writing the output"""
+        if self.data is not None:
+            del self.data
+            self.data = None
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp)
+
+
+class MatrixFile(object):
+    """Read only access to a matrix file. The values are memory mapped.
+
+    :param path: the matrix file
+    """
+
+    def __init__(self, path):
+        numpy = _import_numpy()
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise ValueError("%s is not a grape matrix file" % path)
+            magic, version, rows, cols, offset, row_len, col_len = \
+                HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError("%s is not a grape matrix file" % path)
+            if version > VERSION:
+                raise ValueError("Unsupported matrix file version %d" %
+                                 version)
+            f.seek(offset + rows * cols * numpy.dtype(DTYPE).itemsize)
+            row_names = f.read(row_len)
+            col_names = f.read(col_len)
+        self.transcripts = row_names.decode('utf-8').split('\n') \
+            if rows else []
+        self.samples = col_names.decode('utf-8').split('\n') if cols else []
+        self._rows = None
+        self._cols = None
+        if rows and cols:
+            self.data = numpy.memmap(path, dtype=DTYPE, mode='r',
+                                     offset=offset, shape=(rows, cols),
+                                     order='F')
+        else:
+            self.data = numpy.zeros((rows, cols), dtype=DTYPE, order='F')
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def sample(self, name):
+        """Return the values of a sample. The values are a view of the
+        contiguous column in the file
+
+        :param name: the sample id
+        """
+        if self._cols is None:
+            self._cols = dict((s, i) for i, s in enumerate(self.samples))
+        return self.data[:, self._cols[name]]
+
+    def transcript(self, name):
+        """Return the values of a transcript across all samples. The values
+        are a strided view of the file
+
+        :param name: the transcript id
+        """
+        if self._rows is None:
+            self._rows = dict((t, i) for i, t in enumerate(self.transcripts))
+        return self.data[self._rows[name], :]
+
+
+def write_matrix(path, transcripts, samples, data):
+    """Write an in memory matrix to a matrix file
+
+    :param path: the output path
+    :param transcripts: the row names
+    :param samples: the column names
+    :param data: the matrix values with shape (transcripts, samples)
+    """
+    writer = MatrixWriter(path, transcripts, samples)
+    if writer.data is not None:
+        writer.data[:] = data
+    writer.close()
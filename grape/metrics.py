@@ -0,0 +1,340 @@
+"""Grape pipeline metrics
+
+Export the progress of a project in the Prometheus text format, either as a
+file for the textfile collector of the node exporter or served on a local
+`/metrics` endpoint with `grape metrics --serve`. The metrics are read from
+the project jip database, the job history and the project index:
+
+- ``grape_jobs``: the number of jobs in each state
+- ``grape_job_duration_seconds``: the run time of the finished jobs of
+  each tool
+- ``grape_job_queue_wait_seconds``: the time between the creation and the
+  start of the jobs of each tool
+- ``grape_tool_input_bytes_total`` and ``grape_tool_output_bytes_total``:
+  the bytes processed by each tool, from the job history
+- ``grape_index_datasets``, ``grape_index_files`` and
+  ``grape_index_bytes``: the size of the project index
+
+All the samples have a `project` label with the name of the project
+folder. When the ``GRAPE_METRICS_DIR`` environment variable is set, the
+`grape_<project>.prom` file in that folder is updated after each job run by
+`grape run`. For pipelines submitted to a cluster, run `grape metrics`
+periodically or serve the metrics.
+"""
+import os
+import re
+import sqlite3
+import logging
+
+#: the environment variable with the textfile collector folder
+METRICS_DIR = 'GRAPE_METRICS_DIR'
+
+#: the jip job states
+JOB_STATES = ['Hold', 'Queued', 'Running', 'Done', 'Failed', 'Canceled']
+
+log = logging.getLogger('grape.metrics')
+
+
+class Metric(object):
+    """A metric with its samples
+
+    :param name: the metric name
+    :param type: the metric type, `gauge`, `counter` or `summary`
+    :param help: the metric description
+    """
+
+    def __init__(self, name, type, help):
+        self.name = name
+        self.type = type
+        self.help = help
+        self.samples = []
+
+    def add(self, value, suffix='', **labels):
+        """Add a sample
+
+        :param value: the sample value
+        :param suffix: the sample name suffix, e.g. `_sum` for summaries
+        :param labels: the sample labels
+        """
+        self.samples.append((self.name + suffix, labels, value))
+
+    def __repr__(self):
+        return "Metric(%s, %d samples)" % (self.name, len(self.samples))
+
+
+def _seconds(start, end):
+    """SQL expression for the number of seconds between two dates"""
+    return "(julianday(%s) - julianday(%s)) * 86400.0" % (end, start)
+
+
+def _job_metrics():
+    return [Metric('grape_jobs', 'gauge', "Number of jobs in each state"),
+            Metric('grape_job_duration_seconds', 'summary',
+                   "Run time of the finished jobs"),
+            Metric('grape_job_queue_wait_seconds', 'summary',
+                   "Time between the creation and the start of the jobs")]
+
+
+def _add_job_counts(metric, counts):
+    for state in JOB_STATES + sorted(set(counts) - set(JOB_STATES)):
+        metric.add(counts.get(state, 0), state=state)
+
+
+def job_metrics(path):
+    """Return the job metrics of a jip database
+
+    :param path: the path to the jip database
+    """
+    metrics = _job_metrics()
+    jobs, duration, wait = metrics
+    counts = {}
+    if os.path.exists(path):
+        conn = sqlite3.connect(path)
+        try:
+            for state, count in conn.execute(
+                    "SELECT state, COUNT(*) FROM jobs GROUP BY state"):
+                counts[state] = count
+            for metric, start, end, where in [
+                    (duration, 'start_date', 'finish_date',
+                     "state = 'Done'"),
+                    (wait, 'create_date', 'start_date', "1")]:
+                query = "SELECT tool_name, COUNT(*), SUM(%s) FROM jobs " \
+                        "WHERE %s AND %s IS NOT NULL AND %s IS NOT NULL " \
+                        "GROUP BY tool_name ORDER BY tool_name" % (
+                            _seconds(start, end), where, start, end)
+                for tool, count, total in conn.execute(query):
+                    metric.add(count, '_count', tool=tool)
+                    metric.add(max(0.0, total or 0.0), '_sum', tool=tool)
+        except sqlite3.OperationalError:
+            # no jobs table yet
+            pass
+        finally:
+            conn.close()
+    _add_job_counts(jobs, counts)
+    return metrics
+
+
+def run_metrics(jobs):
+    """Return the job metrics of a list of jip jobs, e.g. the jobs of a
+    `grape run` that are not stored in the jip database
+
+    :param jobs: the jobs
+    """
+    metrics = _job_metrics()
+    counts = {}
+    totals = [{}, {}]
+    for job in jobs:
+        counts[job.state] = counts.get(job.state, 0) + 1
+        for total, start, end, done in [
+                (totals[0], job.start_date, job.finish_date,
+                 job.state == 'Done'),
+                (totals[1], job.create_date, job.start_date, True)]:
+            if done and start and end:
+                count, seconds = total.get(job.tool_name, (0, 0.0))
+                delta = end - start
+                total[job.tool_name] = (count + 1, seconds + max(
+                    0.0, delta.days * 86400 + delta.seconds +
+                    delta.microseconds / 1e6))
+    _add_job_counts(metrics[0], counts)
+    for metric, total in zip(metrics[1:], totals):
+        for tool, (count, seconds) in sorted(total.items()):
+            metric.add(count, '_count', tool=tool)
+            metric.add(seconds, '_sum', tool=tool)
+    return metrics
+
+
+def history_metrics(history):
+    """Return the processed bytes metrics from a job history
+
+    :param history: the :py:class:`grape.history.History`
+    """
+    input = Metric('grape_tool_input_bytes_total', 'counter',
+                   "Bytes read by the finished jobs")
+    output = Metric('grape_tool_output_bytes_total', 'counter',
+                    "Bytes written by the finished jobs")
+    for s in history.summary():
+        input.add(s['input_bytes'] or 0, tool=s['tool'])
+        output.add(s['output_bytes'] or 0, tool=s['tool'])
+    return [input, output]
+
+
+def index_metrics(project):
+    """Return the index metrics of a loaded project
+
+    :param project: the project
+    """
+    datasets = Metric('grape_index_datasets', 'gauge',
+                      "Number of datasets in the project index")
+    files = Metric('grape_index_files', 'gauge',
+                   "Number of files in the project index")
+    size = Metric('grape_index_bytes', 'gauge',
+                  "Size of the project index file")
+    index = project.index.datasets
+    datasets.add(len(index))
+    files.add(sum([sum([len(f) for f in d._files.values()])
+                   for d in index.values()]))
+    path = project.indexfile
+    size.add(os.path.getsize(path) if os.path.exists(path) else 0)
+    return [datasets, files, size]
+
+
+def project_name(project):
+    """Return the project name used in the `project` label, that is the
+    name of the project folder. The configured project name is not used as
+    most projects keep the default one."""
+    return os.path.basename(os.path.abspath(project.path))
+
+
+def collect(project, index=True, jobs=None):
+    """Collect the metrics of a project. The `project` label is added to
+    all the samples.
+
+    :param project: the project
+    :param index: add the index metrics. The project index has to be
+        loaded
+    :param jobs: the jobs used for the job metrics. Default: the jobs of
+        the project jip database
+    """
+    from .history import History
+    if jobs is not None:
+        metrics = run_metrics(jobs)
+    else:
+        metrics = job_metrics(project.jip_db)
+    if os.path.exists(project.history_db):
+        history = History(project.history_db)
+        try:
+            metrics.extend(history_metrics(history))
+        finally:
+            history.close()
+    if index:
+        metrics.extend(index_metrics(project))
+    name = project_name(project)
+    for metric in metrics:
+        for _, labels, _ in metric.samples:
+            labels['project'] = name
+    return metrics
+
+
+def _escape(value):
+    return unicode(value).replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n')
+
+
+def _value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render(metrics):
+    """Render metrics in the Prometheus text format
+
+    :param metrics: the list of metrics
+    """
+    lines = []
+    for metric in metrics:
+        lines.append("# HELP %s %s" % (metric.name, metric.help))
+        lines.append("# TYPE %s %s" % (metric.name, metric.type))
+        for name, labels, value in metric.samples:
+            if labels:
+                name += "{%s}" % ",".join(
+                    '%s="%s"' % (k, _escape(v))
+                    for k, v in sorted(labels.items()))
+            lines.append("%s %s" % (name, _value(value)))
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path, text):
+    """Write a metrics file atomically, so the collector never reads a
+    partial file
+
+    :param path: the file path
+    :param text: the metrics text
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(text.encode('utf-8'))
+    os.rename(tmp, path)
+
+
+def textfile(project):
+    """Return the path of the metrics file of a project in the
+    ``GRAPE_METRICS_DIR`` folder or None if the variable is not set
+
+    :param project: the project
+    """
+    folder = os.environ.get(METRICS_DIR)
+    if not folder:
+        return None
+    name = re.sub(r"[^\w\.-]", "_", project_name(project))
+    return os.path.join(folder, "grape_%s.prom" % name)
+
+
+def update_textfile(project, reload=False, jobs=None):
+    """Update the metrics file of a loaded project if ``GRAPE_METRICS_DIR``
+    is set. Errors are logged and do not stop the caller.
+
+    :param project: the project
+    :param reload: reload the project index first, e.g. after jobs that
+        updated it
+    :param jobs: the jobs used for the job metrics. Default: the jobs of
+        the project jip database
+    """
+    path = textfile(project)
+    if path is None:
+        return None
+    try:
+        if reload:
+            project.load()
+        write_textfile(path, render(collect(project, jobs=jobs)))
+    except Exception, e:
+        log.warn("Unable to update the metrics file %s: %s", path, e)
+        return None
+    return path
+
+
+def serve(project, host='127.0.0.1', port=9090):
+    """Serve the project metrics on `http://<host>:<port>/metrics`. The
+    metrics are collected for each request and the index is reloaded when
+    the index file changes.
+
+    :param project: the project
+    :param host: the address to listen on
+    :param port: the port
+    """
+    import BaseHTTPServer
+
+    state = {'mtime': None}
+
+    def metrics():
+        path = project.indexfile
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        if mtime != state['mtime']:
+            project.load()
+            state['mtime'] = mtime
+        return render(collect(project))
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type',
+                             'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            log.debug(format, *args)
+
+    server = BaseHTTPServer.HTTPServer((host, port), Handler)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
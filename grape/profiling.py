@@ -0,0 +1,195 @@
+"""Grape command profiling
+
+The phases of the grape commands, e.g. loading the project, creating the
+jobs or submitting them, are wrapped with :py:func:`phase`. Profiling is
+enabled with the global ``--profile`` option or the ``GRAPE_PROFILE``
+environment variable. When it is disabled the phases cost nothing.
+
+The time spent in each phase is written to the project `.grape/profiles`
+folder as a JSON report and as a file with folded stacks, which can be
+passed to flamegraph.pl. In `cprofile` mode the command also runs under
+:py:mod:`cProfile` and the statistics are written next to the report.
+"""
+import os
+import sys
+import time
+import json
+from contextlib import contextmanager
+
+#: the profiling modes
+MODES = ['timers', 'cprofile']
+
+
+def get_mode(value):
+    """Return the profiling mode for an option or environment value or
+    None if profiling is disabled
+
+    :param value: the value, a mode, a true value like `1` or None
+    :raises ValueError: if the value is not valid
+    """
+    if value is None:
+        return None
+    value = str(value).strip().lower()
+    if value in ['', '0', 'false', 'no', 'off']:
+        return None
+    if value in ['1', 'true', 'yes', 'on']:
+        return MODES[0]
+    if value not in MODES:
+        raise ValueError("Unknown profiling mode %s. Use one of %s" % (
+            value, ", ".join(MODES)))
+    return value
+
+
+class Profiler(object):
+    """Collect the calls and the elapsed time of nested phases
+
+    :param mode: the profiling mode or None to disable profiling
+    """
+
+    def __init__(self, mode=None):
+        self.mode = mode
+        self.phases = {}
+        self.started = None
+        self.seconds = None
+        self._order = []
+        self._stack = []
+        self._cprofile = None
+
+    @property
+    def enabled(self):
+        return self.mode is not None
+
+    def start(self):
+        """Start the profiler"""
+        if not self.enabled:
+            return
+        self.started = time.time()
+        if self.mode == 'cprofile':
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def stop(self):
+        """Stop the profiler"""
+        if not self.enabled or self.started is None:
+            return
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        self.seconds = time.time() - self.started
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager that times a phase. Phases started within a
+        phase are recorded as its children.
+
+        :param name: the phase name
+        """
+        if not self.enabled:
+            yield
+            return
+        self._stack.append(name)
+        path = tuple(self._stack)
+        if path not in self.phases:
+            self.phases[path] = {'calls': 0, 'seconds': 0.0}
+            self._order.append(path)
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            self._stack.pop()
+            self.phases[path]['calls'] += 1
+            self.phases[path]['seconds'] += elapsed
+
+    def _self_seconds(self, path):
+        children = sum(p['seconds'] for c, p in self.phases.items()
+                       if len(c) == len(path) + 1 and c[:-1] == path)
+        return max(0.0, self.phases[path]['seconds'] - children)
+
+    def report(self):
+        """Return the profiling report as a dictionary"""
+        return {
+            'mode': self.mode,
+            'argv': sys.argv,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                     time.localtime(self.started or 0)),
+            'seconds': self.seconds,
+            'phases': [{
+                'phase': ";".join(path),
+                'calls': self.phases[path]['calls'],
+                'seconds': self.phases[path]['seconds'],
+                'self_seconds': self._self_seconds(path),
+            } for path in self._order],
+        }
+
+    def folded(self):
+        """Return the phases as folded stacks, one line per phase with the
+        time spent in the phase itself in microseconds"""
+        return ["%s %d" % (";".join(path),
+                           int(self._self_seconds(path) * 1e6))
+                for path in self._order]
+
+    def write(self, folder, name):
+        """Write the report, the folded stacks and, in `cprofile` mode, the
+        cProfile statistics to a folder. Returns the path of the report.
+
+        :param folder: the output folder
+        :param name: the file name prefix, e.g. the command name
+        """
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        prefix = os.path.join(folder, "%s-%s-%d" % (
+            time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started)),
+            name, os.getpid()))
+        with open(prefix + '.json', 'w') as f:
+            json.dump(self.report(), f, indent=1)
+        with open(prefix + '.folded', 'w') as f:
+            f.write("\n".join(self.folded()) + "\n")
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(prefix + '.prof')
+        return prefix + '.json'
+
+
+#: the profiler of the current process
+profiler = Profiler()
+
+
+def start(mode):
+    """Start profiling the current process
+
+    :param mode: the profiling mode or None to disable profiling
+    """
+    global profiler
+    profiler = Profiler(mode)
+    profiler.start()
+    return profiler
+
+
+def phase(name):
+    """Return a context manager that times a phase of the current process
+
+    :param name: the phase name
+    """
+    return profiler.phase(name)
+
+
+def finish(name, folder=None):
+    """Stop profiling the current process and write the report. Returns the
+    path of the report or None if profiling is disabled.
+
+    :param name: the file name prefix, e.g. the command name
+    :param folder: the output folder. Defaults to the `.grape/profiles`
+        folder of the current project or of the user home
+    """
+    if not profiler.enabled:
+        return None
+    profiler.stop()
+    if folder is None:
+        from .grape import Project
+        project = Project.find()
+        if project is not None:
+            folder = project.profiles
+        else:
+            folder = os.path.join(os.path.expanduser("~"), ".grape",
+                                  "profiles")
+    return profiler.write(folder, name)
@@ -0,0 +1,318 @@
+"""Grape expression matrix
+
+Build a transcripts x samples expression matrix from the Flux Capacitor
+transcript GTF files of the project datasets. The matrix is backed by NumPy
+and stored column by column, one column per sample.
+
+Parsing the transcript files is the expensive part, so the values parsed
+for each sample are cached in the project `.grape/quantify` folder and the
+files are parsed again only if they change.
+"""
+import os
+import json
+
+#: the expression values available in the Flux Capacitor output
+VALUES = ['RPKM', 'reads']
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ValueError("NumPy is required to build expression matrices. "
+                         "Please install the numpy package.")
+    return numpy
+
+
+def attribute(attributes, key):
+    """Return the value of a GTF attribute or None if the attribute is not
+    found. The attribute string is only scanned up to the attribute.
+
+    :param attributes: the GTF attributes column
+    :param key: the attribute name
+    """
+    start = 0
+    token = key + ' '
+    while True:
+        i = attributes.find(token, start)
+        if i < 0:
+            return None
+        if i == 0 or attributes[i - 1] in ' ;':
+            break
+        start = i + 1
+    i += len(token)
+    end = attributes.find(';', i)
+    value = attributes[i:end] if end >= 0 else attributes[i:]
+    return value.strip().strip('"')
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        import gzip
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def parse_transcripts(path, value='RPKM'):
+    """Parse a Flux Capacitor transcript GTF file and return a tuple with
+    the list of transcript ids and the list of values
+
+    :param path: the path to the GTF file
+    :param value: the attribute holding the expression value
+    """
+    ids = []
+    values = []
+    with _open(path) as gtf:
+        for line in gtf:
+            fields = line.split('\t', 8)
+            if len(fields) < 9 or fields[2] != 'transcript':
+                continue
+            attributes = fields[8]
+            tid = attribute(attributes, 'transcript_id')
+            if tid is None:
+                continue
+            v = attribute(attributes, value)
+            ids.append(tid)
+            values.append(float(v) if v else 0.0)
+    return ids, values
+
+
+def transcript_file(project, dataset):
+    """Return the path to the transcript GTF file of a dataset or None.
+    The file is searched in the project index first and then next to the
+    dataset primary file.
+
+    :param project: the project
+    :param dataset: the dataset
+    """
+    for path, info in (dataset._files.get('gtf') or {}).items():
+        if info.get('view') == 'transcript' or \
+                '.transcript.gtf' in os.path.basename(path):
+            return os.path.abspath(os.path.join(project.path, path))
+    primary = dataset.primary
+    if primary:
+        base = os.path.join(os.path.dirname(
+            os.path.join(project.path, primary)), dataset.id)
+        for ext in ['.transcript.gtf', '.transcript.gtf.gz']:
+            if os.path.exists(base + ext):
+                return os.path.abspath(base + ext)
+    return None
+
+
+class SampleCache(object):
+    """Cache for the parsed transcript values of the samples
+
+    :param path: the cache folder
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _files(self, sample, value):
+        base = os.path.join(self.path, "%s.%s" % (sample, value))
+        return base + '.json', base + '.npz'
+
+    def get(self, sample, source, value):
+        """Return the cached (ids, values) of a sample or None if the cache
+        does not exist or the source file changed
+
+        :param sample: the sample id
+        :param source: the source GTF file
+        :param value: the expression value name
+        """
+        numpy = _import_numpy()
+        info_file, data_file = self._files(sample, value)
+        if not os.path.exists(info_file) or not os.path.exists(data_file):
+            return None
+        with open(info_file) as f:
+            info = json.load(f)
+        stat = os.stat(source)
+        if info.get('source') != source or info.get('size') != stat.st_size \
+                or info.get('mtime') != stat.st_mtime:
+            return None
+        data = numpy.load(data_file)
+        return list(data['ids']), data['values']
+
+    def put(self, sample, source, value, ids, values):
+        """Store the parsed values of a sample
+
+        :param sample: the sample id
+        :param source: the source GTF file
+        :param value: the expression value name
+        :param ids: the transcript ids
+        :param values: the expression values
+        """
+        numpy = _import_numpy()
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        info_file, data_file = self._files(sample, value)
+        stat = os.stat(source)
+        with open(data_file, 'wb') as f:
+            numpy.savez(f, ids=numpy.array(ids),
+                        values=numpy.asarray(values, dtype=numpy.float64))
+        with open(info_file, 'w') as f:
+            json.dump({'source': source, 'size': stat.st_size,
+                       'mtime': stat.st_mtime}, f)
+
+
+class ExpressionMatrix(object):
+    """A transcripts x samples expression matrix
+
+    :param transcripts: the transcript ids, one per row
+    :param samples: the sample ids, one per column
+    :param data: the NumPy matrix. The matrix is stored in column major
+        order, so each sample column is contiguous
+    """
+
+    def __init__(self, transcripts, samples, data):
+        self.transcripts = transcripts
+        self.samples = samples
+        self.data = data
+
+    @classmethod
+    def from_columns(cls, columns):
+        """Create a matrix from a list of (sample, ids, values) tuples.
+        Transcripts missing in a sample are set to zero.
+
+        :param columns: the sample columns
+        """
+        numpy = _import_numpy()
+        transcripts = sorted(set(t for _, ids, _ in columns for t in ids))
+        rows = dict((t, i) for i, t in enumerate(transcripts))
+        data = numpy.zeros((len(transcripts), len(columns)),
+                           dtype=numpy.float64, order='F')
+        for j, (_, ids, values) in enumerate(columns):
+            if len(ids):
+                data[[rows[t] for t in ids], j] = values
+        return cls(transcripts, [c[0] for c in columns], data)
+
+    def write_tsv(self, out):
+        """Write the matrix as tab separated values with a header line
+
+        :param out: the output file object
+        """
+        out.write("transcript_id\t%s\n" % "\t".join(self.samples))
+        for i, t in enumerate(self.transcripts):
+            out.write("%s\t%s\n" % (t, "\t".join(
+                "%g" % v for v in self.data[i])))
+
+    def save_npz(self, path):
+        """Save the matrix in NumPy npz format with the `data`,
+        `transcripts` and `samples` arrays
+
+        :param path: the output path
+        """
+        numpy = _import_numpy()
+        numpy.savez(path, data=self.data,
+                    transcripts=numpy.array(self.transcripts),
+                    samples=numpy.array(self.samples))
+
+
+def sample_columns(project, datasets, value='RPKM', cache=True, log=None):
+    """Generate the (sample, ids, values) columns of the given datasets.
+    Datasets without a transcript file are skipped.
+
+    :param project: the project
+    :param datasets: the datasets
+    :param value: the expression value, one of :py:data:`VALUES`
+    :param cache: use the per sample cache
+    :param log: optional function called with a message for each skipped
+        dataset
+    """
+    samples = _sample_cache(project)
+    for sample, source in _sample_sources(project, datasets, log):
+        ids, values = _read_sample(samples, sample, source, value, cache)
+        yield (sample, ids, values)
+
+
+def _sample_cache(project):
+    return SampleCache(os.path.join(project.path, '.grape', 'quantify'))
+
+
+def _sample_sources(project, datasets, log=None):
+    """Generate the (sample, source) tuples of the datasets with a
+    transcript file"""
+    for d in sorted(datasets, key=lambda d: d.id):
+        source = transcript_file(project, d)
+        if source is None or not os.path.exists(source):
+            if log:
+                log("No transcript file found for %s" % d.id)
+            continue
+        yield d.id, source
+
+
+def _read_sample(samples, sample, source, value, cache):
+    """Return the (ids, values) of a sample from the cache or the source
+    file"""
+    parsed = samples.get(sample, source, value) if cache else None
+    if parsed is None:
+        parsed = parse_transcripts(source, value)
+        if cache:
+            samples.put(sample, source, value, *parsed)
+    return parsed
+
+
+def build_matrix(project, datasets, value='RPKM', cache=True, log=None):
+    """Build the expression matrix for the given datasets. Datasets without
+    a transcript file are skipped.
+
+    :param project: the project
+    :param datasets: the datasets
+    :param value: the expression value, one of :py:data:`VALUES`
+    :param cache: use the per sample cache
+    :param log: optional function called with a message for each skipped
+        dataset
+    """
+    return ExpressionMatrix.from_columns(
+        list(sample_columns(project, datasets, value, cache, log)))
+
+
+def build_matrix_file(path, project, datasets, value='RPKM', cache=True,
+                      log=None):
+    """Write the expression matrix of the given datasets to a binary matrix
+    file (see :py:mod:`grape.matrix`) one sample at a time, so the full
+    matrix is never held in memory. The samples are read twice, the second
+    time from the per sample cache or, if the cache is not used, from the
+    transcript files again. The second pass reads the transcript files
+    found by the first one, and fails if one of them was removed or has
+    new transcripts.
+
+    :param path: the output path
+    :param project: the project
+    :param datasets: the datasets
+    :param value: the expression value, one of :py:data:`VALUES`
+    :param cache: use the per sample cache
+    :param log: optional function called with a message for each skipped
+        dataset
+    :returns: tuple with the number of transcripts and samples
+    :raises ValueError: if a transcript file changed between the two passes
+    """
+    from .matrix import MatrixWriter
+    samples = _sample_cache(project)
+    transcripts = set()
+    sources = []
+    for sample, source in _sample_sources(project, datasets, log):
+        ids, _ = _read_sample(samples, sample, source, value, cache)
+        transcripts.update(ids)
+        sources.append((sample, source))
+    writer = MatrixWriter(path, sorted(transcripts),
+                          [sample for sample, _ in sources])
+    try:
+        for j, (sample, source) in enumerate(sources):
+            if not os.path.exists(source):
+                raise ValueError("The transcript file of %s was removed "
+                                 "while writing the matrix: %s" % (
+                                     sample, source))
+            ids, values = _read_sample(samples, sample, source, value,
+                                       cache)
+            try:
+                writer.set_column(j, ids, values)
+            except ValueError, e:
+                raise ValueError("The transcript file of %s changed while "
+                                 "writing the matrix: %s. %s" % (
+                                     sample, source, str(e)))
+    except:
+        writer.discard()
+        raise
+    writer.close()
+    return len(transcripts), len(sources)
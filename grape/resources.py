@@ -0,0 +1,434 @@
+"""Grape resource planning
+
+Estimate the number of threads, the memory and the wall clock time needed by
+the pipeline jobs from the size of their input files. The estimates are
+based on per-tool resource profiles. The default profiles can be overwritten
+using a `resources.json` file in the grape_home `conf` folder or in the users
+`.grape` folder, using the tool names as keys, for example::
+
+    {
+        "grape_flux": {"memory": 4096, "memory_per_gb": 1024}
+    }
+
+Memory values are expressed in MB, time values in minutes and sizes in GB,
+matching the units used by jip for `max_memory` and `max_time`.
+
+If a job history is available (see :py:mod:`grape.history`), the memory
+and time of tools with enough recorded runs are derived from the history
+instead of the profiles.
+"""
+import os
+import math
+
+#: size of one GB in bytes
+GB = 1024.0 ** 3
+
+#: the default resource profiles for the grape tools. The profile values are:
+#:
+#:  threads         the minimum number of threads
+#:  max_threads     the maximum number of threads
+#:  gb_per_thread   the input size handled by one thread
+#:  memory          the base memory
+#:  memory_per_gb   the additional memory per GB of input
+#:  time            the base wall clock time
+#:  time_per_gb     the additional single thread time per GB of input
+#:  output_ratio    the expected ratio between output and input size
+#:  thread_weight   the share of threads given to the tool when it runs in
+#:                  a pipe chain. Tools with weight 0 get a single thread
+DEFAULT_PROFILES = {
+    "default": {
+        "threads": 1,
+        "max_threads": 1,
+        "gb_per_thread": 0,
+        "memory": 1024,
+        "memory_per_gb": 0,
+        "time": 60,
+        "time_per_gb": 30,
+        "output_ratio": 1.0,
+        "thread_weight": 1,
+    },
+    "grape_gem_index": {
+        "max_threads": 8,
+        "gb_per_thread": 0.5,
+        "memory": 2048,
+        "memory_per_gb": 8192,
+        "time": 60,
+        "time_per_gb": 480,
+        "output_ratio": 1.5,
+    },
+    "grape_gem_t_index": {
+        "max_threads": 8,
+        "gb_per_thread": 0.5,
+        "memory": 2048,
+        "memory_per_gb": 4096,
+        "time": 60,
+        "time_per_gb": 480,
+        "output_ratio": 1.5,
+    },
+    "grape_gem_rnatool": {
+        "max_threads": 8,
+        "gb_per_thread": 1,
+        "memory": 2048,
+        "memory_per_gb": 1024,
+        "time": 60,
+        "time_per_gb": 360,
+        "output_ratio": 1.2,
+    },
+    "grape_gem_quality": {
+        "memory": 256,
+    },
+    "grape_gem_filter": {
+        "memory": 256,
+    },
+    "grape_gem_mapfilter": {
+        "memory": 512,
+    },
+    "grape_pigz": {
+        "memory": 256,
+    },
+    "grape_samtools_view": {
+        "memory": 256,
+        "thread_weight": 0,
+    },
+    "grape_gem_sam": {
+        "max_threads": 4,
+        "gb_per_thread": 2,
+        "memory": 2048,
+        "memory_per_gb": 256,
+        "time": 30,
+        "time_per_gb": 60,
+        "output_ratio": 1.5,
+        "thread_weight": 4,
+    },
+    "grape_samtools_sort": {
+        "max_threads": 4,
+        "gb_per_thread": 2,
+        "memory": 1024,
+        "memory_per_gb": 512,
+        "time": 30,
+        "time_per_gb": 60,
+        "thread_weight": 2,
+    },
+    "grape_flux": {
+        "memory": 2048,
+        "memory_per_gb": 2048,
+        "time": 60,
+        "time_per_gb": 120,
+        "output_ratio": 0.05,
+    },
+}
+
+
+def load_profiles(home=None):
+    """Return the resource profiles merged with the global and the user
+    `resources.json` configuration files.
+
+    :param home: the grape home folder. Defaults to $GRAPE_HOME
+    """
+    from .grape import load_json
+
+    home = home or os.getenv("GRAPE_HOME", None)
+    profiles = dict((k, dict(v)) for k, v in DEFAULT_PROFILES.items())
+    paths = [os.path.join(os.path.expanduser("~"), ".grape", "resources.json")]
+    if home:
+        paths.insert(0, os.path.join(home, "conf", "resources.json"))
+    for path in paths:
+        cfg = load_json(path)
+        if not cfg:
+            continue
+        for name, values in cfg.items():
+            profile = profiles.setdefault(name, {})
+            profile.update((k, v) for k, v in values.items() if v is not None)
+    return profiles
+
+
+def split_threads(threads, names, profiles=None):
+    """Split the threads of a pipe chain between its tools proportionally to
+    the `thread_weight` of their profiles. Every tool gets at least one
+    thread and tools with weight 0 get exactly one. Returns the list of
+    threads in the order of the tool names.
+
+    :param threads: the number of threads of the chain
+    :param names: the tool names
+    :param profiles: the resource profiles. Defaults to the profiles
+        returned by :py:func:`load_profiles`
+    """
+    if profiles is None:
+        profiles = load_profiles()
+    default = profiles.get("default", {}).get("thread_weight", 1)
+    weights = [profiles.get(n, {}).get("thread_weight", default)
+               for n in names]
+    result = [1] * len(names)
+    weighted = [i for i, w in enumerate(weights) if w > 0]
+    available = int(threads or 1) - (len(names) - len(weighted))
+    if not weighted or available <= len(weighted):
+        return result
+    total = float(sum(weights[i] for i in weighted))
+    shares = dict((i, available * weights[i] / total) for i in weighted)
+    for i in weighted:
+        result[i] = max(1, int(shares[i]))
+    # hand out the remaining threads by largest remainder
+    remaining = available - sum(result[i] for i in weighted)
+    for i in sorted(weighted, key=lambda i: result[i] - shares[i]):
+        if remaining <= 0:
+            break
+        result[i] += 1
+        remaining -= 1
+    return result
+
+
+def index_sizes(project, datasets=None):
+    """Return a dictionary mapping the absolute paths of the files
+    registered in the project index to their size in bytes
+
+    :param project: the project
+    :param datasets: the datasets. Defaults to all project datasets
+    """
+    if datasets is None:
+        datasets = project.get_datasets()
+    sizes = {}
+    for d in datasets:
+        for files in d._files.values():
+            for path, info in files.items():
+                try:
+                    size = int(info.get('size'))
+                except (TypeError, ValueError):
+                    continue
+                sizes[os.path.abspath(os.path.join(project.path, path))] = size
+    return sizes
+
+
+class ResourcePlanner(object):
+    """Plan the job resources from the input file sizes
+
+    :param profiles: the resource profiles. Defaults to the profiles
+        returned by :py:func:`load_profiles`
+    :param sizes: dictionary with known file sizes, e.g. the sizes stored
+        in the project index
+    :param history: list of :py:class:`grape.history.History` stores used
+        to derive the resources from previous runs
+    """
+
+    def __init__(self, profiles=None, sizes=None, history=None):
+        self.profiles = profiles if profiles is not None else load_profiles()
+        self.sizes = sizes or {}
+        self.history = history or []
+        self._input_bytes = {}
+
+    def model(self, name):
+        """Return the history resource model for a tool or None
+
+        :param name: the tool name
+        """
+        for store in self.history:
+            model = store.model(name)
+            if model:
+                return model
+        return None
+
+    def profile(self, name):
+        """Return the resource profile for a tool. Missing values are taken
+        from the default profile.
+
+        :param name: the tool name
+        """
+        profile = dict(self.profiles.get("default", {}))
+        profile.update(self.profiles.get(name, {}))
+        return profile
+
+    def file_size(self, path):
+        """Return the size of a file in bytes or None if the size is not
+        known and the file does not exist
+
+        :param path: the file path
+        """
+        path = os.path.abspath(path)
+        if path in self.sizes:
+            return self.sizes[path]
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return None
+
+    def input_bytes(self, job):
+        """Return the estimated input size of a job in bytes. The size of
+        input files that do not exist yet is estimated from the input size
+        of the jobs producing them.
+
+        :param job: the job
+        """
+        if job in self._input_bytes:
+            return self._input_bytes[job]
+        # guard against cycles
+        self._input_bytes[job] = 0
+        total = 0
+        missing = False
+        for path in job.get_input_files():
+            size = self.file_size(path)
+            if size is None:
+                missing = True
+            else:
+                total += size
+        pipe_from = getattr(job, 'pipe_from', None) or []
+        if missing or pipe_from:
+            for parent in list(job.dependencies) + list(pipe_from):
+                ratio = self.profile(parent.tool_name).get('output_ratio', 1.0)
+                total += self.input_bytes(parent) * ratio
+        self._input_bytes[job] = total
+        return total
+
+    def threads(self, name, size):
+        """Return the number of threads for a tool and a given input size
+
+        :param name: the tool name
+        :param size: the input size in bytes
+        """
+        profile = self.profile(name)
+        threads = profile.get('threads', 1)
+        if profile.get('gb_per_thread'):
+            threads = max(threads,
+                          int(size / GB / profile['gb_per_thread']) + 1)
+        return max(1, min(threads, profile.get('max_threads', threads)))
+
+    def plan(self, name, size, threads=None):
+        """Return a dictionary with the planned `threads`, `max_memory` (MB)
+        and `max_time` (minutes) for a tool
+
+        :param name: the tool name
+        :param size: the input size in bytes
+        :param threads: the number of threads used by the tool. If not
+            specified, the number of threads is planned from the input size
+        """
+        profile = self.profile(name)
+        gb = size / GB
+        if not threads:
+            threads = self.threads(name, size)
+        memory = profile.get('memory', 0) + profile.get('memory_per_gb', 0) * gb
+        time = profile.get('time', 0) + \
+            profile.get('time_per_gb', 0) * gb / threads
+        model = self.model(name)
+        if model:
+            from .history import MARGIN
+            if 'rss' in model:
+                intercept, slope = model['rss']
+                memory = MARGIN * (intercept + slope * size) / 1024
+            intercept, slope = model['cpu']
+            time = MARGIN * (intercept + slope * size) / threads / 60
+        return {
+            'threads': int(threads),
+            'max_memory': int(memory),
+            'max_time': int(time) + 1,
+        }
+
+    def plan_job(self, job):
+        """Return the planned resources for a job. The number of threads is
+        taken from the tools `threads` option, if the tool has one, so the
+        reservation matches the rendered command.
+
+        Jobs that stream their output to other jobs run together with them,
+        so the threads and the memory of the whole pipe chain are reserved
+        for the first job, the only one submitted.
+
+        The memory is returned per thread: the clusters reserve the job
+        memory for each CPU, e.g. the Slurm `--mem-per-cpu` and the SGE per
+        slot memory.
+
+        If the history has a model for the pipe chain, see
+        :py:func:`grape.history.chain_tool`, the time of the chain is taken
+        from it. The recorded peak memory is the one of the largest process
+        of the chain, not of all the processes running together, so the
+        memory of the chain is taken from the history only if it is larger
+        than the sum of the memory of its tools.
+
+        :param job: the job
+        """
+        plan = self._plan_chain(job)
+        if getattr(job, 'pipe_to', None):
+            from .history import chain_tool
+            name = chain_tool(job)
+            model = self.model(name)
+            if model:
+                chain_plan = self.plan(name, self.input_bytes(job),
+                                       threads=plan['threads'])
+                plan['max_time'] = chain_plan['max_time']
+                if 'rss' in model:
+                    plan['max_memory'] = max(plan['max_memory'],
+                                             chain_plan['max_memory'])
+        plan['max_memory'] = per_thread_memory(plan['max_memory'],
+                                               plan['threads'])
+        return plan
+
+    def _plan_chain(self, job):
+        """Return the planned threads and total memory of a job and the
+        jobs it pipes to"""
+        plan = self.plan(job.tool_name, self.input_bytes(job),
+                         threads=_tool_threads(job))
+        for child in getattr(job, 'pipe_to', None) or []:
+            child_plan = self._plan_chain(child)
+            plan['threads'] += child_plan['threads']
+            plan['max_memory'] += child_plan['max_memory']
+            plan['max_time'] = max(plan['max_time'], child_plan['max_time'])
+        return plan
+
+
+def per_thread_memory(max_memory, threads=1):
+    """Return the memory per thread in MB for a job with the given total
+    memory and threads, rounded up
+
+    :param max_memory: the total job memory in MB
+    :param threads: the number of threads
+    """
+    threads = max(1, int(threads or 1))
+    return int(math.ceil(max_memory / float(threads)))
+
+
+def _tool_threads(job):
+    """Return the value of the tools threads option or None"""
+    try:
+        value = job.tool.options['threads'].get()
+        return int(value) if value else None
+    except Exception:
+        return None
+
+
+#: the fraction of the job memory used for the samtools sort buffers
+SORT_MEMORY_FRACTION = 0.75
+
+#: the minimum samtools sort memory per thread in MB
+MIN_SORT_MEMORY = 128
+
+
+def sort_memory(max_memory, threads=1):
+    """Return the samtools sort memory per thread in MB for a job with the
+    given memory and threads. samtools allocates the sort buffer for each
+    thread, so the job memory is split between the threads.
+
+    :param max_memory: the job memory in MB
+    :param threads: the number of sort threads
+    """
+    threads = max(1, int(threads or 1))
+    return max(MIN_SORT_MEMORY,
+               int(max_memory * SORT_MEMORY_FRACTION / threads))
+
+
+def configure_sort(job):
+    """Set the per thread memory of a samtools sort job from the job memory
+    and threads, if it is not set explicitly, and render the job command
+    again. The job memory is reserved per thread, see
+    :py:meth:`ResourcePlanner.plan_job`. Larger buffers reduce the number of temporary files written and
+    merged by samtools.
+
+    :param job: the job
+    :returns: True if the job was changed
+    """
+    if job.tool_name != 'grape_samtools_sort' or not job.max_memory:
+        return False
+    option = job.tool.options['max_memory']
+    if option.get():
+        return False
+    threads = _tool_threads(job) or job.threads or 1
+    total = job.max_memory * max(1, int(job.threads or 1))
+    option.set("%dM" % sort_memory(total, threads))
+    cmds = job.tool.get_command()
+    job.command = cmds[1] if isinstance(cmds, (list, tuple)) else cmds
+    return True
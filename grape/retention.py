@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""Grape intermediate file retention
+
+Apply a retention policy to intermediate pipeline outputs once all the
+jobs consuming them have succeeded. The policies are:
+
+    keep        the file is left in place
+    delete      the file is removed
+    archive     the file is moved to the `archive` folder of the project,
+                keeping its path relative to the project folder
+
+The project index is updated to match: deleted files are removed from the
+dataset and archived files point to their new location.
+
+Usage::
+
+    python -m grape.retention -f <files>... [-p <policy>] [-n <name>]
+        [--update-index]
+"""
+import os
+import sys
+
+#: the available retention policies
+POLICIES = ['keep', 'delete', 'archive']
+
+#: the name of the archive folder
+ARCHIVE_DIR = 'archive'
+
+
+def parse_policies(value):
+    """Parse retention policies given as a comma separated list of
+    `output=policy` pairs, e.g. `map=delete,filtered_map=archive`, and
+    return them as a dictionary
+
+    :param value: the policies string
+    :raises ValueError: if a policy is not valid
+    """
+    policies = {}
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if "=" not in item:
+            raise ValueError("Invalid retention policy: %s" % item)
+        key, policy = [s.strip() for s in item.split("=", 1)]
+        if policy not in POLICIES:
+            raise ValueError("Unknown retention policy for %s: %s. "
+                             "Use one of %s" % (key, policy,
+                                                ", ".join(POLICIES)))
+        policies[key] = policy
+    return policies
+
+
+def archive_path(path, root=None):
+    """Return the archive location of a file. Files inside the `root`
+    folder are moved to `<root>/archive` keeping their relative path, other
+    files to an `archive` folder next to them.
+
+    :param path: the file path
+    :param root: the project folder
+    """
+    path = os.path.abspath(path)
+    if root:
+        root = os.path.abspath(root)
+        if path.startswith(root + os.sep):
+            return os.path.join(root, ARCHIVE_DIR,
+                                os.path.relpath(path, root))
+    return os.path.join(os.path.dirname(path), ARCHIVE_DIR,
+                        os.path.basename(path))
+
+
+def is_applied(files, policy, root=None):
+    """Return True if the policy was applied to all the files, that is the
+    files do not exist anymore and, for archived files, exist in the archive
+
+    :param files: the file paths
+    :param policy: the retention policy
+    :param root: the project folder
+    """
+    if policy == 'keep':
+        return True
+    for path in files:
+        if os.path.exists(path):
+            return False
+        if policy == 'archive' and \
+                not os.path.exists(archive_path(path, root)):
+            return False
+    return True
+
+
+def apply(files, policy, root=None):
+    """Apply a retention policy and return a dictionary that maps the
+    absolute path of each processed file to its new location, or None for
+    deleted files. Missing files are skipped.
+
+    :param files: the file paths
+    :param policy: the retention policy
+    :param root: the project folder
+    """
+    import shutil
+
+    if policy not in POLICIES:
+        raise ValueError("Unknown retention policy: %s" % policy)
+    applied = {}
+    if policy == 'keep':
+        return applied
+    for path in files:
+        path = os.path.abspath(path)
+        if not os.path.exists(path):
+            continue
+        if policy == 'delete':
+            os.remove(path)
+            applied[path] = None
+        else:
+            target = archive_path(path, root)
+            if not os.path.exists(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            shutil.move(path, target)
+            applied[path] = target
+    return applied
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="python -m grape.retention",
+        description="Apply a retention policy to intermediate files")
+    parser.add_argument("-f", "--files", nargs="+", required=True,
+                        help="The files")
+    parser.add_argument("-p", "--policy", default="delete",
+                        choices=POLICIES, help="The retention policy. "
+                                               "Default: delete")
+    parser.add_argument("-n", "--name", default=None,
+                        help="The dataset id used to update the index")
+    parser.add_argument("--update-index", dest="update_index", default=False,
+                        action="store_true",
+                        help="Update the files in the project index")
+    args = parser.parse_args(argv)
+
+    from .grape import Project
+
+    files = [os.path.abspath(f) for f in args.files]
+    project = Project.find(os.path.dirname(files[0]))
+    root = project.path if project else None
+    applied = apply(files, args.policy, root)
+    if args.update_index and args.name and applied:
+        if project is None:
+            sys.stderr.write("No grape project found, index not updated\n")
+            return
+        from .grapeindex import update_files
+        update_files(project, args.name, applied)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""Grape single-end SAM flag fixer
+
+Clear the paired-end bits from the flags of SAM records produced for
+single-end data. The cleared bits are 0x1 (paired), 0x2 (proper pair),
+0x8 (mate unmapped), 0x20 (mate reverse), 0x40 (first in pair) and 0x80
+(second in pair), applied as a single mask per record.
+
+SAM text is processed by default. BAM files, detected by the `.bam`
+extension of the input or output file, are supported if `pysam` is
+installed.
+
+Usage::
+
+    python -m grape.samfix [-i <input>] [-o <output>]
+"""
+import sys
+
+#: the paired-end flag bits cleared for single-end data
+PAIRED_BITS = 0x1 | 0x2 | 0x8 | 0x20 | 0x40 | 0x80
+
+#: the mask applied to the record flags
+FLAG_MASK = ~PAIRED_BITS & 0xffff
+
+#: number of lines written at once
+_BATCH = 4096
+
+
+def fix_flag(flag):
+    """Return the flag with the paired-end bits cleared
+
+    :param flag: the SAM flag
+    """
+    return flag & FLAG_MASK
+
+
+def fix_sam(input, output):
+    """Fix the flags of a SAM text stream. The fixed flag is computed once
+    for each distinct flag value.
+
+    :param input: the input file object
+    :param output: the output file object
+    """
+    flags = {}
+    batch = []
+    for line in input:
+        if line[0] != '@':
+            fields = line.split('\t', 2)
+            if len(fields) == 3:
+                flag = fields[1]
+                fixed = flags.get(flag)
+                if fixed is None:
+                    fixed = flags[flag] = str(fix_flag(int(flag)))
+                if fixed != flag:
+                    line = '%s\t%s\t%s' % (fields[0], fixed, fields[2])
+        batch.append(line)
+        if len(batch) >= _BATCH:
+            output.writelines(batch)
+            batch = []
+    output.writelines(batch)
+    output.flush()
+
+
+def fix_bam(input, output):
+    """Fix the flags of a SAM or BAM file using pysam. The file types are
+    selected from the `.bam` extension.
+
+    :param input: the input path or '-' for stdin
+    :param output: the output path or '-' for stdout
+    """
+    try:
+        import pysam
+    except ImportError:
+        raise ValueError("pysam is required to process BAM files")
+    in_mode = 'rb' if input.endswith('.bam') else 'r'
+    out_mode = 'wb' if output.endswith('.bam') else 'wh'
+    source = pysam.AlignmentFile(input, in_mode)
+    target = pysam.AlignmentFile(output, out_mode, template=source)
+    try:
+        for read in source:
+            read.flag = fix_flag(read.flag)
+            target.write(read)
+    finally:
+        target.close()
+        source.close()
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="python -m grape.samfix",
+        description="Clear the paired-end SAM flags for single-end data")
+    parser.add_argument("-i", "--input", default='-',
+                        help="The input SAM or BAM file. Default: stdin")
+    parser.add_argument("-o", "--output", default='-',
+                        help="The output SAM or BAM file. Default: stdout")
+    args = parser.parse_args(argv)
+
+    if args.input.endswith('.bam') or args.output.endswith('.bam'):
+        try:
+            fix_bam(args.input, args.output)
+        except ValueError, e:
+            sys.stderr.write("%s\n" % str(e))
+            sys.exit(1)
+        return
+
+    input = sys.stdin if args.input == '-' else open(args.input)
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        fix_sam(input, output)
+    finally:
+        if input is not sys.stdin:
+            input.close()
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
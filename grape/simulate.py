@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+"""Grape simulated modules
+
+The simulated modules replace the binaries of the GEMtools, CRGtools,
+SAMtools and Flux Capacitor modules, so the default pipeline can be run and
+submitted without the real tools, e.g. for throughput tests. For each binary
+a wrapper script is installed to `$GRAPE_HOME/modules/<name>/<version>/bin`
+that runs this module. The simulator parses the options passed by the grape
+tools, waits for the configured runtime and writes outputs with the format
+of the real ones:
+
+- GEM index files with a short header
+- gzipped GEM map files with a mix of unmapped, unique, mismatched, split
+  and multimapped paired reads, which the grape map filter and statistics
+  process as usual
+- SAM records for the mapped reads. The simulated BAM files contain the
+  sorted SAM records compressed with gzip
+- Flux Capacitor GTF files with transcript, junction and intron records with
+  `RPKM` and `reads` values
+
+The runtime and the number of reads and transcripts are set when the
+modules are installed::
+
+    python -m grape.simulate install [-r <runtime>] [-n <reads>]
+        [-t <transcripts>] <grape_home>
+"""
+import os
+import sys
+import time
+import gzip
+import random
+import argparse
+
+#: the simulated binaries of each module
+BINARIES = {
+    'gemtools': ['gemtools', 'gt.stats', 'gem-2-sam'],
+    'crgtools': ['gt.quality', 'gt.filter', 'pigz'],
+    'samtools': ['samtools'],
+    'flux': ['flux-capacitor'],
+}
+
+#: the default simulation settings
+RUNTIME = 0.0
+READS = 1000
+TRANSCRIPTS = 100
+
+#: the simulated read length and chromosomes
+READ_LENGTH = 76
+CHROMOSOMES = ['chr1', 'chr2', 'chr3']
+
+_SEQUENCE = 'ACGTTGCAAGCTTCGATCGGATCCATGCAGTCAGTACGATCGTAGCTAGCATCGAT' * 4
+
+_WRAPPER = """#!/bin/bash
+exec %(python)s -m grape.simulate run -r %(runtime)s -n %(reads)d \
+-t %(transcripts)d %(binary)s "$@"
+"""
+
+
+def install(home, runtime=RUNTIME, reads=READS, transcripts=TRANSCRIPTS):
+    """Install the simulated binaries for all the modules used by the grape
+    tools to a grape home folder and return the list of installed module
+    folders
+
+    :param home: the grape home folder
+    :param runtime: the number of seconds each binary runs
+    :param reads: the number of reads of each simulated sample
+    :param transcripts: the number of transcripts in the Flux Capacitor
+        output
+    """
+    import inspect
+    from . import tools
+    modules = set([])
+    for tool in vars(tools).values():
+        if inspect.isclass(tool):
+            modules.update(tuple(m) for m in getattr(tool, 'modules', None)
+                           or [])
+    installed = []
+    for module in sorted(modules):
+        folder = os.path.join(home, 'modules', *module)
+        bin = os.path.join(folder, 'bin')
+        if not os.path.exists(bin):
+            os.makedirs(bin)
+        for binary in BINARIES.get(module[0], []):
+            path = os.path.join(bin, binary)
+            with open(path, 'w') as f:
+                f.write(_WRAPPER % {'python': sys.executable,
+                                    'runtime': float(runtime),
+                                    'reads': reads,
+                                    'transcripts': transcripts,
+                                    'binary': binary})
+            os.chmod(path, 0755)
+        installed.append(folder)
+    return installed
+
+
+def _open_in(path):
+    if path is None or path == '-':
+        return sys.stdin
+    if path.endswith('.gz') or path.endswith('.bam'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _open_out(path):
+    if path is None or path == '-' or path == 'stdout':
+        return sys.stdout
+    if path.endswith('.gz') or path.endswith('.bam'):
+        return gzip.open(path, 'wb')
+    return open(path, 'wb')
+
+
+def _touch(path, content=''):
+    folder = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def _parser(values=(), flags=()):
+    """Return a parser for the given value options and flags. Each option
+    is a list of option names"""
+    parser = argparse.ArgumentParser(add_help=False)
+    for names in values:
+        parser.add_argument(*names)
+    for names in flags:
+        parser.add_argument(*names, action='store_true')
+    return parser
+
+
+def map_lines(name, reads):
+    """Generate the GEM map lines of a simulated paired end sample
+
+    :param name: the sample name, used as the random seed
+    :param reads: the number of reads
+    """
+    rnd = random.Random(name)
+    quality = 'I' * READ_LENGTH
+    for i in range(reads):
+        offset = i % (len(_SEQUENCE) - READ_LENGTH)
+        seq = _SEQUENCE[offset:offset + READ_LENGTH]
+        chr = CHROMOSOMES[i % len(CHROMOSOMES)]
+        pos = rnd.randint(1, 1000000)
+        kind = rnd.random()
+        first = str(READ_LENGTH)
+        second = str(READ_LENGTH)
+        if kind < 0.1:
+            mappings = ['-']
+        elif kind < 0.2:
+            first = "%dA%d" % (READ_LENGTH / 2, READ_LENGTH / 2 - 1)
+        elif kind < 0.3:
+            second = "%d>1200*%d" % (READ_LENGTH / 2, READ_LENGTH / 2)
+        if kind >= 0.1:
+            mappings = ["%s:+:%d:%s::%s:-:%d:%s:::255" % (
+                chr, pos, first, chr, pos + 200, second)]
+            if 0.3 <= kind < 0.4:
+                mappings.append("%s:+:%d:%s::%s:-:%d:%s:::255" % (
+                    chr, pos + 5000, first, chr, pos + 5200, second))
+        counters = "0:%d" % len(mappings) if mappings != ['-'] else "0"
+        yield "%s/%d\t%s %s\t%s %s\t%s\t%s\n" % (
+            name, i, seq, seq, quality, quality, counters, ",".join(mappings))
+
+
+def sam_lines(input, sequence_lengths=False):
+    """Convert simulated GEM map lines to SAM lines
+
+    :param input: the map lines
+    :param sequence_lengths: add the sequence lengths to the SAM header
+    """
+    yield "@HD\tVN:1.0\tSO:unsorted\n"
+    if sequence_lengths:
+        for chr in CHROMOSOMES:
+            yield "@SQ\tSN:%s\tLN:%d\n" % (chr, 2000000)
+    for line in input:
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) != 5 or fields[4] == '-':
+            continue
+        name = fields[0].replace('/', '_')
+        seq = fields[1].split(' ')[0]
+        qual = fields[2].split(' ')[0]
+        mapping = fields[4].split(',')[0].split(':::')[0]
+        ends = [e.split(':') for e in mapping.split('::')]
+        for i, (chr, strand, pos, cigar) in enumerate(ends):
+            flag = 1 | 2 | (64 if i == 0 else 128) | \
+                (16 if strand == '-' else 0)
+            mate = ends[1 - i]
+            yield "%s\t%d\t%s\t%s\t255\t%dM\t=\t%s\t0\t%s\t%s\n" % (
+                name, flag, chr, pos, READ_LENGTH, mate[2], seq, qual)
+
+
+def gtf_lines(name, transcripts):
+    """Generate the Flux Capacitor GTF lines of a simulated sample
+
+    :param name: the sample name, used as the random seed
+    :param transcripts: the number of transcripts
+    """
+    rnd = random.Random(name)
+    for i in range(transcripts):
+        chr = CHROMOSOMES[i % len(CHROMOSOMES)]
+        start = 1 + i * 10000
+        reads = rnd.randint(0, 1000)
+        rpkm = reads * 1000.0 / 2000
+        ids = 'gene_id "G%06d"; transcript_id "T%06d";' % (i, i)
+        yield "%s\tflux\ttranscript\t%d\t%d\t.\t+\t.\t%s reads %d; " \
+              "length 2000; RPKM %.6f;\n" % (chr, start, start + 5000, ids,
+                                             reads, rpkm)
+        yield "%s\tflux\tjunction\t%d\t%d\t.\t+\t.\t%s reads %d;\n" % (
+            chr, start + 1000, start + 2000, ids, reads / 2)
+        yield "%s\tflux\tintron\t%d\t%d\t.\t+\t.\t%s reads %d;\n" % (
+            chr, start + 1001, start + 1999, ids, reads / 10)
+
+
+def gem_index(args, config):
+    opts, _ = _parser([['-i', '--input'], ['-o', '--output'],
+                       ['-t', '--threads']],
+                      [['--no-hash']]).parse_known_args(args)
+    output = opts.output or os.path.splitext(opts.input)[0] + '.gem'
+    _touch(output, "GEM index of %s\n" % opts.input)
+
+
+def gem_t_index(args, config):
+    opts, _ = _parser([['-i', '--index'], ['-a', '--annotation'],
+                       ['-o', '--output-prefix'], ['-t', '--threads'],
+                       ['-m', '--max-length']]).parse_known_args(args)
+    prefix = opts.output_prefix or opts.annotation
+    for ext in ['.junctions.gem', '.junctions.keys']:
+        _touch(prefix + ext, "GEM transcriptome index of %s\n" %
+               opts.annotation)
+
+
+def gem_rna_pipeline(args, config):
+    opts, _ = _parser([['-f', '--fastq'], ['-i', '--index'],
+                       ['-r', '--transcript-index'], ['-q', '--quality'],
+                       ['-n', '--name'], ['-o', '--output-dir'],
+                       ['-t', '--threads']],
+                      [['-s', '--single-end'], ['--no-bam'],
+                       ['--no-stats']]).parse_known_args(args)
+    folder = opts.output_dir or os.getcwd()
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    prefix = os.path.join(folder, opts.name)
+    out = gzip.open(prefix + '.map.gz', 'wb')
+    try:
+        out.writelines(map_lines(opts.name, config.reads))
+    finally:
+        out.close()
+    if not opts.no_bam:
+        _sort(sam_lines(map_lines(opts.name, config.reads)), prefix + '.bam')
+        _touch(prefix + '.bam.bai', "BAM index\n")
+
+
+def copy(args, config):
+    """gt.quality, gt.filter: copy the map records"""
+    opts, _ = _parser([['-i', '--input'], ['-o', '--output'],
+                       ['-n', '--name'], ['-t', '--threads'],
+                       ['--max-levenshtein-error'],
+                       ['--max-matches']]).parse_known_args(args)
+    _write(_open_out(opts.output), _open_in(opts.input))
+
+
+def gem_stats(args, config):
+    opts, _ = _parser([['-i', '--input'], ['-n', '--name'],
+                       ['-t', '--threads']],
+                      [['-a', '--all-tests'],
+                       ['-p', '--paired-end']]).parse_known_args(args)
+    count = sum(1 for _ in _open_in(opts.input))
+    sys.stdout.write("Reads: %d\n" % count)
+
+
+def gem_2_sam(args, config):
+    opts, _ = _parser([['-f', '--input'], ['-o', '--output'],
+                       ['-I', '--index'], ['-q', '--quality'],
+                       ['-n', '--name'], ['-T', '--threads'],
+                       ['--read-group']],
+                      [['-l', '--sequence-lengths'],
+                       ['--expect-single-end-reads'],
+                       ['--expect-paired-end-reads']]).parse_known_args(args)
+    _write(_open_out(opts.output), sam_lines(_open_in(opts.input),
+                                             opts.sequence_lengths))
+
+
+def pigz(args, config):
+    opts, _ = _parser([['-p'], ['-c']], [['-d']]).parse_known_args(args)
+    input = _open_in(opts.c)
+    if opts.d:
+        _write(sys.stdout, input)
+        return
+    _write(gzip.GzipFile(fileobj=sys.stdout, mode='wb'), input)
+    sys.stdout.flush()
+
+
+def samtools(args, config):
+    command, args = args[0], args[1:]
+    if command == 'view':
+        opts, rest = _parser([['-@']], [['-S'], ['-b'], ['-u']]
+                             ).parse_known_args(args)
+        _write(sys.stdout, _open_in(rest[0] if rest else None))
+    elif command == 'sort':
+        opts, rest = _parser([['-@'], ['-m']], [['-o']]).parse_known_args(args)
+        input, prefix = rest[0], rest[1]
+        if opts.o:
+            output = sys.stdout
+        else:
+            output = prefix + '.bam'
+        _sort(_open_in(input), output)
+    elif command == 'index':
+        _touch(args[1] if len(args) > 1 else args[0] + '.bai', "BAM index\n")
+    else:
+        raise ValueError("samtools %s is not simulated" % command)
+
+
+def flux(args, config):
+    opts, _ = _parser([['-i', '--input'], ['-a', '--annotation'],
+                       ['-o', '--output']]).parse_known_args(args)
+    name = os.path.basename(opts.output).rsplit('.', 1)[0]
+    out = _open_out(opts.output)
+    try:
+        out.writelines(gtf_lines(name, config.transcripts))
+    finally:
+        out.close()
+
+
+def _write(out, lines):
+    try:
+        for line in lines:
+            out.write(line)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        else:
+            out.flush()
+
+
+def _sort(lines, output):
+    header = []
+    records = []
+    for line in lines:
+        if line.startswith('@'):
+            header.append(line)
+        else:
+            records.append(line)
+
+    def key(line):
+        fields = line.split('\t', 4)
+        return fields[2], int(fields[3])
+    records.sort(key=key)
+    if output is sys.stdout:
+        out = gzip.GzipFile(fileobj=sys.stdout, mode='wb')
+    else:
+        out = _open_out(output)
+    try:
+        out.writelines(header)
+        out.writelines(records)
+    finally:
+        out.close()
+
+
+#: the simulated commands
+COMMANDS = {
+    ('gemtools', 'index'): gem_index,
+    ('gemtools', 't-index'): gem_t_index,
+    ('gemtools', 'rna-pipeline'): gem_rna_pipeline,
+    ('gt.quality',): copy,
+    ('gt.filter',): copy,
+    ('gt.stats',): gem_stats,
+    ('gem-2-sam',): gem_2_sam,
+    ('pigz',): pigz,
+    ('samtools',): samtools,
+    ('flux-capacitor',): flux,
+}
+
+
+def simulate(binary, args, config):
+    """Simulate a binary call
+
+    :param binary: the binary name
+    :param args: the binary arguments
+    :param config: the simulation settings with the `runtime`, `reads` and
+        `transcripts` attributes
+    """
+    command = COMMANDS.get((binary, args[0] if args else None))
+    if command is not None:
+        args = args[1:]
+    else:
+        command = COMMANDS.get((binary,))
+    if command is None:
+        raise ValueError("%s %s is not simulated" % (binary,
+                                                     " ".join(args[:1])))
+    if config.runtime > 0:
+        time.sleep(config.runtime)
+    command(args, config)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers()
+    for name, help in [('install', "Install the simulated modules"),
+                       ('run', "Run a simulated binary")]:
+        command = commands.add_parser(name, help=help)
+        command.set_defaults(command=name)
+        command.add_argument("-r", "--runtime", type=float, default=RUNTIME,
+                             help="The runtime of each binary call in "
+                                  "seconds. Default: %s" % RUNTIME)
+        command.add_argument("-n", "--reads", type=int, default=READS,
+                             help="The number of reads of each sample. "
+                                  "Default: %d" % READS)
+        command.add_argument("-t", "--transcripts", type=int,
+                             default=TRANSCRIPTS,
+                             help="The number of quantified transcripts. "
+                                  "Default: %d" % TRANSCRIPTS)
+        if name == 'install':
+            command.add_argument("home", help="The grape home folder")
+        else:
+            command.add_argument("binary", help="The binary name")
+            command.add_argument("args", nargs=argparse.REMAINDER,
+                                 help="The binary arguments")
+    args = parser.parse_args(argv)
+    if args.command == 'install':
+        for folder in install(args.home, args.runtime, args.reads,
+                              args.transcripts):
+            print folder
+    else:
+        simulate(args.binary, args.args, args)
+
+
+if __name__ == '__main__':
+    main()
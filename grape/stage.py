@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+"""Grape scratch staging
+
+Run a job command in a scratch folder on the local disk of the compute node
+instead of the shared project folders. For each output folder of the job a
+scratch folder is created under `$TMPDIR` and the job inputs stored in
+the output folder, together with the files named after them such as the
+BAM index, are linked into it, so the inputs are streamed from their
+original location. The output folders are replaced with the scratch folders
+in the command, so all the files written by the command, including the
+temporary files, are written to the local disk.
+
+When the command succeeds the new files are moved back to the output
+folders. Files on a different file system are copied to a temporary file
+next to the destination, verified with their MD5 checksum and renamed, so
+the final outputs appear atomically. The scratch folder is always removed.
+
+Usage::
+
+    python -m grape.stage -o <output>... [-i <input>...] [-s <scratch>] -c <command>
+"""
+import os
+import re
+import sys
+
+#: the tools whose jobs are staged
+STAGED_TOOLS = ['grape_gem_rnatool', 'grape_samtools_sort', 'grape_flux']
+
+
+def scratch_root(path=None):
+    """Return the folder where the scratch folders are created: the given
+    path, `$TMPDIR` or the system temporary folder
+
+    :param path: the scratch root folder
+    """
+    import tempfile
+    return path or os.environ.get('TMPDIR') or tempfile.gettempdir()
+
+
+def rewrite(command, folders):
+    """Replace folder paths in a command
+
+    :param command: the command
+    :param folders: dictionary that maps the folders to their replacement
+    """
+    for folder in sorted(folders, key=len, reverse=True):
+        target = folders[folder]
+        command = re.sub(re.escape(folder) + r'(?=[/\s"\';|&)]|$)',
+                         lambda m: target, command)
+    return command
+
+
+def _md5_copy(source, target, n_blocks=128):
+    """Copy a file and return the MD5 checksum of the copied data"""
+    import hashlib
+    md5 = hashlib.md5()
+    with open(source, 'rb') as src:
+        with open(target, 'wb') as dst:
+            for chunk in iter(lambda: src.read(n_blocks * md5.block_size),
+                              b''):
+                md5.update(chunk)
+                dst.write(chunk)
+    return md5.hexdigest()
+
+
+def move(source, target):
+    """Move a file atomically. Files on a different file system are copied
+    to a temporary file next to the target, verified and renamed.
+
+    :param source: the source path
+    :param target: the target path
+    :raises IOError: if the checksum of the copy does not match
+    """
+    from .utils import md5sum
+
+    if os.stat(source).st_dev == \
+            os.stat(os.path.dirname(target)).st_dev:
+        os.rename(source, target)
+        return
+    tmp = os.path.join(os.path.dirname(target),
+                       '.%s.stage.%d' % (os.path.basename(target),
+                                         os.getpid()))
+    try:
+        md5 = _md5_copy(source, tmp)
+        if md5sum(tmp) != md5:
+            raise IOError("Checksum mismatch copying %s to %s" %
+                          (source, target))
+        os.rename(tmp, target)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    os.remove(source)
+
+
+class Stage(object):
+    """Scratch folders for the output folders of a job
+
+    :param outputs: the job output files
+    :param root: the folder where the scratch folder is created
+    :param inputs: the job input files
+    """
+
+    def __init__(self, outputs, root=None, inputs=None):
+        import tempfile
+        self.outputs = set(os.path.abspath(o) for o in outputs)
+        self.inputs = sorted(set(os.path.abspath(i) for i in inputs or []))
+        self.path = tempfile.mkdtemp(prefix='grape.stage.',
+                                     dir=scratch_root(root))
+        self.folders = {}
+        for i, folder in enumerate(sorted(set(
+                os.path.dirname(o) for o in self.outputs))):
+            scratch = os.path.join(self.path, str(i))
+            os.mkdir(scratch)
+            self.folders[folder] = scratch
+            if os.path.exists(folder):
+                self._link(folder, scratch)
+
+    def _link(self, folder, scratch):
+        """Link the inputs stored in an output folder, and the files named
+        after them, into its scratch folder"""
+        for path in self.inputs:
+            rel = os.path.relpath(path, folder)
+            parent = os.path.dirname(path)
+            if rel == os.curdir or rel.startswith(os.pardir) or \
+                    not os.path.isdir(parent):
+                continue
+            base = os.path.basename(path)
+            for name in os.listdir(parent):
+                source = os.path.join(parent, name)
+                if (name != base and not name.startswith(base + '.')) or \
+                        source in self.outputs:
+                    continue
+                target = os.path.join(scratch, os.path.dirname(rel), name)
+                if os.path.lexists(target):
+                    continue
+                if not os.path.isdir(os.path.dirname(target)):
+                    os.makedirs(os.path.dirname(target))
+                os.symlink(source, target)
+
+    def command(self, command):
+        """Return the command with the output folders replaced by the
+        scratch folders
+
+        :param command: the job command
+        """
+        return rewrite(command, self.folders)
+
+    def finish(self):
+        """Move the new files back to the output folders and return the
+        list of moved files"""
+        moved = []
+        for folder, scratch in sorted(self.folders.items()):
+            for parent, dirs, files in os.walk(scratch):
+                for name in files:
+                    path = os.path.join(parent, name)
+                    if os.path.islink(path):
+                        continue
+                    target = os.path.join(folder,
+                                          os.path.relpath(path, scratch))
+                    if not os.path.exists(os.path.dirname(target)):
+                        os.makedirs(os.path.dirname(target))
+                    move(path, target)
+                    moved.append(target)
+        return moved
+
+    def cleanup(self):
+        """Remove the scratch folder"""
+        import shutil
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def run(command, outputs, root=None, inputs=None):
+    """Run a command staged to a scratch folder and return its exit code.
+    The outputs are moved back only if the command succeeds.
+
+    :param command: the command
+    :param outputs: the output files
+    :param root: the folder where the scratch folder is created
+    :param inputs: the input files
+    """
+    import subprocess
+    stage = Stage(outputs, root, inputs)
+    try:
+        code = subprocess.call(['bash', '-o', 'pipefail', '-c',
+                                stage.command(command)])
+        if code == 0:
+            stage.finish()
+        return code
+    finally:
+        stage.cleanup()
+
+
+def stage_command(command, outputs, root=None, inputs=None):
+    """Return a command that runs the given command through the staging
+    runner
+
+    :param command: the command
+    :param outputs: the output files
+    :param root: the folder where the scratch folder is created
+    :param inputs: the input files
+    """
+    from pipes import quote
+    args = [sys.executable, '-m', 'grape.stage']
+    for output in outputs:
+        args += ['-o', output]
+    for input in inputs or []:
+        args += ['-i', input]
+    if root:
+        args += ['-s', root]
+    args += ['-c', command.strip()]
+    return " ".join(quote(a) for a in args)
+
+
+def stage_jobs(jobs, root=None):
+    """Run the jobs of the :py:data:`STAGED_TOOLS` through the staging
+    runner
+
+    :param jobs: the jobs
+    :param root: the folder where the scratch folders are created. The
+        default is `$TMPDIR` on the compute node
+    """
+    for job in jobs:
+        if job.tool_name not in STAGED_TOOLS or job.interpreter != 'bash':
+            continue
+        outputs = [os.path.abspath(o) for o in job.get_output_files()]
+        if outputs:
+            inputs = [os.path.abspath(i) for i in job.get_input_files()]
+            job.command = stage_command(job.command, outputs, root, inputs)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="python -m grape.stage",
+        description="Run a command in a scratch folder")
+    parser.add_argument("-o", "--output", dest="outputs", action="append",
+                        required=True, help="An output file")
+    parser.add_argument("-i", "--input", dest="inputs", action="append",
+                        default=[], help="An input file")
+    parser.add_argument("-s", "--scratch", default=None,
+                        help="The folder where the scratch folder is "
+                             "created. Default: $TMPDIR")
+    parser.add_argument("-c", "--command", required=True,
+                        help="The command")
+    args = parser.parse_args(argv)
+    sys.exit(run(args.command, args.outputs, args.scratch, args.inputs))
+
+
+if __name__ == "__main__":
+    main()
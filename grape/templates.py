@@ -0,0 +1,100 @@
+"""Grape template cache
+
+jip renders the tool options, the job names and the commands through
+:py:func:`jip.templates.render_template`, which compiles the template string
+with Jinja2 on every call. The same templates are rendered for each sample,
+so their compilation dominates the job creation time of large projects.
+
+:py:func:`install` replaces the `from_string` method of the jip template
+environment with a cached version. Templates are compiled once per process
+and values without template markup, e.g. the paths of the genome index or
+the annotation, are not compiled at all.
+"""
+
+#: the maximum number of compiled templates kept in the cache
+CACHE_SIZE = 4096
+
+
+class Text(object):
+    """A template without markup, rendered as the text itself
+
+    :param source: the text
+    """
+
+    def __init__(self, source):
+        self.source = unicode(source)
+
+    def render(self, *args, **kwargs):
+        return self.source
+
+
+def _environment(environment):
+    if environment is None:
+        import jip.templates
+        environment = jip.templates._get_environment()
+    return environment
+
+
+def _is_text(environment, source):
+    """Return True if Jinja2 renders the source as it is, that is if it has
+    no markup and no line endings that are changed by the template
+    engine"""
+    if '\r' in source or source.endswith('\n'):
+        return False
+    for start in [environment.variable_start_string,
+                  environment.block_start_string,
+                  environment.comment_start_string,
+                  environment.line_statement_prefix,
+                  environment.line_comment_prefix]:
+        if start and start in source:
+            return False
+    return True
+
+
+def install(environment=None, size=CACHE_SIZE):
+    """Cache the compiled templates of a Jinja2 environment and return the
+    cache. The least recently used templates are removed when the cache is
+    full.
+
+    :param environment: the environment. Default: the jip template
+        environment
+    :param size: the maximum number of cached templates
+    """
+    from jinja2.utils import LRUCache
+    from .profiling import phase
+
+    environment = _environment(environment)
+    cache = getattr(environment, 'template_cache', None)
+    if cache is not None:
+        return cache
+    compile = environment.from_string
+    cache = LRUCache(size)
+
+    def from_string(source, globals=None, template_class=None):
+        if globals is not None or template_class is not None:
+            return compile(source, globals, template_class)
+        if _is_text(environment, source):
+            return Text(source)
+        template = cache.get(source)
+        if template is None:
+            with phase('template_compile'):
+                template = compile(source)
+            cache[source] = template
+        return template
+
+    environment.from_string = from_string
+    environment.template_cache = cache
+    return cache
+
+
+def uninstall(environment=None):
+    """Remove the template cache of a Jinja2 environment
+
+    :param environment: the environment. Default: the jip template
+        environment
+    """
+    environment = _environment(environment)
+    if getattr(environment, 'template_cache', None) is None:
+        return
+    del environment.from_string
+    del environment.template_cache
@@ -158,7 +158,12 @@ class gem_filter(object):
     """
     def setup(self):
         if self.options['name']:
-            self.name("gem.filter.${name}")
+            # the multimap filter runs after the edit distance filter
+            if self.options['max_matches'] and \
+                    not self.options['max_levenshtein_error']:
+                self.name("gem.matches.${name}")
+            else:
+                self.name("gem.filter.${name}")
             self.options['name'].hidden = True
 
     def get_command(self):
@@ -166,6 +171,63 @@ class gem_filter(object):
         return 'bash','%s ${options()}' % bin_path(self, 'gt.filter')
 
 
+@tool('grape_gem_mapfilter')
+class gem_mapfilter(object):
+    """\
+    The grape streaming map filter. Applies the edit distance and
+    multimap filters in a single pass and compresses the output
+
+    Usage:
+        gem.mapfilter -i <input> -o <output> [-n name] [-t <threads>] [-z] [--max-levenshtein-error <error>] [--max-matches <matches>]
+
+    Options:
+        --help  Show this help message
+        -n, --name <name>  The output prefix name
+        -o, --output <output>  The output file [default: stdout]
+        -t, --threads <threads>  The number of compression threads [default: 1]
+        -z, --gzip  Compress the output
+        --max-levenshtein-error <error>  The maximum number of edit operations allowed
+        --max-matches <matches>  The maximum number of matches allowed
+
+    Inputs:
+        -i, --input <input>  The input map file [default: stdin]
+    """
+    def setup(self):
+        if self.options['name']:
+            self.name("gem.mapfilter.${name}")
+            self.options['name'].hidden = True
+
+    def get_command(self):
+        import sys
+        return 'bash','%s -m grape.mapfilter ${options()}' % sys.executable
+
+
+@tool('grape_gem_mapstats')
+class gem_mapstats(object):
+    """\
+    Compute the mapping statistics of a GEM map file
+
+    Usage:
+        gem.mapstats -i <input> [-o <output>] [-n <name>] [--update-index]
+
+    Options:
+        --help  Show this help message
+        -n, --name <name>  The output prefix name
+        -o, --output <output>  The output file [default: ${input|ext|ext}.mapstats.json]
+        --update-index  Add the statistics to the project index
+
+    Inputs:
+        -i, --input <input>  The input map file
+    """
+    def setup(self):
+        if self.options['name']:
+            self.name("gem.mapstats.${name}")
+
+    def get_command(self):
+        import sys
+        return 'bash','%s -m grape.mapstats ${input|arg("-i ")}${output|arg(" -o ")}${name|arg(" -n ")}${update_index|arg(" --update-index")}' % sys.executable
+
+
 @module([("gemtools","1.6.2")])
 @tool('grape_gem_stats')
 class gem_stats(object):
@@ -254,7 +316,10 @@ class pigz(object):
     """
     def setup(self):
         if self.options['name']:
-            self.name("pigz.${name}")
+            if self.options['decompress']:
+                self.name("unpigz.${name}")
+            else:
+                self.name("pigz.${name}")
             self.options['name'].hidden = True
         self.options['threads'].short = '-p'
 
@@ -262,11 +327,10 @@ class pigz(object):
         return 'bash','%s ${threads|arg|suf(" ")}${decompress|arg|suf(" ")}${input|arg("-c ")|suf(" ")}${output|arg("> ")}' % bin_path(self, 'pigz')
 
 
-@module([("crgtools","0.1")])
 @tool('grape_fix_se')
-class awk_fix_se(object):
+class fix_se(object):
     """\
-    An AWK script to fix SAM flags for single-end data
+    Fix SAM flags for single-end data
 
     Usage:
         fix_se -i <input> -o <output> [-n <name>]
@@ -281,12 +345,12 @@ class awk_fix_se(object):
     """
     def setup(self):
         if self.options['name']:
-            self.name("awk_fix_se.${name}")
+            self.name("fix_se.${name}")
             self.options['name'].hidden = True
 
     def get_command(self):
-        command = "\'BEGIN{OFS=FS=\"\\t\"}$0!~/^@/{split(\"1_2_8_32_64_128\",a,\"_\");for(i in a){if(and($2,a[i])>0){$2=xor($2,a[i])}}}{print}\'"
-        return 'bash','awk %s ${input|arg("")|suf(" ")}${output|arg("> ")}' % command
+        import sys
+        return 'bash','%s -m grape.samfix ${input|arg("-i ")|suf(" ")}${output|arg("-o ")}' % sys.executable
 
 @module([("samtools","0.1.19")])
 @tool('grape_samtools_view')
@@ -295,12 +359,13 @@ class samtools(object):
     The SAMtools view program
 
     Usage:
-        sam.view -i <input> -o <output> [-s] [-b] [-n <name>] [-t <threads>]
+        sam.view -i <input> -o <output> [-s] [-b] [-u] [-n <name>] [-t <threads>]
 
     Options:
         --help  Show this help message
         -s, --input-sam  Read input in SAM format
         -b, --output-bam  Output BAM format
+        -u, --uncompressed  Output uncompressed BAM format
         -n, --name <name>  The output prefix name
         -o, --output <output>  The output file [default: stdout]
         -t, --threads <threads>  The number of execution threads
@@ -316,7 +381,7 @@ class samtools(object):
         self.options['input_sam'].short = "-S"
 
     def get_command(self):
-        return 'bash','%s ${input_sam|arg|suf(" ")}${output_bam|arg|suf(" ")}${threads|arg|suf(" ")}${input|arg("")|else("-")|suf(" ")}${output|arg("> ")}' % bin_path(self, 'samtools view')
+        return 'bash','%s ${input_sam|arg|suf(" ")}${output_bam|arg|suf(" ")}${uncompressed|arg|suf(" ")}${threads|arg|suf(" ")}${input|arg("")|else("-")|suf(" ")}${output|arg("> ")}' % bin_path(self, 'samtools view')
 
 
 @module([("samtools","0.1.19")])
@@ -326,11 +391,12 @@ class samtools(object):
     The SAMtools sort program
 
     Usage:
-        sam.sort -i <input> -o <output> [-m <max_memory>] [-n <name>] [-t <threads>]
+        sam.sort -i <input> -o <output> [-m <max_memory>] [-T <tmp_dir>] [-n <name>] [-t <threads>]
 
     Options:
         --help  Show this help message
         -m, --max-memory <max_memory>  The maximum amount of RAM to use for sorting (per thread)
+        -T, --tmp-dir <tmp_dir>  The folder for the temporary files. Defaults to the output folder
         -n, --name <name>  The output prefix name
         -o, --output <output>  The output file [default: ${input|ext}_sorted.bam]
         -t, --threads <threads>  The number of execution threads
@@ -343,8 +409,13 @@ class samtools(object):
             self.name("sam.sort.${name}")
             self.options['name'].hidden = True
         self.options['threads'].short = "-@"
+        self.options['tmp_dir'].hidden = True
 
     def get_command(self):
+        if self.options['tmp_dir'].get():
+            # write the sorted output to stdout and use the output name as
+            # temporary files prefix in the temporary folder
+            return 'bash','%s -o ${threads|arg|suf(" ")}${max_memory|arg|suf(" ")}${input|arg("")|else("-")|suf(" ")}${tmp_dir|abs}/${output|name|ext} > ${output|arg("")}' % bin_path(self, 'samtools sort')
         return 'bash','%s ${threads|arg|suf(" ")}${max_memory|arg|suf(" ")}${input|arg("")|else("-")|suf(" ")}${output|arg("")|ext}' % bin_path(self, 'samtools sort')
 
 
@@ -405,35 +476,67 @@ class flux(object):
         return 'bash', '%s ${options()}' % bin_path(self, 'flux-capacitor')
 
 
-@module([("crgtools","0.1")])
 @tool('grape_flux_split_features')
-class awk_split_features(object):
+class split_features(object):
     """\
-    An AWK script to split the Flux Capacitor output by features
+    Split the Flux Capacitor output by features
 
     Usage:
-        split_features -i <input> [-n <name>]
+        split_features -i <input> [-n <name>] [-z] [--update-index]
 
     Options:
         --help  Show this help message
         -n, --name <name>  The output prefix name
+        -z, --gzip  Compress the output files
+        --update-index  Add the output files and their line counts to the project index
 
     Inputs:
         -i, --input <input>  The input map file [default: stdin]
     """
     def init(self):
-        self.add_output('transcript', '${input}.transcript.gtf')
-        self.add_output('junction', '${input}.junction.gtf')
-        self.add_output('intron', '${input}.intron.gtf')
+        self.add_output('transcript', '${input|ext}.transcript.gtf${gzip|arg(".gz")}')
+        self.add_output('junction', '${input|ext}.junction.gtf${gzip|arg(".gz")}')
+        self.add_output('intron', '${input|ext}.intron.gtf${gzip|arg(".gz")}')
 
     def setup(self):
         if self.options['name']:
-            self.name("awk_split_flux_features.${name}")
-            self.options['name'].hidden = True
+            self.name("split_flux_features.${name}")
+
+    def get_command(self):
+        import sys
+        return 'bash','%s -m grape.fluxsplit ${input|arg("-i ")}${name|arg(" -n ")}${gzip|arg(" -z")}${update_index|arg(" --update-index")}' % sys.executable
+
+
+@tool('grape_retention')
+class retention(object):
+    """\
+    Apply a retention policy to intermediate files
+
+    Usage:
+        retention -f <files>... [-p <policy>] [-n <name>] [--update-index]
+
+    Options:
+        --help  Show this help message
+        -f, --files <files>...  The intermediate files
+        -p, --policy <policy>  The retention policy, delete or archive [default: delete]
+        -n, --name <name>  The output prefix name
+        --update-index  Update the files in the project index
+    """
+    def setup(self):
+        self.name("${policy}.${files|name}")
+
+    def is_done(self):
+        import os
+        from .grape import Project
+        from .retention import is_applied
+        files = [os.path.abspath(f) for f in self.options['files'].raw()]
+        project = Project.find(os.path.dirname(files[0])) if files else None
+        return is_applied(files, self.options['policy'].get(),
+                          project.path if project else None)
 
     def get_command(self):
-        command = "\'BEGIN{OFS=FS=\"\\t\"}{print > input\".\"$3\".gtf\"}\'"
-        return 'bash','awk -v input=${input|arg("")|suf(" ")|ext} %s ${input|arg("")|suf(" ")}' % command
+        import sys
+        return 'bash','%s -m grape.retention ${files|arg("-f ")}${policy|arg(" -p ")}${name|arg(" -n ")}${update_index|arg(" --update-index")}' % sys.executable
 
 
 @pipeline('grape_gem_setup')
@@ -482,7 +585,7 @@ class GrapePipeline(object):
     The default GRAPE RNAseq pipeline
 
     usage:
-        rnaseq -f <fastq_file> -q <quality> -g <genome> -a <annotation> [-t <threads>] [-o <output_dir>] [--single-end] [--max-mismatches <mismatches>] [--max-matches <matches>]
+        rnaseq -f <fastq_file> -q <quality> -g <genome> -a <annotation> [-t <threads>] [-o <output_dir>] [--single-end] [--max-mismatches <mismatches>] [--max-matches <matches>] [-r <retention>] [--sort-tmp-dir <tmp_dir>] [--fast-filter]
 
     Inputs:
         -f, --fastq <fastq_file>        The input reference genome
@@ -496,8 +599,20 @@ class GrapePipeline(object):
         -n, --max-matches <matches>  The maximum number of matches allowed (multimaps)
         -o, --output-dir <output_dir>   The output prefix [default: ${fastq|abs|parent}]
         -t, --threads <threads>  The number of execution threads
+        -r, --retention <retention>  Retention policies for the intermediate outputs, e.g. map=keep,filtered_map=archive
+        --sort-tmp-dir <tmp_dir>  The folder for the temporary BAM sort files
+        --fast-filter  Filter the mappings with the grape streaming map filter
 
     """
+    #: the default retention policies for the intermediate outputs. All
+    #: the outputs are kept unless a policy is set for the run or the
+    #: project
+    retention_policies = {
+        'map': 'keep',
+        'filtered_map': 'keep',
+        'bam': 'keep',
+    }
+
     def setup(self):
         self.name('gem.pipeline')
         self.add_option('sample','${fastq|name|ext|ext|re("[_-][12]","")}')
@@ -507,12 +622,35 @@ class GrapePipeline(object):
         gem_setup = p.run('grape_gem_setup', input=self.genome, annotation=self.annotation, threads=self.threads)
         gem = p.run('grape_gem_rnatool', index=gem_setup.index, transcript_index=gem_setup.t_index, single_end=self.single_end, fastq=self.fastq, quality=self.quality, no_bam=True, no_stats=True, output_dir=self.output_dir, threads=self.threads)
         sample = self.sample
-        gem_filter = p.run('grape_gem_filter_p', input=gem.map, max_mismatches=self.max_mismatches, max_matches=self.max_matches, threads=self.threads, name=sample)
-        gem_bam = p.run('grape_gem_bam_p', input=gem_filter.output, index=gem_setup.index, quality=self.quality, threads=self.threads, single_end=self.single_end, sequence_lengths=True, name=sample)
+        gem_filter = p.run('grape_gem_filter_p', input=gem.map, max_mismatches=self.max_mismatches, max_matches=self.max_matches, threads=self.threads, fast=self.fast_filter, name=sample)
+        stats = p.run('grape_gem_mapstats', input=gem_filter.output, name=sample, update_index=True)
+        gem_bam = p.run('grape_gem_bam_p', input=gem_filter.output, index=gem_setup.index, quality=self.quality, threads=self.threads, single_end=self.single_end, sequence_lengths=True, tmp_dir=self.sort_tmp_dir, name=sample)
         flux = p.run('grape_flux', input=gem_bam.bam, annotation=self.annotation, output_dir=self.output_dir, name=sample)
-        p.run('grape_flux_split_features', input=flux.output, name=sample)
+        p.run('grape_flux_split_features', input=flux.output, name=sample, update_index=True)
+        self.retain(p, sample, [
+            ('map', gem.map, [gem_filter]),
+            ('filtered_map', gem_filter.output, [stats, gem_bam]),
+            ('bam', [gem_bam.bam, gem_bam.bai], [flux]),
+        ])
         return p
 
+    def retain(self, p, sample, outputs):
+        """Add the retention jobs for the intermediate outputs. Each
+        output is given as a tuple with the output key, the files and the
+        nodes consuming them. The retention job runs once all the consumers
+        succeeded."""
+        from .retention import parse_policies
+        policies = dict(self.retention_policies)
+        if self.options['retention']:
+            policies.update(parse_policies(self.options['retention'].get()))
+        for key, files, consumers in outputs:
+            policy = policies.get(key, 'keep')
+            if policy == 'keep':
+                continue
+            node = p.run('grape_retention', files=files, policy=policy, name=sample, update_index=True)
+            for consumer in consumers:
+                node.depends_on(consumer)
+
 
 @pipeline('grape_gem_filter_p')
 class FilterPipeline(object):
@@ -520,7 +658,7 @@ class FilterPipeline(object):
     The GEM filter pipeline
 
     usage:
-         gem.filter.pipeline -i <map_file> --max-mismatches <mismatches> --max-matches <matches> -o <output> [-l <name>] [-t <threads>]
+         gem.filter.pipeline -i <map_file> --max-mismatches <mismatches> --max-matches <matches> -o <output> [-l <name>] [-t <threads>] [--fast]
 
     Inputs:
         -i, --input <map_file>        The input MAP file
@@ -531,6 +669,7 @@ class FilterPipeline(object):
         -t, --threads <threads>  The number of execution threads [default: 1]
         -m, --max-mismatches <mismatches>  The maximum number of edit operations allowed
         -n, --max-matches <matches>  The maximum number of matches allowed
+        --fast  Filter and compress with the grape streaming map filter instead of gt.filter and pigz
 
     """
     def setup(self):
@@ -539,10 +678,14 @@ class FilterPipeline(object):
     def pipeline(self):
         p = Pipeline()
         sample=self.options['name']
-        gem_filter = p.run('grape_gem_quality', input=self.input, threads=self.threads, name=sample) | \
-        p.run('grape_gem_filter', max_levenshtein_error=self.max_mismatches, threads=self.threads, name=sample) | \
-        p.run('grape_gem_filter', max_matches=self.max_matches, threads=self.threads, name=sample) | \
-        p.run('grape_pigz', threads=self.threads, output=self.output, name=sample)
+        if self.options['fast']:
+            gem_filter = p.run('grape_gem_quality', input=self.input, threads=self.threads, name=sample) | \
+            p.run('grape_gem_mapfilter', max_levenshtein_error=self.max_mismatches, max_matches=self.max_matches, gzip=True, threads=self.threads, output=self.output, name=sample)
+        else:
+            gem_filter = p.run('grape_gem_quality', input=self.input, threads=self.threads, name=sample) | \
+            p.run('grape_gem_filter', max_levenshtein_error=self.max_mismatches, threads=self.threads, name=sample) | \
+            p.run('grape_gem_filter', max_matches=self.max_matches, threads=self.threads, name=sample) | \
+            p.run('grape_pigz', threads=self.threads, output=self.output, name=sample)
         return p
 
 @pipeline('grape_gem_bam_p')
@@ -551,7 +694,7 @@ class Gem2BamPipeline(object):
     The GEM to BAM conversion pipeline
 
     usage:
-         gem2bam.pipeline -f <map_file> -i <gem_index> -q quality -o <output> [-s] [-l] [-t <threads>] [--read-group <read_group>] [-n <name>]
+         gem2bam.pipeline -f <map_file> -i <gem_index> -q quality -o <output> [-s] [-l] [-t <threads>] [--read-group <read_group>] [-n <name>] [-T <tmp_dir>]
 
     Inputs:
         -f, --input <map_file>        The input MAP file
@@ -564,6 +707,7 @@ class Gem2BamPipeline(object):
         -l, --sequence-lengths  Add sequence lengths information to SAM header
         -o, --output <output>  The output file [default: ${input|ext|ext}.bam]
         -t, --threads <threads>  The number of execution threads [default: 1]
+        -T, --tmp-dir <tmp_dir>  The folder for the temporary sort files
 
     """
     def init(self):
@@ -574,13 +718,21 @@ class Gem2BamPipeline(object):
         self.name('gem.to.bam.pipeline')
 
     def pipeline(self):
+        from .resources import split_threads
         p = Pipeline()
-        i_threads = int(self.threads.raw())
-        hthreads = i_threads/2 if i_threads > 1 else 1
+        # the BAM is compressed only once by sort, view passes uncompressed
+        # BAM and the threads are split between the streaming stages
+        pigz_threads, sam_threads, view_threads, sort_threads = split_threads(
+            int(self.threads.raw()), ['grape_pigz', 'grape_gem_sam', 'grape_samtools_view', 'grape_samtools_sort'])
         sample=self.options['name']
-        gem_bam = p.run('grape_pigz', input=self.input, threads=self.threads, decompress=True, name=sample) | \
-        p.run('grape_gem_sam', threads=hthreads, index=self.index, read_group=self.read_group, quality=self.quality, sequence_lengths=self.sequence_lengths, expect_paired_end_reads=not self.single_end, expect_single_end_reads=self.single_end, name=sample) | \
-        p.run('grape_samtools_view', threads=self.threads, input_sam=True, output_bam=True, name=sample) | \
-        p.run('grape_samtools_sort', threads=self.threads, output=self.output, name=sample)
+        gem_bam = p.run('grape_pigz', input=self.input, threads=pigz_threads, decompress=True, name=sample) | \
+        p.run('grape_gem_sam', threads=sam_threads, index=self.index, read_group=self.read_group, quality=self.quality, sequence_lengths=self.sequence_lengths, expect_paired_end_reads=not self.single_end, expect_single_end_reads=self.single_end, name=sample) | \
+        p.run('grape_samtools_view', threads=view_threads, input_sam=True, uncompressed=True, name=sample) | \
+        p.run('grape_samtools_sort', threads=sort_threads, tmp_dir=self.tmp_dir, output=self.output, name=sample)
         gem_bai = p.run('grape_samtools_index', input=gem_bam.output, name=sample)
         return p
+
+
+# compile the templates of the tools once per process
+from .templates import install as install_template_cache
+install_template_cache()
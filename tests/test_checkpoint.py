@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+#
+# test the job checkpoints
+#
+import jip
+import jip.db
+from grape.checkpoint import Checkpoints, quick_hash, same_file, file_info, \
+    update_states
+
+
+def _jobs(tmpdir, text='a'):
+    p = jip.Pipeline()
+    a = p.bash('echo %s > ${outfile}' % text,
+               outfile=str(tmpdir.join('a.txt')))
+    p.bash('cat ${input} > ${outfile}', input=a,
+           outfile=str(tmpdir.join('b.txt')))
+    return jip.jobs.create_jobs(p)
+
+
+def _run(tmpdir, jobs, checkpoints):
+    # write the job outputs instead of running the jobs
+    tmpdir.join('a.txt').write('a\n')
+    tmpdir.join('b.txt').write('a\n')
+    for job in jobs:
+        job.state = jip.db.STATE_DONE
+        checkpoints.record(job)
+
+
+def _reasons(groups):
+    return [reason for _, reason in groups]
+
+
+def test_quick_hash(tmpdir):
+    f = tmpdir.join('f')
+    f.write('x' * 100)
+    h = quick_hash(str(f), block=10)
+    f.write('x' * 50 + 'y' + 'x' * 49)
+    assert quick_hash(str(f), block=10) == h
+    f.write('x' * 99 + 'y')
+    assert quick_hash(str(f), block=10) != h
+
+
+def test_same_file(tmpdir):
+    f = tmpdir.join('f')
+    f.write('data')
+    info = file_info(str(f))
+    assert same_file(str(f), info)
+    f.write('other')
+    assert not same_file(str(f), info)
+    assert file_info(str(tmpdir.join('missing'))) is None
+
+
+def test_checkpoints(tmpdir):
+    jip.db.init(str(tmpdir.join('jip.db')))
+    checkpoints = Checkpoints(str(tmpdir.join('checkpoints')))
+    jobs = _jobs(tmpdir)
+    groups = update_states(jobs, checkpoints)
+    assert _reasons(groups) == ['no checkpoint', 'bash.0 runs']
+    _run(tmpdir, jobs, checkpoints)
+
+    # complete jobs are done
+    checkpoints = Checkpoints(str(tmpdir.join('checkpoints')))
+    jobs = _jobs(tmpdir)
+    assert _reasons(update_states(jobs, checkpoints)) == [None, None]
+    assert [j.state for j in jobs] == [jip.db.STATE_DONE] * 2
+
+    # changed outputs invalidate the job and its descendants
+    tmpdir.join('a.txt').write('changed\n')
+    checkpoints = Checkpoints(str(tmpdir.join('checkpoints')))
+    jobs = _jobs(tmpdir)
+    assert _reasons(update_states(jobs, checkpoints)) == [
+        'output changed: %s' % tmpdir.join('a.txt'), 'bash.0 runs']
+    assert [j.state for j in jobs] == [jip.db.STATE_HOLD] * 2
+    _run(tmpdir, jobs, checkpoints)
+
+    # changed commands invalidate the job
+    checkpoints = Checkpoints(str(tmpdir.join('checkpoints')))
+    jobs = _jobs(tmpdir, text='b')
+    assert _reasons(update_states(jobs, checkpoints)) == [
+        'parameters changed: cmd', 'bash.0 runs']
+
+
+def test_tool_versions(tmpdir, monkeypatch):
+    jip.db.init(str(tmpdir.join('jip.db')))
+    modules = ['gemtools/1.6.2']
+    monkeypatch.setattr('grape.checkpoint.tool_modules', lambda job: modules)
+    checkpoints = Checkpoints(str(tmpdir.join('checkpoints')))
+    jobs = _jobs(tmpdir)
+    _run(tmpdir, jobs, checkpoints)
+    modules[0] = 'gemtools/1.6.3'
+
+    # version changes are ignored unless running incrementally
+    checkpoints = Checkpoints(str(tmpdir.join('checkpoints')))
+    jobs = _jobs(tmpdir)
+    assert _reasons(update_states(jobs, checkpoints)) == [None, None]
+    checkpoints = Checkpoints(str(tmpdir.join('checkpoints')),
+                              incremental=True)
+    jobs = _jobs(tmpdir)
+    assert _reasons(update_states(jobs, checkpoints)) == [
+        'tool versions changed: gemtools/1.6.2 -> gemtools/1.6.3',
+        'bash.0 runs']
+
+
+def test_partial_outputs_are_not_complete(tmpdir):
+    jip.db.init(str(tmpdir.join('jip.db')))
+    checkpoints = Checkpoints(str(tmpdir.join('checkpoints')))
+    jobs = _jobs(tmpdir)
+    _run(tmpdir, jobs, checkpoints)
+    # the job is interrupted
+    checkpoints.start(jobs[0])
+    tmpdir.join('a.txt').write('partial')
+    checkpoints = Checkpoints(str(tmpdir.join('checkpoints')))
+    jobs = _jobs(tmpdir)
+    assert _reasons(update_states(jobs, checkpoints)) == [
+        'no checkpoint', 'bash.0 runs']
+
+
+def test_adopt_existing_outputs(tmpdir):
+    jip.db.init(str(tmpdir.join('jip.db')))
+    # outputs of jobs run before the project used checkpoints
+    tmpdir.join('a.txt').write('a\n')
+    checkpoints = Checkpoints(str(tmpdir.join('checkpoints')))
+    jobs = _jobs(tmpdir)
+    assert _reasons(update_states(jobs, checkpoints)) == [
+        None, 'no checkpoint']
+    tmpdir.join('b.txt').write('a\n')
+    checkpoints = Checkpoints(str(tmpdir.join('checkpoints')))
+    jobs = _jobs(tmpdir)
+    assert _reasons(update_states(jobs, checkpoints)) == [None, None]
+    # the adopted checkpoints are checked as the recorded ones
+    tmpdir.join('a.txt').write('changed\n')
+    checkpoints = Checkpoints(str(tmpdir.join('checkpoints')))
+    jobs = _jobs(tmpdir)
+    assert _reasons(update_states(jobs, checkpoints)) == [
+        'output changed: %s' % tmpdir.join('a.txt'), 'bash.0 runs']
+
+
+def test_removed_temporary_outputs(tmpdir):
+    jip.db.init(str(tmpdir.join('jip.db')))
+    checkpoints = Checkpoints(str(tmpdir.join('checkpoints')))
+    jobs = _jobs(tmpdir)
+    _run(tmpdir, jobs, checkpoints)
+    tmpdir.join('a.txt').remove()
+    jobs = _jobs(tmpdir)
+    assert _reasons(update_states(jobs, checkpoints))[0] == \
+        'output changed: %s' % tmpdir.join('a.txt')
+    checkpoints = Checkpoints(str(tmpdir.join('checkpoints')))
+    jobs = _jobs(tmpdir)
+    jobs[0].temp = True
+    assert _reasons(update_states(jobs, checkpoints)) == [None, None]
+
+
+def test_sync(tmpdir, monkeypatch):
+    monkeypatch.setattr('grape.checkpoint.SYNC_BATCH', 1)
+    jip.db.init(str(tmpdir.join('jip.db')))
+    checkpoints = Checkpoints(str(tmpdir.join('checkpoints')))
+    jobs = _jobs(tmpdir)
+    _run(tmpdir, jobs, checkpoints)
+    jip.db.save(jobs)
+    checkpoints = Checkpoints(str(tmpdir.join('other')))
+    # only the given jobs are synchronized
+    assert checkpoints.sync(_jobs(tmpdir)[1:]) == 1
+    assert checkpoints.sync(_jobs(tmpdir)) == 1
+    assert checkpoints.sync(_jobs(tmpdir)) == 0
+    # the outputs are changed, so the jobs would not be adopted
+    tmpdir.join('b.txt').write('b\n')
+    jobs = _jobs(tmpdir)
+    assert _reasons(update_states(jobs, checkpoints)) == [
+        None, 'output changed: %s' % tmpdir.join('b.txt')]
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+#
+# test array job grouping
+#
+import jip
+from jip.db import Job
+from grape.cluster import group_jobs, get_dependencies
+
+
+def _job(tool, name, threads=1, dependencies=None):
+    job = Job()
+    job.tool_name = tool
+    job.name = name
+    job.threads = threads
+    job.working_directory = '/tmp'
+    for d in dependencies or []:
+        job.dependencies.append(d)
+    return job
+
+
+def test_group_by_tool_and_depth():
+    index = _job('grape_gem_index', 'index')
+    gems = [_job('grape_gem_rnatool', 'gem.%d' % i, dependencies=[index])
+            for i in range(3)]
+    fluxes = [_job('grape_flux', 'flux.%d' % i, dependencies=[g])
+              for i, g in enumerate(gems)]
+    groups = group_jobs(fluxes + gems + [index])
+    assert groups == [[index], gems, fluxes]
+
+
+def test_group_by_resources():
+    a = _job('grape_flux', 'a', threads=1)
+    b = _job('grape_flux', 'b', threads=4)
+    c = _job('grape_flux', 'c', threads=1)
+    assert group_jobs([a, b, c]) == [[a, c], [b]]
+
+
+def test_group_pipe_chains():
+    a = _job('grape_pigz', 'a')
+    a.pipe_to.append(_job('grape_gem_sam', 'a.sam'))
+    b = _job('grape_pigz', 'b')
+    c = _job('grape_pigz', 'c')
+    c.pipe_to.append(_job('grape_gem_sam', 'c.sam'))
+    assert group_jobs([a, b, c]) == [[a, c], [b]]
+
+
+def test_group_max_array_size():
+    jobs = [_job('grape_flux', str(i)) for i in range(5)]
+    groups = group_jobs(jobs, max_array_size=2)
+    assert [len(g) for g in groups] == [2, 2, 1]
+
+
+def test_array_dependencies():
+    setup = _job('grape_gem_index', 'index')
+    setup.job_id = '42'
+    setup.state = jip.db.STATE_QUEUED
+    done = _job('grape_gem_t_index', 't_index')
+    done.job_id = '41'
+    done.state = jip.db.STATE_DONE
+    gem = _job('grape_gem_rnatool', 'gem', dependencies=[setup, done])
+    flux = _job('grape_flux', 'flux', dependencies=[gem])
+    assert get_dependencies([gem], {}) == set(['42'])
+    assert get_dependencies([flux], {gem: '100'}) == set(['100'])
+
+
+def test_throttle_feed(tmpdir):
+    from grape.cluster import Throttle, count_active_jobs
+    jip.db.init(str(tmpdir.join("test.db")))
+    active = [_job('grape_flux', str(i)) for i in range(3)]
+    for i, job in enumerate(active):
+        job.state = jip.db.STATE_QUEUED
+        job.job_id = str(i)
+    jip.db.save(active)
+    assert count_active_jobs() == 3
+
+    throttle = Throttle(max_jobs=5)
+    assert throttle.enabled
+    jobs = [_job('grape_flux', 'pending.%d' % i) for i in range(10)]
+    chunks = []
+    for chunk in throttle.feed(jobs, wait=False):
+        for job in chunk:
+            job.state = jip.db.STATE_QUEUED
+            job.job_id = job.name
+        jip.db.save(chunk)
+        chunks.append(chunk)
+    assert chunks == [jobs[:2]]
+
+    throttle = Throttle()
+    assert not throttle.enabled
+    assert list(throttle.feed(jobs)) == [jobs]
+
+
+def test_get_held_jobs(tmpdir):
+    from grape.cluster import get_held_jobs
+    jip.db.init(str(tmpdir.join("test.db")))
+    index = _job('grape_gem_index', 'index.genome')
+    gem_a = _job('grape_gem_rnatool', 'gem.a', dependencies=[index])
+    gem_b = _job('grape_gem_rnatool', 'gem.b', dependencies=[index])
+    clean = _job('grape_retention', 'delete.a.map.gz', dependencies=[gem_a])
+    jobs = [index, gem_a, gem_b, clean]
+    for job in jobs:
+        job.state = jip.db.STATE_HOLD
+    jip.db.save(jobs)
+
+    def names(held):
+        return sorted(j.name for j in held)
+
+    assert names(get_held_jobs()) == names(jobs)
+    assert names(get_held_jobs(ids=[gem_b.id])) == ['gem.b']
+    # the project level jobs linked to the dataset jobs are included
+    assert names(get_held_jobs(datasets=['a'])) == \
+        ['delete.a.map.gz', 'gem.a', 'index.genome']
+    assert names(get_held_jobs(ids=[gem_a.id, gem_b.id],
+                               datasets=['a'])) == ['gem.a']
+    assert names(get_held_jobs(datasets=[None])) == ['index.genome']
+
+
+def test_submit_job_drops_done_dependencies(tmpdir):
+    from grape.cluster import submit_job
+    jip.db.init(str(tmpdir.join("test.db")))
+    index = _job('grape_gem_index', 'index')
+    gem = _job('grape_gem_rnatool', 'gem', dependencies=[index])
+    flux = _job('grape_flux', 'flux', dependencies=[index, gem])
+    index.job_id, gem.job_id = '1', '2'
+    index.state = gem.state = jip.db.STATE_QUEUED
+    flux.state = jip.db.STATE_HOLD
+    jip.db.save([index, gem, flux])
+    # the index finished after the jobs were loaded
+    index_db = jip.db.get(index.id)
+    index_db.state = jip.db.STATE_DONE
+    jip.db.update_job_states([index_db])
+
+    class Cluster(object):
+        def submit(self, job):
+            self.dependencies = sorted(d.job_id for d in job.dependencies
+                                       if d.job_id)
+            job.job_id = '3'
+
+    cluster = Cluster()
+    assert submit_job(flux, cluster)
+    assert cluster.dependencies == ['2']
+    assert index.job_id == '1'
+    assert flux.job_id == '3'
+    assert not submit_job(index_db, cluster)
+
+
+class _LocalJob(object):
+    def __init__(self, command, folder, dependencies=None, threads=1):
+        self.command = command
+        self.name = command
+        self.working_directory = folder
+        self.stdout = None
+        self.stderr = None
+        self.threads = threads
+        self.dependencies = dependencies or []
+        self.job_id = None
+
+    def get_cluster_command(self):
+        return self.command
+
+
+def _wait(cluster, timeout=30):
+    import time
+    start = time.time()
+    while cluster.list():
+        assert time.time() - start < timeout
+        time.sleep(0.05)
+
+
+def test_local_cluster_dependencies(tmpdir):
+    from grape.cluster import LocalCluster
+    cluster = LocalCluster(slots=2, spool=str(tmpdir.join('spool')),
+                           interval=0.05, idle=0.5)
+    folder = str(tmpdir)
+    first = _LocalJob("sleep 0.2; echo first > first", folder)
+    second = _LocalJob("cat first > second", folder, [first])
+    failed = _LocalJob("exit 1", folder)
+    skipped = _LocalJob("touch skipped", folder, [failed])
+    for job in [first, second, failed, skipped]:
+        cluster.submit(job)
+    assert [j.job_id for j in [first, second, failed, skipped]] == \
+        ['1', '2', '3', '4']
+    assert first.stdout == str(tmpdir.join('local-%J.out'))
+    assert cluster.resolve_log(first, first.stdout) == \
+        str(tmpdir.join('local-1.out'))
+    _wait(cluster)
+    assert tmpdir.join('second').read() == "first\n"
+    assert not tmpdir.join('skipped').exists()
+
+
+def test_local_cluster_failed_dependency(tmpdir):
+    import time
+    from grape.cluster import LocalCluster
+    spool = tmpdir.join('spool')
+    cluster = LocalCluster(slots=1, spool=str(spool), interval=0.05,
+                           idle=0.2)
+    folder = str(tmpdir)
+    failed = _LocalJob("exit 1", folder)
+    done = _LocalJob("true", folder)
+    cluster.submit(failed)
+    cluster.submit(done)
+    _wait(cluster)
+    start = time.time()
+    while spool.join('scheduler.pid').exists():
+        assert time.time() - start < 30
+        time.sleep(0.05)
+    # the failed job is kept after the scheduler stopped
+    assert sorted(p.basename for p in spool.listdir('[0-9]*')) == \
+        ['1.failed']
+    skipped = _LocalJob("touch skipped", folder, [failed])
+    cluster.submit(skipped)
+    _wait(cluster)
+    assert not tmpdir.join('skipped').exists()
+    assert spool.join('%s.canceled' % skipped.job_id).exists()
+
+
+def test_local_cluster_forget(tmpdir):
+    import os
+    import time
+    from grape.cluster import LocalCluster, _LocalScheduler
+    spool = tmpdir.join('spool')
+    cluster = LocalCluster(slots=1, spool=str(spool), expire=60)
+    folder = str(tmpdir)
+    jobs = [_LocalJob("exit 1", folder) for i in range(4)]
+    records = []
+    for i, job in enumerate(jobs):
+        job.job_id = str(i + 1)
+        records.append({'id': job.job_id, 'dependencies': []})
+    cluster._write(records[0], 'failed')
+    cluster._write(records[1], 'canceled')
+    cluster._write(records[2], 'failed')
+    cluster._write(records[3], 'failed')
+    # a failed job a queued job depends on is kept
+    cluster._write({'id': '5', 'dependencies': ['3']}, 'queued')
+    cluster.forget_jobs([jobs[0], jobs[1], jobs[2]])
+    assert sorted(p.basename for p in spool.listdir('[0-9]*')) == \
+        ['3.failed', '4.failed', '5.queued']
+    os.remove(cluster._path('5', 'queued'))
+    # a job submitted again forgets its previous run
+    cluster._start_scheduler = lambda: None
+    cluster.submit(jobs[2])
+    assert not spool.join('3.failed').exists()
+    assert spool.join('%s.queued' % jobs[2].job_id).exists()
+    os.remove(cluster._path(jobs[2].job_id, 'queued'))
+    # old failed jobs expire
+    old = time.time() - 120
+    os.utime(cluster._path('4', 'failed'), (old, old))
+    cluster._write({'id': '7', 'dependencies': []}, 'failed')
+    _LocalScheduler(cluster)._cleanup()
+    assert sorted(p.basename for p in spool.listdir('[0-9]*')) == \
+        ['7.failed']
+
+
+def test_local_cluster_cancel(tmpdir):
+    from grape.cluster import LocalCluster
+    cluster = LocalCluster(slots=1, spool=str(tmpdir.join('spool')),
+                           interval=0.05, idle=0.5)
+    folder = str(tmpdir)
+    running = _LocalJob("sleep 30", folder)
+    queued = _LocalJob("touch queued", folder)
+    cluster.submit(running)
+    cluster.submit(queued)
+    assert cluster.list() == ['1', '2']
+    cluster.cancel(queued)
+    assert cluster.list() == ['1']
+    cluster.cancel(running)
+    _wait(cluster, timeout=5)
+    assert not tmpdir.join('queued').exists()
@@ -45,3 +45,42 @@ def test_remove():
     config.remove('name')
     assert config.get('name') is None
     os.remove('test_data/project_default_conf/.grape/config')
+
+def test_load_json_cache(tmpdir):
+    from grape.grape import load_json
+    conf = tmpdir.join('jobs.json')
+    conf.write('{"default": {"threads": 2}}')
+    first = load_json(str(conf))
+    assert first == {"default": {"threads": 2}}
+    assert load_json(str(conf)) is first
+    conf.write('{"default": {"threads": 4}}')
+    os.utime(str(conf), (0, 0))
+    assert load_json(str(conf)) == {"default": {"threads": 4}}
+    assert load_json(str(tmpdir.join('missing.json'))) is None
+
+def test_tool_job_config(tmpdir, monkeypatch):
+    from grape.grape import Grape
+    import jip.db
+    monkeypatch.setenv('GRAPE_HOME', str(tmpdir))
+    monkeypatch.setenv('HOME', str(tmpdir))
+    tmpdir.mkdir('conf').join('jobs.json').write(
+        '{"default": {"threads": 2, "queue": "short"}, '
+        '"grape_flux": {"threads": 8, "queue": null}}')
+    grape = Grape()
+    config = grape._get_tool_job_config('grape_flux')
+    assert config == {'threads': 8, 'queue': 'short'}
+    assert grape._get_tool_job_config('grape_flux') is config
+    class Tool(object):
+        name = 'grape_flux'
+        job = jip.db.Job()
+    grape.configure_job(Tool, user_config={'threads': 1})
+    job = Tool.job
+    assert job.threads == 1
+    assert job.queue == 'short'
+    # the overrides only apply to the first job of a pipe chain
+    class Piped(object):
+        name = 'grape_flux'
+        job = jip.db.Job()
+    Piped.job.pipe_from = [job]
+    grape.configure_job(Piped, user_config={'threads': 1})
+    assert Piped.job.threads == 8
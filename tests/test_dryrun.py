@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+#
+# test the dry run summary
+#
+import jip
+from grape.dryrun import SAMPLE, sample_name, placeholder, group_datasets, \
+    Summary
+
+
+class _Dataset(object):
+    def __init__(self, *fastq):
+        self.fastq = dict((f, {}) for f in fastq)
+
+
+def test_sample_name():
+    assert sample_name('/data/foo_1.fastq.gz') == 'foo'
+    assert sample_name('/data/foo-2.fq') == 'foo'
+    assert sample_name('/data/foo.fastq') == 'foo'
+
+
+def test_placeholder():
+    assert placeholder('/data/foo_1.fastq.gz') == \
+        '/data/%s_1.fastq.gz' % SAMPLE
+    # the sample name is not a prefix of the file name
+    assert placeholder('/data/a_1b_1.fastq') is None
+
+
+def test_group_datasets():
+    a = _Dataset('/data/a_1.fastq', '/data/a_2.fastq')
+    b = _Dataset('/data/b_1.fastq', '/data/b_2.fastq')
+    c = _Dataset('/other/c_1.fastq.gz', '/other/c_2.fastq.gz')
+    d = _Dataset('/data/d_1x_1.fastq')
+    groups = group_datasets([a, b, c, d])
+    assert groups == [
+        ('/data/%s_1.fastq' % SAMPLE, [(a, 'a'), (b, 'b')]),
+        ('/other/%s_1.fastq.gz' % SAMPLE, [(c, 'c')]),
+        ('/data/d_1x_1.fastq', [(d, None)]),
+    ]
+
+
+def test_summary(tmpdir):
+    p = jip.Pipeline()
+    p.bash('cat ${input} > ${outfile}', input=str(tmpdir.join('in')),
+           outfile=str(tmpdir.join('%s.txt' % SAMPLE)))
+    p.bash('touch ${outfile}', outfile=str(tmpdir.join('shared.txt')))
+    jobs = jip.jobs.create_jobs(p, validate=False)
+    for job in jobs:
+        job.threads = 2
+        job.max_time = 30
+    tmpdir.join('a.txt').write('a')
+    summary = Summary()
+    for sample in ['a', 'b']:
+        for job in jobs:
+            summary.add(job, sample)
+    rows, total = summary.rows()
+    assert rows == [{'tool': 'bash', 'jobs': 3, 'outputs': 3, 'existing': 1,
+                     'cpu_hours': 3.0}]
+    assert total['jobs'] == 3
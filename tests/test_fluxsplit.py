@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#
+# test the Flux Capacitor output splitter
+#
+import gzip
+from StringIO import StringIO
+from grape.fluxsplit import split_features, output_prefix, update_index
+from grape.grape import Project
+
+GTF = "chr1\tflux\ttranscript\t1\t100\t.\t+\t.\ttranscript_id \"t1\";\n" \
+      "chr1\tflux\ttranscript\t200\t300\t.\t+\t.\ttranscript_id \"t2\";\n" \
+      "chr1\tflux\tjunction\t100\t200\t.\t+\t.\tgene_id \"g1\";\n" \
+      "chr1\tflux\tgene\t1\t300\t.\t+\t.\tgene_id \"g1\";\n"
+
+
+def test_output_prefix():
+    assert output_prefix('/data/sample.gtf') == '/data/sample'
+    assert output_prefix('/data/sample.txt') == '/data/sample.txt'
+
+
+def test_split_features(tmpdir):
+    prefix = str(tmpdir.join('sample'))
+    outputs = split_features(StringIO(GTF), prefix)
+    assert outputs == {
+        'transcript': (prefix + '.transcript.gtf', 2),
+        'junction': (prefix + '.junction.gtf', 1),
+        'intron': (prefix + '.intron.gtf', 0),
+        'gene': (prefix + '.gene.gtf', 1),
+    }
+    assert tmpdir.join('sample.intron.gtf').read() == ''
+    assert tmpdir.join('sample.junction.gtf').read() == GTF.split('\n')[2] + '\n'
+
+
+def test_split_features_gzip(tmpdir):
+    prefix = str(tmpdir.join('sample'))
+    outputs = split_features(StringIO(GTF), prefix, compress=True)
+    path, lines = outputs['transcript']
+    assert path == prefix + '.transcript.gtf.gz'
+    assert lines == 2
+    assert len(gzip.open(path).readlines()) == 2
+    assert gzip.open(outputs['intron'][0]).read() == ''
+
+
+def test_update_index(tmpdir):
+    project = Project(str(tmpdir))
+    project.initialize(init_structure=False)
+    outputs = split_features(StringIO(GTF), str(tmpdir.join('sample')))
+    assert update_index(outputs, 'sample', str(tmpdir))
+    project = Project(str(tmpdir))
+    project.load()
+    dataset = project.index.datasets['sample']
+    gtfs = dataset.gtf
+    assert len(gtfs) == 4
+    info = gtfs[str(tmpdir.join('sample.transcript.gtf'))]
+    assert int(info['lines']) == 2
+    assert info['view'] == 'transcript'
+
+
+def test_update_existing_dataset(tmpdir):
+    project = Project(str(tmpdir))
+    project.initialize(init_structure=False)
+    tmpdir.join('sample_1.fastq').write('')
+    project.add_dataset(str(tmpdir), 'sample',
+                        str(tmpdir.join('sample_1.fastq')),
+                        {'type': 'fastq', 'view': 'FqRd1'}, link=False)
+    project.save()
+    outputs = split_features(StringIO(GTF), str(tmpdir.join('sample')))
+    assert update_index(outputs, 'sample', str(tmpdir))
+    # updating the files again keeps a single entry per file
+    assert update_index(outputs, 'sample', str(tmpdir))
+    project = Project(str(tmpdir))
+    project.load()
+    dataset = project.index.datasets['sample']
+    assert len(dataset.fastq) == 1
+    assert len(dataset.gtf) == 4
+    info = dataset.gtf[str(tmpdir.join('sample.intron.gtf'))]
+    assert info['lines'] == '0'
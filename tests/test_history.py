@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#
+# test the job history
+#
+from grape.history import History, _fit, chain_tool
+from grape.resources import ResourcePlanner, GB
+
+
+def _run(key, tool, input_bytes, wall, cpu=None, rss=None, threads=1):
+    return {'key': key, 'tool': tool, 'input_bytes': input_bytes,
+            'wall': wall, 'cpu': cpu, 'rss': rss, 'threads': threads}
+
+
+def test_record_and_summary(tmpdir):
+    history = History(str(tmpdir.join('.grape', 'history.db')))
+    runs = [_run('a', 'grape_flux', 100, 10.0, cpu=8.0, rss=2048),
+            _run('b', 'grape_flux', 300, 30.0, cpu=24.0, rss=4096),
+            _run('c', 'grape_gem_rnatool', 1000, 5.0)]
+    assert history.record(runs) == 3
+    # runs are recorded only once
+    assert history.record(runs[:1]) == 0
+    assert len(history.runs('grape_flux')) == 2
+    summary = dict((s['tool'], s) for s in history.summary())
+    flux = summary['grape_flux']
+    assert flux['runs'] == 2
+    assert flux['wall'] == 20.0
+    assert flux['rss'] == 4096
+    assert flux['input_bytes'] == 400
+    assert flux['throughput'] == 10.0
+    assert summary['grape_gem_rnatool']['cpu'] is None
+
+
+def test_fit():
+    assert _fit([(1, 3), (2, 5), (3, 7)]) == (1.0, 2.0)
+    assert _fit([(1, 5), (2, 5), (3, 1)]) == (5, 0.0)
+
+
+def test_planner_uses_history(tmpdir):
+    history = History(str(tmpdir.join('history.db')))
+    history.record([_run(str(i), 'grape_flux', i * GB, 60.0 * i,
+                         cpu=60.0 * i, rss=1024 * 1024 * i)
+                    for i in range(1, 4)])
+    model = history.model('grape_flux')
+    assert model['rss'][1] > 0
+    assert history.model('grape_gem_rnatool') is None
+    planner = ResourcePlanner(profiles={}, history=[history])
+    plan = planner.plan('grape_flux', 10 * GB)
+    assert plan['max_memory'] == int(1.2 * 10 * 1024)
+    assert plan['max_time'] == int(1.2 * 10) + 1
+
+
+class _Job(object):
+    def __init__(self, tool_name, inputs=None, pipe_to=None):
+        self.tool_name = tool_name
+        self.inputs = inputs or []
+        self.pipe_to = pipe_to or []
+        self.pipe_from = []
+        self.dependencies = []
+
+    def get_input_files(self):
+        return self.inputs
+
+
+def test_planner_uses_chain_history(tmpdir):
+    reads = str(tmpdir.join('reads.map.gz'))
+    sort = _Job('grape_samtools_sort')
+    head = _Job('grape_pigz', inputs=[reads], pipe_to=[sort])
+    sort.pipe_from.append(head)
+    assert chain_tool(head) == 'grape_pigz|grape_samtools_sort'
+    history = History(str(tmpdir.join('history.db')))
+    history.record([_run(str(i), chain_tool(head), i * GB, 60.0 * i,
+                         cpu=120.0 * i, rss=1024 * 1024 * i, threads=2)
+                    for i in range(1, 4)])
+    planner = ResourcePlanner(profiles={}, history=[history],
+                              sizes={reads: 10 * GB})
+    plan = planner.plan_job(head)
+    assert plan['threads'] == 2
+    # the chain memory is reserved per thread
+    assert plan['max_memory'] == int(1.2 * 10 * 1024) / 2
+    assert plan['max_time'] == int(1.2 * 10) + 1
+    # the recorded peak memory does not lower the sum of the tools memory
+    planner = ResourcePlanner(profiles={'grape_pigz': {'memory': 10000},
+                                        'grape_samtools_sort':
+                                        {'memory': 20000}},
+                              history=[history], sizes={reads: 10 * GB})
+    plan = planner.plan_job(head)
+    assert plan['max_memory'] == 30000 / 2
+    assert plan['max_time'] == int(1.2 * 10) + 1
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+#
+# test the job summaries
+#
+import jip
+from jip.db import Job
+from grape.jobs import job_dataset, summary, totals, states, version, \
+    select, related, load, cancel, restart, delete, deferred, defer
+
+
+def test_job_dataset():
+    assert job_dataset('gem.mapfilter.a.b', 'grape_gem_mapfilter') == 'a.b'
+    assert job_dataset('gem.sam.a', 'grape_gem_sam') == 'a'
+    assert job_dataset('gem.matches.a', 'grape_gem_filter') == 'a'
+    assert job_dataset('unpigz.a', 'grape_pigz') == 'a'
+    assert job_dataset('gem.a', 'grape_gem_rnatool') == 'a'
+    assert job_dataset('index.genome', 'grape_gem_index') is None
+    assert job_dataset('delete.a.map.gz', 'grape_retention') is None
+    assert job_dataset('other', 'grape_flux') is None
+
+
+def test_summary(tmpdir):
+    path = str(tmpdir.join('jip.db'))
+    assert summary(path) == {}
+    assert version(path) is None
+
+    jip.db.init(path)
+    jobs = []
+    for name, tool, state in [
+            ('index.genome', 'grape_gem_index', 'Done'),
+            ('gem.a', 'grape_gem_rnatool', 'Done'),
+            ('gem.sam.a', 'grape_gem_sam', 'Failed'),
+            ('gem.b', 'grape_gem_rnatool', 'Running'),
+            ('gem.sam.b', 'grape_gem_sam', 'Hold')]:
+        job = Job()
+        job.name = name
+        job.tool_name = tool
+        job.state = state
+        jobs.append(job)
+    jip.db.save(jobs)
+    assert version(path) is not None
+
+    counts = summary(path)
+    assert counts == {'grape_gem_index': {'Done': 1},
+                      'grape_gem_rnatool': {'Done': 1, 'Running': 1},
+                      'grape_gem_sam': {'Failed': 1, 'Hold': 1}}
+    assert totals(counts) == {'Done': 2, 'Running': 1, 'Failed': 1,
+                              'Hold': 1}
+    assert states(counts) == ['Hold', 'Running', 'Done', 'Failed']
+
+    assert summary(path, by='dataset') == {
+        None: {'Done': 1},
+        'a': {'Done': 1, 'Failed': 1},
+        'b': {'Running': 1, 'Hold': 1}}
+    assert summary(path, by='dataset', datasets=['b'],
+                   states=['Hold', 'Done']) == {'b': {'Hold': 1}}
+    assert summary(path, states=['Failed']) == {
+        'grape_gem_sam': {'Failed': 1}}
+
+
+class _Cluster(object):
+    def __init__(self):
+        self.canceled = []
+        self.forgotten = []
+
+    def cancel_jobs(self, jobs):
+        self.canceled.extend(j.job_id for j in jobs)
+
+    def forget_jobs(self, jobs):
+        self.forgotten.extend(j.job_id for j in jobs)
+
+    def resolve_log(self, job, path):
+        return path
+
+
+def test_update(tmpdir):
+    path = str(tmpdir.join('jip.db'))
+    jip.db.init(path)
+    gem = Job()
+    gem.name = 'gem.a'
+    gem.tool_name = 'grape_gem_rnatool'
+    gem.state = 'Queued'
+    gem.job_id = '1'
+    gem.stdout = str(tmpdir.join('gem.out'))
+    flux = Job()
+    flux.name = 'flux.a'
+    flux.tool_name = 'grape_flux'
+    flux.state = 'Hold'
+    flux.dependencies.append(gem)
+    other = Job()
+    other.name = 'gem.b'
+    other.tool_name = 'grape_gem_rnatool'
+    other.state = 'Done'
+    jip.db.save([gem, flux, other])
+
+    ids = select(path, states=['Queued'])
+    assert ids == [gem.id]
+    assert related(path, ids) == [gem.id, flux.id]
+    ids = related(path, ids)
+
+    cluster = _Cluster()
+    assert len(cancel(load(ids), cluster=cluster)) == 2
+    assert cluster.canceled == ['1']
+    assert summary(path, by='dataset') == {'a': {'Canceled': 2},
+                                           'b': {'Done': 1}}
+
+    assert len(restart(load(ids), cluster=cluster)) == 2
+    assert cluster.canceled == ['1']
+    assert cluster.forgotten == ['1']
+    assert summary(path, by='dataset') == {'a': {'Hold': 2},
+                                           'b': {'Done': 1}}
+    # the restarted jobs are submitted by grape submit --continue
+    assert deferred(path) == sorted(ids)
+
+    tmpdir.join('gem.out').write('')
+    delete(load(ids), cluster=cluster)
+    assert not tmpdir.join('gem.out').exists()
+    assert select(path) == [other.id]
+    assert deferred(path) == []
+
+
+def test_defer(tmpdir):
+    path = str(tmpdir.join('jip.db'))
+    assert deferred(path) == []
+    jip.db.init(path)
+    jip.db.save([Job()])
+    defer(path, [3, 1, 3])
+    assert deferred(path) == [1, 3]
+    defer(path, [3], False)
+    assert deferred(path) == [1]
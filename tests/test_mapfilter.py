@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+#
+# test the streaming map filter
+#
+import gzip
+from StringIO import StringIO
+from grape.mapfilter import edit_distance, mapping_distance, filter_line, \
+    gzip_block, BlockGzipWriter, run
+
+
+def test_edit_distance():
+    assert edit_distance('76') == 0
+    assert edit_distance('10A65') == 1
+    assert edit_distance('10A30>2+20C12') == 4
+    assert edit_distance('(5)30>1000*41') == 0
+
+
+def test_mapping_distance():
+    assert mapping_distance('chr1:+:100:10A65') == 1
+    assert mapping_distance('chr1:+:100:10A65::chr1:-:300:T75') == 2
+    assert mapping_distance('chr1:+:100:10A65:::255') == 1
+
+
+def test_filter_line():
+    line = 'r1\tACGT\tIIII\t1:1:1\tchr1:+:1:4,chr1:+:9:A3,chr2:-:5:AC2'
+    assert filter_line(line, max_error=1) == \
+        'r1\tACGT\tIIII\t1:1\tchr1:+:1:4,chr1:+:9:A3'
+    assert filter_line(line, max_error=1, max_matches=1) == \
+        'r1\tACGT\tIIII\t0\t-'
+    assert filter_line(line) == 'r1\tACGT\tIIII\t1:1:1\t' \
+        'chr1:+:1:4,chr1:+:9:A3,chr2:-:5:AC2'
+    unmapped = 'r2\tACGT\tIIII\t0\t-'
+    assert filter_line(unmapped, max_error=0) == unmapped
+
+
+def test_block_gzip():
+    assert gzip.GzipFile(fileobj=StringIO(gzip_block('abc' * 10))).read() \
+        == 'abc' * 10
+    out = StringIO()
+    writer = BlockGzipWriter(out, threads=2, block_size=16)
+    data = ''.join('line %d\n' % i for i in range(1000))
+    for i in range(0, len(data), 10):
+        writer.write(data[i:i + 10])
+    writer.close()
+    assert gzip.GzipFile(fileobj=StringIO(out.getvalue())).read() == data
+
+
+def test_run():
+    lines = ['r%d\tA\tI\t1\tchr1:+:%d:A' % (i, i) for i in range(100)]
+    out = StringIO()
+    run(StringIO('\n'.join(lines) + '\n'), out, max_error=0, compress=True)
+    result = gzip.GzipFile(fileobj=StringIO(out.getvalue())).read()
+    assert result == ''.join('r%d\tA\tI\t0\t-\n' % i for i in range(100))
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+#
+# test the mapping statistics
+#
+from StringIO import StringIO
+from grape.grape import Project
+from grape.mapstats import map_stats, encode_multimaps, decode_multimaps, \
+    update_index, report
+
+MAP = "r1\tACGT\tIIII\t1\tchr1:+:1:4\n" \
+      "r2\tACGT\tIIII\t0:2\tchr1:+:1:2>100*2,chr2:-:5:4\n" \
+      "r3\tACGT\tIIII\t0\t-\n" \
+      "r4\tACGT\tIIII\t1\tchr1:+:1:1>50*3\n"
+
+
+def test_map_stats():
+    stats = map_stats(StringIO(MAP), max_multimaps=2)
+    assert stats == {'reads': 4, 'mapped': 3, 'unique': 2, 'split': 2,
+                     'multimaps': {1: 2, 2: 1}}
+
+
+def test_multimaps_encoding():
+    assert encode_multimaps({1: 10, 10: 2, 2: 3}) == '1:10,2:3,10:2'
+    assert decode_multimaps('1:10,2:3,10:2') == {1: 10, 10: 2, 2: 3}
+    assert decode_multimaps(None) == {}
+    assert decode_multimaps('NA') == {}
+
+
+def test_report(tmpdir):
+    project = Project(str(tmpdir))
+    project.initialize(init_structure=False)
+    for name in ['a', 'b']:
+        output = str(tmpdir.join('%s.mapstats.json' % name))
+        tmpdir.join('%s.mapstats.json' % name).write('{}')
+        assert update_index(map_stats(StringIO(MAP)), output, name)
+    # the statistics of a dataset already in the index are updated
+    tmpdir.join('c_1.fastq').write('')
+    project.load()
+    project.add_dataset(str(tmpdir), 'c', str(tmpdir.join('c_1.fastq')),
+                        {'type': 'fastq', 'view': 'FqRd1'}, link=False)
+    project.save()
+    output = str(tmpdir.join('c.mapstats.json'))
+    assert update_index(map_stats(StringIO(MAP)), output, 'c')
+    assert update_index(map_stats(StringIO(MAP.split('\n')[2])), output, 'c')
+    project = Project(str(tmpdir))
+    project.load()
+    summary, total = report(project.index.datasets.values())
+    assert [s['id'] for s in summary] == ['a', 'b', 'c']
+    assert summary[2]['mapped'] == 0
+    assert len(project.index.datasets['c'].fastq) == 1
+    assert summary[0]['multimaps'] == {1: 2, 2: 1}
+    assert total['reads'] == 9
+    assert total['split'] == 4
+    assert total['multimaps'] == {1: 4, 2: 2}
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+#
+# test the binary expression matrix format
+#
+import numpy
+import pytest
+from grape.matrix import MatrixFile, MatrixWriter, write_matrix
+
+
+def test_write_and_read(tmpdir):
+    path = str(tmpdir.join('expression.mtx'))
+    data = numpy.array([[1.5, 3.0], [0.25, 0.0], [0.0, 2.0]])
+    write_matrix(path, ['t1', 't2', 't3'], ['a', 'b'], data)
+    matrix = MatrixFile(path)
+    assert matrix.shape == (3, 2)
+    assert matrix.transcripts == ['t1', 't2', 't3']
+    assert matrix.samples == ['a', 'b']
+    assert isinstance(matrix.data, numpy.memmap)
+    assert matrix.data.tolist() == data.tolist()
+    assert matrix.sample('b').tolist() == [3.0, 0.0, 2.0]
+    assert matrix.sample('b').flags['C_CONTIGUOUS']
+    assert matrix.transcript('t2').tolist() == [0.25, 0.0]
+
+
+def test_writer_columns(tmpdir):
+    path = str(tmpdir.join('expression.mtx'))
+    writer = MatrixWriter(path, ['t1', 't2', 't3'], ['a', 'b'])
+    writer.set_column(0, ['t3', 't1'], [1.0, 2.0])
+    writer.set_column(1, [], [])
+    with pytest.raises(ValueError):
+        writer.set_column(1, ['t4'], [1.0])
+    writer.close()
+    assert tmpdir.listdir() == [tmpdir.join('expression.mtx')]
+    matrix = MatrixFile(path)
+    assert matrix.data.tolist() == [[2.0, 0.0], [0.0, 0.0], [1.0, 0.0]]
+
+
+def test_empty_and_invalid(tmpdir):
+    path = str(tmpdir.join('empty.mtx'))
+    write_matrix(path, [], [], None)
+    assert MatrixFile(path).shape == (0, 0)
+    invalid = tmpdir.join('invalid.mtx')
+    invalid.write('x' * 100)
+    with pytest.raises(ValueError):
+        MatrixFile(str(invalid))
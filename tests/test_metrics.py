@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#
+# test the pipeline metrics
+#
+import datetime
+import jip
+from jip.db import Job
+from grape.grape import Project
+from grape.history import History
+from grape.metrics import Metric, render, job_metrics, run_metrics, \
+    collect, update_textfile
+
+
+def _samples(metrics):
+    return dict(((name, tuple(sorted(labels.items()))), value)
+                for m in metrics for name, labels, value in m.samples)
+
+
+def test_render():
+    metric = Metric('grape_jobs', 'gauge', "Number of jobs")
+    metric.add(3, state='Done', project='a "b"')
+    metric.add(0.5, '_sum')
+    assert render([metric]) == \
+        '# HELP grape_jobs Number of jobs\n' \
+        '# TYPE grape_jobs gauge\n' \
+        'grape_jobs{project="a \\"b\\"",state="Done"} 3\n' \
+        'grape_jobs_sum 0.5\n'
+
+
+def _jobs():
+    created = datetime.datetime(2015, 1, 1, 10, 0, 0)
+    jobs = []
+    for i, state in enumerate(['Done', 'Done', 'Running', 'Queued']):
+        job = Job()
+        job.tool_name = 'grape_flux'
+        job.state = state
+        job.create_date = created
+        if state != 'Queued':
+            job.start_date = created + datetime.timedelta(seconds=10 * i)
+        if state == 'Done':
+            job.finish_date = job.start_date + datetime.timedelta(
+                seconds=60)
+        jobs.append(job)
+    return jobs
+
+
+def _check_job_samples(samples):
+    assert samples[('grape_jobs', (('state', 'Done'),))] == 2
+    assert samples[('grape_jobs', (('state', 'Queued'),))] == 1
+    assert samples[('grape_jobs', (('state', 'Failed'),))] == 0
+    tool = (('tool', 'grape_flux'),)
+    assert samples[('grape_job_duration_seconds_count', tool)] == 2
+    assert abs(samples[('grape_job_duration_seconds_sum', tool)] -
+               120) < 0.01
+    assert samples[('grape_job_queue_wait_seconds_count', tool)] == 3
+    assert abs(samples[('grape_job_queue_wait_seconds_sum', tool)] -
+               30) < 0.01
+
+
+def test_job_metrics(tmpdir):
+    assert _samples(job_metrics(str(tmpdir.join('missing.db'))))[
+        ('grape_jobs', (('state', 'Done'),))] == 0
+
+    jip.db.init(str(tmpdir.join('jip.db')))
+    jip.db.save(_jobs())
+    _check_job_samples(_samples(job_metrics(str(tmpdir.join('jip.db')))))
+
+
+def test_run_metrics():
+    _check_job_samples(_samples(run_metrics(_jobs())))
+
+
+def test_collect(tmpdir, monkeypatch):
+    project = Project(str(tmpdir))
+    project.initialize(init_structure=False)
+    tmpdir.join('a_1.fastq').write('')
+    project.add_dataset(str(tmpdir), 'a', str(tmpdir.join('a_1.fastq')),
+                        {'type': 'fastq', 'view': 'FqRd1'}, link=False)
+    project.save()
+    project.load()
+    history = History(project.history_db)
+    history.record([{'key': '1', 'tool': 'grape_flux', 'wall': 10,
+                     'input_bytes': 100, 'output_bytes': 5}])
+    history.close()
+
+    samples = _samples(collect(project))
+    labels = (('project', tmpdir.basename),)
+    assert samples[('grape_index_datasets', labels)] == 1
+    assert samples[('grape_index_files', labels)] == 1
+    assert samples[('grape_index_bytes', labels)] > 0
+    tool = (('project', tmpdir.basename), ('tool', 'grape_flux'))
+    assert samples[('grape_tool_input_bytes_total', tool)] == 100
+    assert samples[('grape_tool_output_bytes_total', tool)] == 5
+
+    monkeypatch.delenv('GRAPE_METRICS_DIR', raising=False)
+    assert update_textfile(project) is None
+    monkeypatch.setenv('GRAPE_METRICS_DIR', str(tmpdir.join('metrics')))
+    path = update_textfile(project)
+    assert path == str(tmpdir.join('metrics',
+                                   'grape_%s.prom' % tmpdir.basename))
+    assert 'grape_index_datasets{project="%s"} 1\n' % tmpdir.basename in \
+        open(path).read()
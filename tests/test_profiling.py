@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+#
+# test the command profiling
+#
+import json
+import pytest
+from grape.profiling import Profiler, get_mode
+
+
+def test_get_mode():
+    assert get_mode(None) is None
+    assert get_mode('0') is None
+    assert get_mode('1') == 'timers'
+    assert get_mode('cprofile') == 'cprofile'
+    with pytest.raises(ValueError):
+        get_mode('other')
+
+
+def test_disabled_profiler():
+    profiler = Profiler()
+    with profiler.phase('run'):
+        pass
+    assert profiler.phases == {}
+
+
+def test_phases(tmpdir):
+    profiler = Profiler('timers')
+    profiler.start()
+    with profiler.phase('submit'):
+        for i in range(2):
+            with profiler.phase('scheduler'):
+                pass
+    profiler.stop()
+    report = profiler.report()
+    assert [(p['phase'], p['calls']) for p in report['phases']] == [
+        ('submit', 1), ('submit;scheduler', 2)]
+    submit = report['phases'][0]
+    assert submit['self_seconds'] <= submit['seconds']
+    assert [l.split()[0] for l in profiler.folded()] == [
+        'submit', 'submit;scheduler']
+
+    path = profiler.write(str(tmpdir), 'submit')
+    assert json.load(open(path))['phases'] == report['phases']
+    assert tmpdir.join(path[len(str(tmpdir)) + 1:-5] + '.folded').check()
+
+
+def test_cprofile(tmpdir):
+    profiler = Profiler('cprofile')
+    profiler.start()
+    with profiler.phase('run'):
+        sum(range(100))
+    profiler.stop()
+    path = profiler.write(str(tmpdir), 'run')
+    assert tmpdir.join(path[len(str(tmpdir)) + 1:-5] + '.prof').check()
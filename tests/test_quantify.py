@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+#
+# test the expression matrix builder
+#
+import os
+from StringIO import StringIO
+from grape.grape import Project
+from grape.quantify import attribute, parse_transcripts, build_matrix
+
+
+def _gtf(path, values):
+    with open(path, 'w') as f:
+        for tid, rpkm in values:
+            f.write('chr1\tflux\ttranscript\t1\t100\t.\t+\t.\t'
+                    'gene_id "g1"; transcript_id "%s"; reads 10.000000; '
+                    'length 100; RPKM %s\n' % (tid, rpkm))
+        f.write('chr1\tflux\tjunction\t1\t100\t.\t+\t.\tgene_id "g1";\n')
+
+
+def test_attribute():
+    attrs = 'gene_id "g1"; transcript_id "t1"; reads 3.5; RPKM 1.2'
+    assert attribute(attrs, 'transcript_id') == 't1'
+    assert attribute(attrs, 'reads') == '3.5'
+    assert attribute(attrs, 'RPKM') == '1.2'
+    assert attribute(attrs, 'id') is None
+
+
+def test_parse_transcripts(tmpdir):
+    path = str(tmpdir.join('a.transcript.gtf'))
+    _gtf(path, [('t1', '1.5'), ('t2', '0.25')])
+    assert parse_transcripts(path) == (['t1', 't2'], [1.5, 0.25])
+    assert parse_transcripts(path, 'reads') == (['t1', 't2'], [10.0, 10.0])
+
+
+def test_build_matrix(tmpdir):
+    project = Project(str(tmpdir))
+    project.initialize(init_structure=False)
+    a = str(tmpdir.join('a.transcript.gtf'))
+    b = str(tmpdir.join('b.transcript.gtf'))
+    _gtf(a, [('t1', '1.5'), ('t2', '0.25')])
+    _gtf(b, [('t3', '2'), ('t1', '3')])
+    project.index.insert(id='a', type='gtf', path=a, view='transcript')
+    project.index.insert(id='b', type='gtf', path=b, view='transcript')
+    project.index.insert(id='c', type='fastq', path='c_1.fastq')
+    datasets = project.index.datasets.values()
+    missing = []
+    matrix = build_matrix(project, datasets, log=missing.append)
+    assert missing == ['No transcript file found for c']
+    assert matrix.samples == ['a', 'b']
+    assert matrix.transcripts == ['t1', 't2', 't3']
+    assert matrix.data.tolist() == [[1.5, 3.0], [0.25, 0.0], [0.0, 2.0]]
+    assert matrix.data.flags['F_CONTIGUOUS']
+    out = StringIO()
+    matrix.write_tsv(out)
+    assert out.getvalue().split('\n')[:2] == ['transcript_id\ta\tb',
+                                              't1\t1.5\t3']
+    # second run uses the cache
+    assert os.path.exists(str(tmpdir.join('.grape', 'quantify', 'a.RPKM.npz')))
+    cached = build_matrix(project, datasets)
+    assert cached.data.tolist() == matrix.data.tolist()
+
+
+def test_build_matrix_file(tmpdir):
+    from grape.quantify import build_matrix_file
+    from grape.matrix import MatrixFile
+    project = Project(str(tmpdir))
+    project.initialize(init_structure=False)
+    a = str(tmpdir.join('a.transcript.gtf'))
+    b = str(tmpdir.join('b.transcript.gtf'))
+    _gtf(a, [('t1', '1.5'), ('t2', '0.25')])
+    _gtf(b, [('t3', '2'), ('t1', '3')])
+    project.index.insert(id='a', type='gtf', path=a, view='transcript')
+    project.index.insert(id='b', type='gtf', path=b, view='transcript')
+    path = str(tmpdir.join('expression.mtx'))
+    assert build_matrix_file(path, project,
+                             project.index.datasets.values()) == (3, 2)
+    matrix = MatrixFile(path)
+    assert matrix.samples == ['a', 'b']
+    assert matrix.sample('a').tolist() == [1.5, 0.25, 0.0]
+
+
+def test_build_matrix_file_no_cache(tmpdir):
+    from grape.quantify import build_matrix_file
+    from grape.matrix import MatrixFile
+    project = Project(str(tmpdir))
+    project.initialize(init_structure=False)
+    a = str(tmpdir.join('a.transcript.gtf'))
+    _gtf(a, [('t1', '1.5'), ('t2', '0.25')])
+    project.index.insert(id='a', type='gtf', path=a, view='transcript')
+    path = str(tmpdir.join('expression.mtx'))
+    assert build_matrix_file(path, project, project.index.datasets.values(),
+                             cache=False) == (2, 1)
+    assert MatrixFile(path).sample('a').tolist() == [1.5, 0.25]
+    assert not os.path.exists(str(tmpdir.join('.grape', 'quantify')))
+
+
+def test_build_matrix_file_changed(tmpdir, monkeypatch):
+    import pytest
+    import grape.quantify
+    from grape.quantify import build_matrix_file
+    project = Project(str(tmpdir))
+    project.initialize(init_structure=False)
+    a = str(tmpdir.join('a.transcript.gtf'))
+    b = str(tmpdir.join('b.transcript.gtf'))
+    _gtf(a, [('t1', '1.5')])
+    _gtf(b, [('t1', '3')])
+    project.index.insert(id='a', type='gtf', path=a, view='transcript')
+    project.index.insert(id='b', type='gtf', path=b, view='transcript')
+    path = str(tmpdir.join('expression.mtx'))
+    read = grape.quantify._read_sample
+    calls = []
+
+    def read_and_change(samples, sample, source, value, cache):
+        calls.append(sample)
+        if len(calls) == 3:
+            # both samples were read once, b changes before the second pass
+            _gtf(b, [('t1', '3'), ('t9', '1')])
+        return read(samples, sample, source, value, cache)
+
+    monkeypatch.setattr(grape.quantify, '_read_sample', read_and_change)
+    with pytest.raises(ValueError) as e:
+        build_matrix_file(path, project, project.index.datasets.values())
+    assert 'b.transcript.gtf' in str(e.value)
+    assert 't9' in str(e.value)
+    assert calls == ['a', 'b', 'a', 'b']
+    assert tmpdir.listdir('expression.mtx*') == []
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+#
+# test resource planning
+#
+from grape.resources import ResourcePlanner, GB, sort_memory, configure_sort, \
+    split_threads
+
+
+class _Option(object):
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+class _Tool(object):
+    def __init__(self, threads):
+        self.options = {'threads': _Option(threads)}
+
+
+class _Job(object):
+    def __init__(self, tool_name, inputs=None, dependencies=None,
+                 threads=None):
+        self.tool_name = tool_name
+        self.inputs = inputs or []
+        self.dependencies = dependencies or []
+        self.pipe_from = []
+        self.pipe_to = []
+        if threads:
+            self.tool = _Tool(threads)
+
+    def get_input_files(self):
+        return self.inputs
+
+
+PROFILES = {
+    "default": {"threads": 1, "max_threads": 1, "memory": 1024,
+                "time": 60, "time_per_gb": 0, "output_ratio": 1.0},
+    "mapper": {"max_threads": 8, "gb_per_thread": 1, "memory_per_gb": 1024,
+               "time_per_gb": 120, "output_ratio": 2.0},
+    "sort": {"memory_per_gb": 512},
+}
+
+
+def test_plan_from_size():
+    planner = ResourcePlanner(profiles=PROFILES)
+    small = planner.plan('mapper', 0.5 * GB)
+    assert small == {'threads': 1, 'max_memory': 1536, 'max_time': 121}
+    large = planner.plan('mapper', 20 * GB)
+    assert large['threads'] == 8
+    assert large['max_memory'] == 1024 + 20 * 1024
+    assert large['max_time'] == 60 + 300 + 1
+    assert planner.plan('unknown', 20 * GB) == {'threads': 1,
+                                                'max_memory': 1024,
+                                                'max_time': 61}
+
+
+def test_input_bytes_estimate(tmpdir):
+    fastq = tmpdir.join('reads.fastq')
+    fastq.write('x' * 1024)
+    mapper = _Job('mapper', inputs=[str(fastq)])
+    sort = _Job('sort', inputs=[str(tmpdir.join('reads.map'))],
+                dependencies=[mapper])
+    planner = ResourcePlanner(profiles=PROFILES)
+    assert planner.input_bytes(mapper) == 1024
+    assert planner.input_bytes(sort) == 2048
+    planner = ResourcePlanner(profiles=PROFILES, sizes={str(fastq): 4 * GB})
+    assert planner.input_bytes(sort) == 8 * GB
+    assert planner.plan_job(sort)['max_memory'] == 1024 + 8 * 512
+
+
+def test_plan_pipe_chain():
+    mapper = _Job('mapper')
+    sort = _Job('sort')
+    mapper.pipe_to.append(sort)
+    sort.pipe_from.append(mapper)
+    planner = ResourcePlanner(profiles=PROFILES)
+    # the chain memory is reserved per thread
+    assert planner.plan_job(mapper) == {'threads': 2, 'max_memory': 1024,
+                                        'max_time': 61}
+
+
+def test_plan_pipe_chain_threads():
+    # the head of the chain reserves the threads of all the stages
+    chain = [_Job('pigz', threads=1), _Job('sam', threads=4),
+             _Job('view', threads=1), _Job('sort', threads=2)]
+    for head, child in zip(chain, chain[1:]):
+        head.pipe_to.append(child)
+        child.pipe_from.append(head)
+    planner = ResourcePlanner(profiles=PROFILES)
+    assert planner.plan_job(chain[0])['threads'] == 8
+    assert planner.plan_job(chain[-1])['threads'] == 2
+
+
+def test_sort_memory():
+    assert sort_memory(8192, 4) == 1536
+    assert sort_memory(8192, None) == 6144
+    assert sort_memory(256, 8) == 128
+
+
+class _Option(object):
+    def __init__(self, value=None):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+class _SortTool(object):
+    def __init__(self, memory=None):
+        self.options = {'max_memory': _Option(memory),
+                        'threads': _Option(2)}
+
+    def get_command(self):
+        return 'bash', 'sort -m %s' % self.options['max_memory'].get()
+
+
+def test_configure_sort():
+    job = _Job('grape_samtools_sort')
+    job.tool = _SortTool()
+    job.threads = 1
+    job.max_memory = 4096
+    job.command = 'sort'
+    assert configure_sort(job)
+    assert job.command == 'sort -m 1536M'
+    # the job memory is per thread
+    job.tool = _SortTool()
+    job.threads = 2
+    job.max_memory = 2048
+    assert configure_sort(job)
+    assert job.command == 'sort -m 1536M'
+    job.tool = _SortTool('2G')
+    assert not configure_sort(job)
+    other = _Job('grape_flux')
+    other.max_memory = 4096
+    assert not configure_sort(other)
+
+
+def test_split_threads():
+    profiles = {
+        "default": {"thread_weight": 1},
+        "decompress": {"thread_weight": 1},
+        "convert": {"thread_weight": 4},
+        "view": {"thread_weight": 0},
+        "sort": {"thread_weight": 2},
+    }
+    names = ['decompress', 'convert', 'view', 'sort']
+    assert split_threads(1, names, profiles) == [1, 1, 1, 1]
+    assert split_threads(8, names, profiles) == [1, 4, 1, 2]
+    assert split_threads(16, names, profiles) == [2, 9, 1, 4]
+    assert split_threads(4, ['unknown', 'sort'], profiles) == [1, 3]
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#
+# test the intermediate file retention
+#
+import pytest
+from grape.retention import parse_policies, archive_path, apply, \
+    is_applied, main
+from grape.grapeindex import add_files
+from grape.grape import Project
+
+
+def test_parse_policies():
+    assert parse_policies(None) == {}
+    assert parse_policies("map=keep, filtered_map=archive") == {
+        'map': 'keep',
+        'filtered_map': 'archive',
+    }
+    with pytest.raises(ValueError):
+        parse_policies("map=remove")
+    with pytest.raises(ValueError):
+        parse_policies("map")
+
+
+def test_archive_path():
+    assert archive_path('/p/data/s.map.gz', '/p') == '/p/archive/data/s.map.gz'
+    assert archive_path('/q/s.map.gz', '/p') == '/q/archive/s.map.gz'
+    assert archive_path('/q/s.map.gz') == '/q/archive/s.map.gz'
+
+
+def test_apply_delete(tmpdir):
+    path = str(tmpdir.join('s.map.gz'))
+    tmpdir.join('s.map.gz').write('map')
+    assert not is_applied([path], 'delete')
+    assert apply([path, str(tmpdir.join('missing'))], 'delete') == {
+        path: None}
+    assert not tmpdir.join('s.map.gz').check()
+    assert is_applied([path], 'delete')
+
+
+def test_apply_archive(tmpdir):
+    tmpdir.mkdir('data').join('s.map.gz').write('map')
+    path = str(tmpdir.join('data', 's.map.gz'))
+    target = str(tmpdir.join('archive', 'data', 's.map.gz'))
+    assert apply([path], 'archive', str(tmpdir)) == {path: target}
+    assert tmpdir.join('archive', 'data', 's.map.gz').read() == 'map'
+    assert is_applied([path], 'archive', str(tmpdir))
+    assert not is_applied([path], 'archive')
+
+
+def test_apply_keep(tmpdir):
+    tmpdir.join('s.map.gz').write('map')
+    assert apply([str(tmpdir.join('s.map.gz'))], 'keep') == {}
+    assert tmpdir.join('s.map.gz').check()
+
+
+def test_main_update_index(tmpdir):
+    project = Project(str(tmpdir))
+    project.initialize(init_structure=False)
+    tmpdir.join('s.map.gz').write('map')
+    tmpdir.join('s.bam').write('bam')
+    add_files(project, 's', [
+        {'path': str(tmpdir.join('s.map.gz')), 'type': 'map'},
+        {'path': str(tmpdir.join('s.bam')), 'type': 'bam'},
+    ])
+    main(['-f', str(tmpdir.join('s.map.gz')), '-p', 'archive', '-n', 's',
+          '--update-index'])
+    main(['-f', str(tmpdir.join('s.bam')), '-n', 's', '--update-index'])
+    project = Project(str(tmpdir))
+    project.load()
+    dataset = project.index.datasets['s']
+    assert dataset._files['map'].keys() == [
+        str(tmpdir.join('archive', 's.map.gz'))]
+    assert 'bam' not in dataset._files
+
+
+def test_pipeline_keeps_outputs_by_default(tmpdir, monkeypatch):
+    import jip
+    import grape.tools
+    from grape.simulate import install
+    monkeypatch.setenv('GRAPE_HOME', str(tmpdir))
+    install(str(tmpdir))
+    policies = {}
+    for retention in [None, 'map=delete']:
+        p = jip.Pipeline()
+        p.run('grape_gem_rnapipeline', fastq='reads_1.fastq.gz',
+              genome='index.fa', annotation='gencode.gtf', quality='33',
+              max_matches='10', max_mismatches='4', retention=retention)
+        jobs = jip.create_jobs(p, validate=False)
+        policies[retention] = [j.tool.options['policy'].get() for j in jobs
+                               if j.tool_name == 'grape_retention']
+    assert policies[None] == []
+    assert policies['map=delete'] == ['delete']
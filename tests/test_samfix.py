@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+#
+# test the single-end SAM flag fixer
+#
+from StringIO import StringIO
+from grape.samfix import fix_flag, fix_sam
+
+
+def test_fix_flag():
+    assert fix_flag(0) == 0
+    assert fix_flag(16) == 16
+    assert fix_flag(99) == 0
+    assert fix_flag(147) == 16
+    assert fix_flag(1024 | 256 | 73) == 1024 | 256
+
+
+def test_fix_sam():
+    sam = "@HD\tVN:1.0\n" \
+          "r1\t99\tchr1\t100\t255\t76M\t=\t300\t276\tACGT\tIIII\tNH:i:1\n" \
+          "r2\t16\tchr1\t100\t255\t76M\t*\t0\t0\tACGT\tIIII\n" \
+          "r3\t147\tchr1\t300\t255\t76M\t=\t100\t-276\tACGT\tIIII\n"
+    out = StringIO()
+    fix_sam(StringIO(sam), out)
+    assert out.getvalue() == \
+        "@HD\tVN:1.0\n" \
+        "r1\t0\tchr1\t100\t255\t76M\t=\t300\t276\tACGT\tIIII\tNH:i:1\n" \
+        "r2\t16\tchr1\t100\t255\t76M\t*\t0\t0\tACGT\tIIII\n" \
+        "r3\t16\tchr1\t300\t255\t76M\t=\t100\t-276\tACGT\tIIII\n"
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#
+# test the simulated modules
+#
+import os
+import gzip
+from grape.simulate import install, simulate, map_lines, sam_lines, \
+    gtf_lines, BINARIES
+
+
+class _Config(object):
+    runtime = 0
+    reads = 100
+    transcripts = 10
+
+
+def test_map_lines():
+    from grape.mapstats import map_stats
+    from grape.mapfilter import filter_line
+    lines = list(map_lines('sample', 100))
+    assert lines == list(map_lines('sample', 100))
+    stats = map_stats(lines)
+    assert stats['reads'] == 100
+    assert 0 < stats['unique'] < stats['mapped'] < 100
+    assert stats['split'] > 0
+    assert 2 in stats['multimaps']
+    for line in lines:
+        filter_line(line.rstrip('\n'), max_error=0, max_matches=1)
+
+
+def test_sam_lines():
+    from grape.mapstats import map_stats
+    lines = list(map_lines('sample', 100))
+    sam = list(sam_lines(lines, sequence_lengths=True))
+    header = [l for l in sam if l.startswith('@')]
+    records = [l.split('\t') for l in sam if not l.startswith('@')]
+    assert len(header) == 4
+    assert len(records) == 2 * map_stats(lines)['mapped']
+    assert all(len(r) == 11 for r in records)
+
+
+def test_gtf_lines(tmpdir):
+    from grape.fluxsplit import split_features
+    from grape.quantify import parse_transcripts
+    gtf = tmpdir.join('sample.gtf')
+    gtf.write("".join(gtf_lines('sample', 10)))
+    ids, values = parse_transcripts(str(gtf))
+    assert ids == ['T%06d' % i for i in range(10)]
+    outputs = split_features(open(str(gtf)), str(tmpdir.join('sample')))
+    assert dict((f, c) for f, (p, c) in outputs.items()) == {
+        'transcript': 10, 'junction': 10, 'intron': 10}
+
+
+def test_install(tmpdir):
+    folders = install(str(tmpdir), runtime=1, reads=10)
+    assert str(tmpdir.join('modules', 'gemtools', '1.6.2')) in folders
+    for folder in folders:
+        name = os.path.basename(os.path.dirname(folder))
+        for binary in BINARIES[name]:
+            path = os.path.join(folder, 'bin', binary)
+            assert os.access(path, os.X_OK)
+            assert '-r 1.0 -n 10 -t 100 %s "$@"' % binary in open(path).read()
+
+
+def test_simulate_mapping(tmpdir):
+    fastq = tmpdir.join('sample_1.fastq')
+    simulate('gemtools', ['rna-pipeline', '-f', str(fastq), '-q', '33',
+                          '-n', 'sample', '-o', str(tmpdir)], _Config())
+    with gzip.open(str(tmpdir.join('sample.map.gz'))) as f:
+        assert f.readlines() == list(map_lines('sample', 100))
+    assert tmpdir.join('sample.bam.bai').exists()
+    with gzip.open(str(tmpdir.join('sample.bam'))) as f:
+        records = [l.split('\t') for l in f if not l.startswith('@')]
+    positions = [(r[2], int(r[3])) for r in records]
+    assert positions == sorted(positions)
+
+
+def test_simulate_pigz(tmpdir, monkeypatch):
+    import sys
+    plain = tmpdir.join('sample.map')
+    plain.write('a\nb\n')
+    compressed = tmpdir.join('sample.map.gz')
+    with open(str(compressed), 'wb') as out:
+        monkeypatch.setattr(sys, 'stdout', out)
+        simulate('pigz', ['-p', '2', '-c', str(plain)], _Config())
+    with gzip.open(str(compressed)) as f:
+        assert f.read() == 'a\nb\n'
+
+
+def test_simulate_flux(tmpdir):
+    simulate('flux-capacitor', ['-i', 'sample.bam', '-a', 'genes.gtf',
+                                '-o', str(tmpdir.join('sample.gtf'))],
+             _Config())
+    assert len(tmpdir.join('sample.gtf').readlines()) == 30
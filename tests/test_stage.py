@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+#
+# test the scratch staging runner
+#
+import shlex
+from grape.stage import rewrite, run, stage_command, Stage
+
+
+def test_rewrite():
+    folders = {'/data/out': '/scratch/0'}
+    assert rewrite('sort - /data/out/s', folders) == 'sort - /scratch/0/s'
+    assert rewrite('gem -o /data/out -t 1', folders) == \
+        'gem -o /scratch/0 -t 1'
+    assert rewrite('cat /data/output/s', folders) == 'cat /data/output/s'
+
+
+def test_stage_command():
+    command = stage_command("cat 'a b' > /out/c\n", ['/out/c'], '/scratch')
+    args = shlex.split(command)
+    assert args[1:] == ['-m', 'grape.stage', '-o', '/out/c', '-s', '/scratch',
+                        '-c', "cat 'a b' > /out/c"]
+
+
+def test_stage_links_input_files(tmpdir):
+    out = tmpdir.mkdir('out')
+    out.join('in.bam').write('in')
+    out.join('in.bam.bai').write('index')
+    out.join('other.txt').write('other')
+    out.join('res.txt').write('old')
+    stage = Stage([str(out.join('res.txt'))], str(tmpdir.mkdir('scratch')),
+                  inputs=[str(out.join('in.bam')), str(tmpdir.join('x'))])
+    try:
+        scratch = stage.folders[str(out)]
+        assert scratch.startswith(str(tmpdir.join('scratch')))
+        # only the inputs and the files named after them are linked
+        assert sorted(p.basename for p in
+                      out.__class__(scratch).listdir()) == \
+            ['in.bam', 'in.bam.bai']
+        assert stage.command('cat %s/in.bam' % out) == \
+            'cat %s/in.bam' % scratch
+    finally:
+        stage.cleanup()
+    assert tmpdir.join('scratch').listdir() == []
+
+
+def test_run(tmpdir):
+    out = tmpdir.mkdir('out')
+    out.join('in.txt').write('in\n')
+    scratch = tmpdir.mkdir('scratch')
+    command = "cat %(out)s/in.txt > %(out)s/res.txt; " \
+              "mkdir %(out)s/tmp; echo t > %(out)s/tmp/t.txt" % {'out': out}
+    assert run(command, [str(out.join('res.txt'))], str(scratch),
+               [str(out.join('in.txt'))]) == 0
+    assert out.join('res.txt').read() == 'in\n'
+    assert out.join('tmp', 't.txt').read() == 't\n'
+    assert not out.join('in.txt').islink()
+    assert scratch.listdir() == []
+
+
+def test_run_failure(tmpdir):
+    out = tmpdir.mkdir('out')
+    scratch = tmpdir.mkdir('scratch')
+    command = "echo x > %s/res.txt; exit 3" % out
+    assert run(command, [str(out.join('res.txt'))], str(scratch)) == 3
+    assert not out.join('res.txt').check()
+    assert scratch.listdir() == []
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+#
+# test the template cache
+#
+from jinja2 import Environment
+from grape.templates import install, uninstall, Text
+
+
+def _environment():
+    return Environment(variable_start_string='${', variable_end_string='}')
+
+
+def test_cached_templates():
+    env = _environment()
+    cache = install(env)
+    assert install(env) is cache
+    template = env.from_string('${a}-${b|upper}')
+    assert env.from_string('${a}-${b|upper}') is template
+    assert template.render(a=1, b='x') == '1-X'
+    assert template.render(a=2, b='y') == '2-Y'
+    uninstall(env)
+    assert env.from_string('${a}') is not env.from_string('${a}')
+
+
+def test_text():
+    env = _environment()
+    install(env)
+    assert isinstance(env.from_string('/data/genome.gem'), Text)
+    assert env.from_string('/data/genome.gem').render(a=1) == \
+        '/data/genome.gem'
+    # sources that jinja changes are compiled
+    for source in ['{% if a %}x{% endif %}', 'a\n', 'a\r\nb', '{# c #}']:
+        assert not isinstance(env.from_string(source), Text)
+        assert env.from_string(source).render(a=1) == \
+            _environment().from_string(source).render(a=1)
@@ -118,3 +118,32 @@ def test_gem_pipeline_with_output_dir():
     assert len(jobs[2].dependencies) == 2
     assert len(jobs[3].dependencies) == 1
     assert jobs[0].children[0] == jobs[1]
+
+def test_gem_filter_pipeline(tmpdir, monkeypatch):
+    from grape.simulate import install
+    monkeypatch.setenv('GRAPE_HOME', str(tmpdir))
+    install(str(tmpdir))
+    names = {}
+    for fast in [False, True]:
+        p = jip.Pipeline()
+        p.run('grape_gem_filter_p', input='reads.map.gz', max_mismatches='4',
+              max_matches='10', name='reads', fast=fast)
+        jobs = jip.create_jobs(p, validate=False)
+        names[fast] = [(j.name, j.tool_name) for j in jobs]
+        assert jobs[-1].configuration['output'].get().endswith(
+            'reads_m4_n10.map.gz')
+    # the native tools are used by default
+    assert names[False] == [('gem.quality.reads', 'grape_gem_quality'),
+                            ('gem.filter.reads', 'grape_gem_filter'),
+                            ('gem.matches.reads', 'grape_gem_filter'),
+                            ('pigz.reads', 'grape_pigz')]
+    assert names[True] == [('gem.quality.reads', 'grape_gem_quality'),
+                           ('gem.mapfilter.reads', 'grape_gem_mapfilter')]
+
+
+def test_fix_se_needs_no_module():
+    from grape.checkpoint import tool_modules
+    p = jip.Pipeline()
+    p.run('grape_fix_se', input='reads.sam', output='fixed.sam')
+    jobs = jip.create_jobs(p, validate=False)
+    assert tool_modules(jobs[0]) == []